@@ -0,0 +1,13 @@
+"""
+Action plugin of the bitbucket_repo_perm module
+"""
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+from ansible_collections.i2btech.ops.plugins.plugin_utils.bitbucket_action import BitbucketAction
+
+class ActionModule(BitbucketAction):
+    """ Run bitbucket_repo_perm on the controller """
+
+    MODULE_NAME = 'bitbucket_repo_perm'
@@ -0,0 +1,97 @@
+"""
+Documentation fragments of the Bitbucket modules
+"""
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+#
+# class: ModuleDocFragment
+#
+
+class ModuleDocFragment:
+    """
+    Class ModuleDocFragment
+
+    Options accepted by several Bitbucket modules, documented once
+    """
+
+    # credentials, every Bitbucket module
+    DOCUMENTATION = r'''
+options:
+    username:
+        description:
+            - Username used for authentication.
+        type: str
+        required: true
+    password:
+        description:
+            - Password used for authentication.
+        type: str
+        required: true
+'''
+
+    # salted hashes of the secured variables
+    FINGERPRINT = r'''
+options:
+    fingerprint_store:
+        type: str
+        description:
+            - Where to keep a salted hash of the last value written to each secured variable
+            - When the hash of the desired value matches, the secured variable is not updated and the task doesn't report a change
+            - C(local) keeps one file per repository scope under I(fingerprint_path)
+            - C(variable) keeps the hashes in the unsecured variable C(ANSIBLE_SECURED_FINGERPRINTS). The modules never delete it,
+              whatever I(fingerprint_store) is, and it is not planned as a change
+        choices: [ none, local, variable ]
+        default: none
+        required: false
+    fingerprint_path:
+        type: path
+        description:
+            - Directory of the files used when I(fingerprint_store=local)
+            - Defaults to C(~/.ansible/bitbucket/fingerprints)
+        required: false
+    fingerprint_salt:
+        type: str
+        description:
+            - Secret used to salt the hashes, required when I(fingerprint_store) is not C(none)
+            - Changing it makes every secured variable to be updated once
+        required: false
+'''
+
+    # workspace snapshot built by the inventory plugin
+    SNAPSHOT = r'''
+options:
+    snapshot_path:
+        type: path
+        description:
+            - Directory of the workspace snapshot built by the inventory plugin M(i2btech.ops.bitbucket_workspace)
+            - When the snapshot has a fresh entry of the repository, it is read instead of the API
+            - The entry of the repository is dropped once the module changes it
+        required: false
+    snapshot_ttl:
+        type: int
+        description:
+            - Seconds an entry of the snapshot is used since it was read from the API
+        default: 3600
+        required: false
+    snapshot_refresh:
+        type: bool
+        description:
+            - Read the repository from the API and save it again on the snapshot instead of using the saved entry
+        default: false
+        required: false
+'''
+
+    # plans computed in check mode
+    PLAN_FILE = r'''
+options:
+    plan_file:
+        type: path
+        description:
+            - In check mode, file where the plan and the ETags of the responses it was computed from are saved
+            - In a normal run, the saved plan is applied without reading the repository again when it was saved by the same
+              task and the ETags still match, otherwise the plan is ignored and the module reads the current state as usual
+            - The file is removed once the plan was applied. Values of the variables are not saved on it
+        required: false
+'''
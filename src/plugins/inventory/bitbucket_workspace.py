@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+""" bitbucket_workspace inventory plugin """
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = r'''
+---
+name: bitbucket_workspace
+short_description: Repositories of a Bitbucket Cloud workspace
+version_added: "2.2.0"
+description:
+    - Reads every repository of the workspace with its pipeline variables, deployment environments and group permissions
+    - The result is kept on a snapshot on disk that the Bitbucket modules read instead of the API when they get the same I(snapshot_path)
+    - Each repository becomes a host of the group C(bitbucket_repositories)
+    - The configuration file name must end with C(bitbucket.yml) or C(bitbucket.yaml)
+options:
+    plugin:
+        description: Name of the plugin
+        required: true
+        choices: ['i2btech.ops.bitbucket_workspace']
+    url:
+        description: URL of the Bitbucket API
+        type: str
+        default: https://api.bitbucket.org/2.0
+    username:
+        description: Username used for authentication
+        type: str
+        required: true
+        env:
+            - name: BITBUCKET_USER_ID
+    password:
+        description: Password used for authentication
+        type: str
+        required: true
+        env:
+            - name: BITBUCKET_PASSWORD
+    validate_certs:
+        description: Validate the certificate of the API
+        type: bool
+        default: true
+    max_concurrency:
+        description:
+            - Number of requests sent to the API at the same time while the workspace is read
+            - The requests are sent from one thread with asyncio, or from as many threads when the API is reached through a proxy
+        type: int
+        default: 10
+    snapshot_path:
+        description: Directory of the snapshot
+        type: path
+        default: ~/.ansible/bitbucket/snapshot
+    snapshot_ttl:
+        description: Seconds the snapshot is used before it is read again from the API
+        type: int
+        default: 3600
+    snapshot_refresh:
+        description: Read the whole workspace from the API even if the snapshot is still fresh
+        type: bool
+        default: false
+author:
+    - IT I2B (it@i2btech.com)
+'''
+
+EXAMPLES = r'''
+# inventory/bitbucket.yml
+plugin: i2btech.ops.bitbucket_workspace
+username: alice
+snapshot_ttl: 600
+'''
+
+#pylint: disable=wrong-import-position
+from ansible.errors import AnsibleParserError
+from ansible.module_utils._text import to_native
+from ansible.plugins.inventory import BaseInventoryPlugin
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket import BitbucketError, BitbucketHelper
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_async import AsyncBitbucketClient, scan_workspace
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_snapshot import build_snapshot, read_repository
+from ansible_collections.i2btech.ops.plugins.plugin_utils.bitbucket_action import ControllerModule, ModuleExit
+#pylint: disable=wrong-import-position
+
+class InventoryModule(BaseInventoryPlugin):
+    """ Build the inventory from the snapshot of the workspace """
+
+    NAME = 'i2btech.ops.bitbucket_workspace'
+
+    GROUP = 'bitbucket_repositories'
+
+    def verify_file(self, path):
+        return super().verify_file(path) and path.endswith(('bitbucket.yml', 'bitbucket.yaml'))
+
+    def helper(self):
+        """
+        BitbucketHelper configured with the options of the plugin
+        """
+
+        options = dict(
+            (name, self.get_option(name))
+            for name in ('url', 'username', 'password', 'validate_certs', 'max_concurrency',
+                         'snapshot_path', 'snapshot_ttl', 'snapshot_refresh'))
+
+        module = ControllerModule(self.NAME, options, False, BitbucketHelper.bitbucket_argument_spec())
+
+        return BitbucketHelper(module)
+
+    def read_snapshot(self, bitbucket):
+        """
+        Entries of the snapshot, the workspace is read again when the snapshot is not fresh.
+        When only some entries are stale (e.g. a module changed the repository) just those are read again.
+        The repositories are read with the asyncio client unless it can't stand in for the helper.
+        """
+
+        snapshot = bitbucket.snapshot
+        use_async = AsyncBitbucketClient.supports(bitbucket)
+        index = snapshot.load_index()
+        if index is None or self.get_option('snapshot_refresh'):
+            if use_async:
+                return scan_workspace(bitbucket, snapshot)
+            return build_snapshot(bitbucket, snapshot)
+
+        entries = {}
+        stale = []
+        for repository in index['repositories']:
+            entry = snapshot.load(repository)
+            if entry is None:
+                stale.append(repository)
+            else:
+                entries[repository] = entry
+
+        if stale and use_async:
+            entries.update(scan_workspace(bitbucket, snapshot, stale))
+            return entries
+
+        for repository in stale:
+            entry = read_repository(bitbucket, repository)
+            if entry is None:
+                continue
+            snapshot.store(entry)
+            entries[repository] = entry
+
+        return entries
+
+    def parse(self, inventory, loader, path, cache=True):
+        super().parse(inventory, loader, path, cache)
+        self._read_config_data(path)
+
+        try:
+            bitbucket = self.helper()
+            entries = self.read_snapshot(bitbucket)
+        except ModuleExit as exc:
+            raise AnsibleParserError(to_native(exc.result.get('msg'))) from exc
+        except BitbucketError as exc:
+            raise AnsibleParserError(to_native(exc)) from exc
+
+        self.inventory.add_group(self.GROUP)
+        for repository, entry in sorted(entries.items()):
+            self.inventory.add_host(repository, group=self.GROUP)
+            self.inventory.set_variable(repository, 'ansible_connection', 'local')
+            self.inventory.set_variable(repository, 'bitbucket_repository', entry['info'])
+            self.inventory.set_variable(repository, 'bitbucket_variables', [
+                dict(key=var['key'], secured=var.get('secured', False)) for var in entry['variables']])
+            self.inventory.set_variable(repository, 'bitbucket_environments', [
+                dict(name=env['name'], type=env['environment_type']['name'], variables=[var['key'] for var in env['variables']])
+                for env in entry['environments']])
+            self.inventory.set_variable(repository, 'bitbucket_groups', [
+                dict(name=group['name'], perm=group['perm']) for group in entry['groups']])
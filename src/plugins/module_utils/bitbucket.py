@@ -5,11 +5,26 @@ Util class for bitbucket_repo
 from __future__ import (absolute_import, division, print_function)
 __metaclass__ = type
 
+import contextlib
+import http.client
 import json
+import random
+import socket
+import ssl
+import threading
 import time
+from email.utils import parsedate_to_datetime
 from ansible.module_utils._text import to_text
 from ansible.module_utils.basic import env_fallback
-from ansible.module_utils.urls import fetch_url, basic_auth_header
+from ansible.module_utils.urls import basic_auth_header
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_cache import DiskCache, ResponseCache
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_circuit import CircuitBreaker
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_pagination import add_query, paginate
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_plan import ReadRecorder
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_ratelimit import SharedTokenBucket
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_session import BitbucketSession, RequestNotSent
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_snapshot import SnapshotReader, WorkspaceSnapshot
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_trace import RequestTracer
 
 #
 # class: BitbucketHelper
@@ -25,6 +40,90 @@ error_messages = {
     'unknown_error': 'An unknown error happened `{info}',
 }
 
+class BitbucketError(Exception):
+    """
+    Error raised instead of failing the module while a mutation runs in a worker
+    """
+
+def parse_retry_after(value):
+    """
+    Seconds to wait from a Retry-After header, it can be a number of seconds or an HTTP date
+    """
+
+    if not value:
+        return None
+
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    try:
+        return parsedate_to_datetime(value).timestamp() - time.time()
+    except (TypeError, ValueError):
+        return None
+
+def parse_ratelimit_reset(value):
+    """
+    Seconds to wait from a X-RateLimit-Reset header, it can be an epoch timestamp or a number of seconds
+    """
+
+    try:
+        reset = float(value)
+    except (TypeError, ValueError):
+        return None
+
+    # values this big are epoch timestamps
+    if reset > 1000000000:
+        return reset - time.time()
+
+    return reset
+
+def backoff_delay(info, attempt, sleep, max_delay):
+    """
+    Seconds to wait before the attempt after `attempt`.
+    Retry-After and X-RateLimit-* headers sent by Bitbucket are honored, otherwise we use an
+    exponential backoff with jitter based on `sleep`. The wait never goes over `max_delay`.
+    """
+
+    delay = parse_retry_after(info.get('retry-after'))
+    if delay is None and info.get('x-ratelimit-remaining') == '0':
+        delay = parse_ratelimit_reset(info.get('x-ratelimit-reset'))
+
+    if delay is None:
+        backoff = min(max_delay, sleep * (2 ** (attempt - 1)))
+        delay = backoff / 2 + random.uniform(0, backoff / 2)
+
+    return max(0, min(max_delay, delay))
+
+def retryable(method, info):
+    """
+    Whether a failed request can be sent again.
+    A 429 is rejected before Bitbucket processes the request and a request that wasn't written never
+    reached it, so both are retried whatever the method. After a network error or a 502, 503 or 504 the
+    request may have been processed, it is only retried when its method is idempotent.
+    """
+
+    if info['status'] == 429 or info.get('written') is False:
+        return True
+
+    if info['status'] != -1 and info['status'] not in BitbucketHelper.RETRY_STATUS_CODES:
+        return False
+
+    return method.upper() in BitbucketSession.IDEMPOTENT_METHODS
+
+def auth_headers(params):
+    """
+    Headers that authenticate the requests
+    """
+
+    if not params['username']:
+        return {}
+
+    return {
+        'Authorization': basic_auth_header(params['username'], params['password'])
+    }
+
 class BitbucketHelper:
     """
     Class BitbucketHelper
@@ -33,6 +132,7 @@ class BitbucketHelper:
     BITBUCKET_API_URL = 'https://api.bitbucket.org/2.0'
 
     BITBUCKET_API_ENDPOINTS = {
+        'workspace-repos': '{url}/repositories/{workspace}',
         'repos': '{url}/repositories/{workspace}/{repo_slug}',
         'repos-permissions-users': '{url}/repositories/{workspace}/{repo_slug}/permissions-config/users',
         'repos-permissions-groups': '{url}/repositories/{workspace}/{repo_slug}/permissions-config/groups',
@@ -41,10 +141,54 @@ class BitbucketHelper:
         'repos-deployments': '{url}/repositories/{workspace}/{repo_slug}/deployments_config',
     }
 
+    # attributes of the variables we read, values of secured variables never come back
+    VARIABLE_FIELDS = ['uuid', 'key', 'value', 'secured']
+
+    # responses that are retried, besides network errors (status -1), see retryable
+    RETRY_STATUS_CODES = (429, 502, 503, 504)
+
     def __init__(self, module):
         self.module = module
         if self.module.params['url'] is None:
             self.module.params['url'] = self.BITBUCKET_API_URL
+        self.session = BitbucketSession(
+            validate_certs=self.module.params['validate_certs'],
+            use_proxy=self.module.params['use_proxy'])
+        self.stats = dict(
+            retries=0,
+            retry_wait_seconds=0.0,
+            pages_fetched=0,
+            bytes_received=0,
+            snapshot_hits=0,
+            rate_limit_wait_seconds=0.0,
+        )
+        self.stats_lock = threading.Lock()
+        self.local = threading.local()
+        self.cache = ResponseCache(
+            ttl=self.module.params['cache_ttl'],
+            size=self.module.params['cache_size'])
+        self.disk_cache = None
+        if self.module.params['cache_dir']:
+            self.disk_cache = DiskCache(
+                self.module.params['cache_dir'],
+                identity='{0}:{1}'.format(self.module.params['username'], self.module.params['password']))
+        self.snapshot = None
+        if self.module.params.get('snapshot_path'):
+            self.snapshot = WorkspaceSnapshot(
+                self.module.params['snapshot_path'],
+                workspace='i2b',
+                ttl=self.module.params['snapshot_ttl'])
+        self.snapshot_reader = SnapshotReader(self, self.snapshot, refresh=self.module.params.get('snapshot_refresh'))
+        self.recorder = ReadRecorder()
+        self.rate_limiter = SharedTokenBucket.from_params(self.module.params)
+        self.circuit = CircuitBreaker.from_params(self.module.params)
+        self.tracer = None
+        if self.module.params.get('trace', 'none') != 'none':
+            self.tracer = RequestTracer(
+                self.BITBUCKET_API_ENDPOINTS,
+                self.module.params['trace'],
+                self.module.params['trace_file'],
+                task=getattr(self.module, '_name', None))
 
     @staticmethod
     def bitbucket_argument_spec():
@@ -52,7 +196,7 @@ class BitbucketHelper:
         Define default arguments for modules
         """
 
-        return dict(
+        argument_spec = dict(
             url=dict(
                 type='str',
                 no_log=False,
@@ -87,7 +231,32 @@ class BitbucketHelper:
             retries=dict(
                 type='int',
                 default=3),
+            max_retry_delay=dict(
+                type='int',
+                default=60),
+            max_concurrency=dict(
+                type='int',
+                default=1),
+            adaptive_concurrency=dict(
+                type='bool',
+                default=False),
+            cache_ttl=dict(
+                type='int',
+                default=300),
+            cache_size=dict(
+                type='int',
+                default=256),
+            cache_dir=dict(
+                type='path',
+                required=False,
+                default=None),
         )
+        argument_spec.update(WorkspaceSnapshot.argument_spec())
+        argument_spec.update(RequestTracer.argument_spec())
+        argument_spec.update(SharedTokenBucket.argument_spec())
+        argument_spec.update(CircuitBreaker.argument_spec())
+
+        return argument_spec
 
     def request(
         self,
@@ -95,17 +264,27 @@ class BitbucketHelper:
         module,
         method,
         data=None,
-        headers=None):
+        headers=None,
+        fields=None):
         """
         Function to interact with Bitbucket API
+        fields: attributes of the response we need, sent as the `fields` query parameter
+        so Bitbucket leaves out everything else.
         """
 
         headers = headers or {}
+        started = time.time()
+
+        if fields:
+            api_url = add_query(api_url, fields=fields)
 
-        if module.params['username']:
-            headers.update({
-                'Authorization': basic_auth_header(module.params['username'], module.params['password'])
-            })
+        if method == 'GET' and self.cache.enabled():
+            cached = self.cache.get(method, api_url)
+            if cached is not None:
+                self.recorder.record(api_url, cached[0])
+                if self.tracer is not None:
+                    self.tracer.record(method, api_url, cached[0]['status'], started, cache='memory')
+                return cached
 
         if isinstance(data, dict):
             data = module.jsonify(data)
@@ -114,54 +293,234 @@ class BitbucketHelper:
                     'Content-type': 'application/json',
                 })
 
+        disk_entry = None
+        if method == 'GET' and self.disk_cache is not None:
+            disk_entry = self.disk_cache.load(api_url)
+            if disk_entry is not None:
+                headers.update(self.disk_cache.conditional_headers(disk_entry))
+
         retries = 1
+        waited = 0.0
         while retries <= module.params['retries']:
-            response, info = fetch_url(
-                module=module,
-                url=api_url,
-                method=method,
-                headers=headers,
-                data=data,
-                force=True,
-                use_proxy=module.params['use_proxy']
-            )
-            if (info is not None) and (info['status'] != -1):
+            info, body = self.send(api_url, method, headers, data)
+            if info['status'] == -1 or info['status'] == 429 or info['status'] >= 500:
+                self.local.throttled = True
+            if not retryable(method, info):
+                break
+            if info.get('circuit_open'):
+                # fail fast, the API is failing for every process
+                break
+            if retries == module.params['retries']:
                 break
-            time.sleep(module.params['sleep'])
+            delay = backoff_delay(info, retries, module.params['sleep'], module.params['max_retry_delay'])
+            self.add_stats(retries=1, retry_wait_seconds=delay)
+            time.sleep(delay)
+            waited += delay
             retries += 1
 
-        content = {}
+        if method == 'DELETE' and retries > 1 and info['status'] == 404:
+            # an attempt that failed after being written already deleted it
+            info['status'] = 204
+            info['msg'] = 'No Content (deleted by a previous attempt)'
+
+        bytes_received = len(body or b'')
+        served_from = None
 
-        if response is not None:
+        if disk_entry is not None and info['status'] == 304:
+            # not modified since we stored it, serve the response from disk
+            self.disk_cache.hit()
+            served_from = 'disk'
+            info['status'] = 200
+            info['msg'] = 'OK (not modified)'
+            body = disk_entry['body'].encode('utf-8')
+        elif self.disk_cache is not None and method == 'GET' and info['status'] == 200:
+            self.disk_cache.store(api_url, info, body)
 
-            body = to_text(response.read())
-            if body:
-                try:
-                    body_js = json.loads(body)
-                    if isinstance(body_js, dict):
-                        content = body_js
-                    else:
-                        content['json'] = body_js
-                except ValueError as exc:
-                    content['content'] = body
+        content = {}
+
+        if body:
+            try:
+                body_js = json.loads(body)
+                if isinstance(body_js, dict):
+                    content = body_js
+                else:
+                    content['json'] = body_js
+            except ValueError:
+                content['content'] = to_text(bytes(body))
 
         content['fetch_url_retries'] = retries
 
+        if method == 'GET':
+            self.recorder.record(api_url, info)
+
+        if method != 'GET':
+            self.cache.invalidate(api_url)
+            self.snapshot_reader.discard(api_url)
+        elif info['status'] == 200 and self.cache.enabled():
+            self.cache.put(method, api_url, (info, content))
+
+        if self.tracer is not None:
+            self.tracer.record(
+                method, api_url, info['status'], started,
+                bytes_received=bytes_received,
+                retries=retries - 1,
+                wait_seconds=waited,
+                cache=served_from)
+
+        if fields:
+            self.module.debug('Bitbucket {0} {1}: {2} bytes received with fields={3}'.format(
+                method, info['url'], len(body or b''), fields))
+
         return info, content
 
-    def get_repository_info(self):
+    def send(
+        self,
+        api_url,
+        method,
+        headers,
+        data):
+        """
+        Send one authenticated request through the pooled session.
+        Returns an `info` dict shaped like the one of fetch_url and the body of successful responses.
+        """
+
+        info = dict(url=api_url, status=-1)
+        headers = dict(headers, **auth_headers(self.module.params))
+
+        if self.circuit is not None and not self.circuit.allow():
+            info['circuit_open'] = True
+            info['msg'] = 'Request not sent: the Bitbucket API is failing, circuit open for {0} more seconds'.format(
+                self.circuit.remaining())
+            return info, None
+
+        if self.rate_limiter is not None:
+            self.add_stats(rate_limit_wait_seconds=self.rate_limiter.acquire())
+
+        try:
+            status, reason, response_headers, body = self.session.request(
+                method,
+                api_url,
+                headers=headers,
+                data=data,
+            )
+        except (socket.error, ssl.SSLError, http.client.HTTPException) as exc:
+            info['msg'] = 'Request failed: {0}'.format(to_text(exc))
+            info['written'] = not isinstance(exc, RequestNotSent)
+            if self.circuit is not None:
+                self.circuit.record(-1)
+            return info, None
+
+        if self.circuit is not None:
+            self.circuit.record(status)
+
+        self.add_stats(bytes_received=len(body))
+
+        info.update(dict((k.lower(), v) for k, v in response_headers))
+        info['status'] = status
+
+        if status == 429 and self.rate_limiter is not None:
+            self.rate_limiter.drain()
+
+        if status >= 400:
+            info['msg'] = 'HTTP Error {0}: {1}'.format(status, reason)
+            info['body'] = to_text(bytes(body))
+            return info, None
+
+        info['msg'] = 'OK ({0} bytes)'.format(len(body))
+
+        return info, body
+
+    def repository_slug(
+        self,
+        repository=None):
+        """
+        Repository the helper works on, the `repository` option of the module by default
+        """
+
+        return repository or self.module.params.get('repository')
+
+    @contextlib.contextmanager
+    def raising_errors(self):
+        """
+        Raise BitbucketError instead of failing the module while the context is active on this thread
+        """
+
+        previous = getattr(self.local, 'raise_errors', False)
+        self.local.raise_errors = True
+        try:
+            yield
+        finally:
+            self.local.raise_errors = previous
+
+    def fail(self, msg):
+        """
+        Fail the module, or raise BitbucketError when called from a mutation worker
+        """
+
+        if getattr(self.local, 'raise_errors', False):
+            raise BitbucketError(msg)
+
+        if self.tracer is not None:
+            self.module.fail_json(msg=msg, api_stats=self.get_stats())
+
+        self.module.fail_json(msg=msg)
+
+    def add_stats(self, **counters):
+        """
+        Increase the counters of the module run, it can be called from several threads
+        """
+
+        with self.stats_lock:
+            for key, value in counters.items():
+                self.stats[key] = self.stats.get(key, 0) + value
+
+    def get_stats(self):
+        """
+        Counters of the HTTP activity of the module run
+        """
+
+        with self.stats_lock:
+            stats = dict(self.stats)
+
+        stats.update(
+            connections_opened=self.session.connections_opened,
+            requests_sent=self.session.requests_sent,
+            bytes_on_wire=self.session.bytes_on_wire,
+            cache_hits=self.cache.hits,
+            cache_misses=self.cache.misses,
+            disk_cache_hits=self.disk_cache.hits if self.disk_cache else 0,
+            disk_cache_stores=self.disk_cache.stores if self.disk_cache else 0,
+            retry_wait_seconds=round(stats['retry_wait_seconds'], 3),
+            rate_limit_wait_seconds=round(stats['rate_limit_wait_seconds'], 3),
+            circuit_rejections=self.circuit.rejected if self.circuit else 0,
+        )
+
+        if self.tracer is not None:
+            stats['trace'] = self.tracer.report()
+
+        return stats
+
+    def get_repository_info(
+        self,
+        repository=None,
+        use_snapshot=True):
         """
         Get information of repository on Bitbucket
         """
 
+        entry = self.snapshot_reader.entry(self.repository_slug(repository)) if use_snapshot else None
+        if entry is not None:
+            return dict(entry['info'])
+
         info, content = self.request(
             api_url=self.BITBUCKET_API_ENDPOINTS['repos'].format(
-                url=self.BITBUCKET_API_URL,
+                url=self.module.params['url'],
                 workspace='i2b',
-                repo_slug=self.module.params['repository']
+                repo_slug=self.repository_slug(repository)
             ),
             module=self.module,
             method='GET',
+            fields='uuid,full_name',
         )
 
         if info['status'] == 200:
@@ -171,7 +530,7 @@ class BitbucketHelper:
             return False
 
         if info['status'] != 200:
-            self.module.fail_json(
+            self.fail(
                 msg=error_messages['unknown_error'].format(
                     info=info,
                 )
@@ -179,22 +538,25 @@ class BitbucketHelper:
 
         return None
 
-    def create_repository(self):
+    def create_repository(
+        self,
+        repository=None,
+        project_key=None):
         """
         Create a bitbucket repository
         """
 
         info, content = self.request(
             api_url=self.BITBUCKET_API_ENDPOINTS['repos'].format(
-                url=self.BITBUCKET_API_URL,
+                url=self.module.params['url'],
                 workspace='i2b',
-                repo_slug=self.module.params['repository']
+                repo_slug=self.repository_slug(repository)
             ),
             module=self.module,
             method='POST',
             data={
                 'project': ({
-                    'key': self.module.params['project_key'],
+                    'key': project_key or self.module.params['project_key'],
                 }),
                 'is_private': True
             },
@@ -204,21 +566,21 @@ class BitbucketHelper:
             return True
 
         if info['status'] == 400:
-            self.module.fail_json(
+            self.fail(
                 msg=error_messages['insufficient_permissions_to_create'].format(
-                    repositorySlug=self.module.params['repository'],
+                    repositorySlug=self.repository_slug(repository),
                 )
             )
 
         if info['status'] == 401:
-            self.module.fail_json(
+            self.fail(
                 msg=error_messages['validation_error'].format(
-                    repositorySlug=self.module.params['repository'],
+                    repositorySlug=self.repository_slug(repository),
                 )
             )
 
         if info['status'] != 200:
-            self.module.fail_json(
+            self.fail(
                 msg=error_messages['unknown_error'].format(
                     info=info,
                 )
@@ -228,84 +590,67 @@ class BitbucketHelper:
 
     def get_repository_permissions_info(
         self,
-        scope=None):
+        scope=None,
+        repository=None,
+        use_snapshot=True):
         """
         Retrieve users or groups that have been granted at least one permission for the specified repository.
         scope: either 'users' or 'groups'.
         """
 
-        permissions = []
-        is_last_page = False
-        api_url=None
+        # the snapshot only keeps the group permissions
+        entry = self.snapshot_reader.entry(self.repository_slug(repository)) if use_snapshot and scope != "user" else None
+        if entry is not None:
+            return [dict(value) for value in entry['groups']]
 
         if scope == "user":
             api_url=self.BITBUCKET_API_ENDPOINTS['repos-permissions-users'].format(
                         url=self.module.params['url'],
                         workspace='i2b',
-                        repo_slug=self.module.params['repository'])
-        else:
-            api_url=self.BITBUCKET_API_ENDPOINTS['repos-permissions-groups'].format(
-                        url=self.module.params['url'],
-                        workspace='i2b',
-                        repo_slug=self.module.params['repository'])
-
-        while not is_last_page:
-            info, content = self.request(
-                api_url,
-                module=self.module,
-                method='GET',
-            )
-
-            for value in content['values']:
-                perm = {}
-                if scope == "user":
-                    perm =	{
-                        "type": scope,
-                        "name": value['user']['nickname'],
-                        "perm": value['permission']
-                    }
-                else:
-                    perm =	{
-                        "type": scope,
-                        "name": value['group']['slug'],
-                        "perm": value['permission']
-                    }
-
-                permissions.extend([perm])
-
-            if 'next' in content:
-                api_url = content['next']
-            else:
-                is_last_page = True
-
-        if info['status'] == 200:
-            return permissions
-
-        if info['status'] != 200:
-            self.module.fail_json(
-                msg=error_messages['unknown_error'].format(
-                    info=info,
-                )
-            )
+                        repo_slug=self.repository_slug(repository))
+            # users are addressed by account ID or UUID on the API, nicknames are only for display
+            return [{
+                "type": scope,
+                "name": value['user'].get('nickname'),
+                "perm": value['permission'],
+                "account_id": value['user'].get('account_id'),
+                "uuid": value['user'].get('uuid'),
+            } for value in paginate(self, api_url, fields=['permission', 'user.nickname', 'user.account_id', 'user.uuid'])]
+
+        api_url=self.BITBUCKET_API_ENDPOINTS['repos-permissions-groups'].format(
+                    url=self.module.params['url'],
+                    workspace='i2b',
+                    repo_slug=self.repository_slug(repository))
 
-        return None
+        return [{
+            "type": scope,
+            "name": value['group']['slug'],
+            "perm": value['permission']
+        } for value in paginate(self, api_url, fields=['permission', 'group.slug'])]
 
     def apply_repository_permissions(
         self,
         action,
         scope,
         name,
-        perm=None):
+        perm=None,
+        repository=None):
         """
         Promote or demote either a user's or a group's permission level for the specified repository
         scope: either 'user' or 'group'.
+        name: slug of the group, or account ID or UUID of the user.
         """
 
-        if scope == "group":
+        if scope == "user":
+            api_url=self.BITBUCKET_API_ENDPOINTS['repos-permissions-users'].format(
+                        url=self.module.params['url'],
+                        workspace='i2b',
+                        repo_slug=self.repository_slug(repository))
+        else:
             api_url=self.BITBUCKET_API_ENDPOINTS['repos-permissions-groups'].format(
                         url=self.module.params['url'],
                         workspace='i2b',
-                        repo_slug=self.module.params['repository'])
+                        repo_slug=self.repository_slug(repository))
 
         if action == "promote":
             api_verb = 'PUT'
@@ -320,14 +665,15 @@ class BitbucketHelper:
             api_url + '/' + name,
             module=self.module,
             method=api_verb,
-            data=api_data
+            data=api_data,
+            fields='permission',
         )
 
         if info['status'] == 200 or info['status'] == 204:
             return content
 
         if info['status'] != 200:
-            self.module.fail_json(
+            self.fail(
                 msg=error_messages['unknown_error'].format(
                     info=info,
                 )
@@ -337,15 +683,15 @@ class BitbucketHelper:
 
     def enable_repository_pipeline(
         self,
-        ):
+        repository=None):
         """
         Enable pipeline on repository
         """
 
         api_url=self.BITBUCKET_API_ENDPOINTS['repos-pipeline'].format(
-            url=self.BITBUCKET_API_URL,
+            url=self.module.params['url'],
             workspace='i2b',
-            repo_slug=self.module.params['repository']
+            repo_slug=self.repository_slug(repository)
         )
 
         info, content = self.request(
@@ -355,13 +701,14 @@ class BitbucketHelper:
             data={
                 'enabled': True
             },
+            fields='enabled',
         )
 
         if info['status'] == 200:
             return content
 
         if info['status'] != 200:
-            self.module.fail_json(
+            self.fail(
                 msg=error_messages['unknown_error'].format(
                     info=info,
                 )
@@ -369,56 +716,69 @@ class BitbucketHelper:
 
         return None
 
-    def get_variables(
+    def get_repository_variables(
         self,
-        api_url):
+        repository=None,
+        use_snapshot=True):
         """
-        Retrieve all variables for the specified repository.
+        Retrieve the pipeline variables of the specified repository.
         """
 
-        variables = []
-        is_last_page = False
-        current_page = 1
-        current_size = 0
-        api_url_base = api_url
-        while not is_last_page:
-            info, content = self.request(
-                api_url,
-                module=self.module,
-                method='GET',
-            )
+        entry = self.snapshot_reader.entry(self.repository_slug(repository)) if use_snapshot else None
+        if entry is not None:
+            return [dict(var) for var in entry['variables']]
 
-            if 'values' in content:
-                variables.extend(content['values'])
+        api_url=self.BITBUCKET_API_ENDPOINTS['repos-pipeline'].format(
+                    url=self.module.params['url'],
+                    workspace='i2b',
+                    repo_slug=self.repository_slug(repository))
 
-            # temporary logic to paginate over the response
-            if 'next' in content:
-                current_page = sum([current_page, 1])
-                api_url = api_url_base + "?page=" + str(current_page)
+        return list(paginate(self, api_url + "/variables/", fields=self.VARIABLE_FIELDS, prefetch=True))
 
-            current_size = sum([current_size, content['pagelen']])
-            if current_size >= content['size']:
-                is_last_page = True
+    def get_environment_variables(
+        self,
+        env_uuid,
+        repository=None,
+        use_snapshot=True):
+        """
+        Retrieve the variables of a deployment environment of the specified repository.
+        """
 
-            # this is the logic we need to use to paginate over the response
-            # but the URL included in the "next" option is currently not working
-            # https://jira.atlassian.com/browse/BCLOUD-13806
-            # if 'next' in content:
-            #     api_url = content['next']
-            # else:
-            #     is_last_page = True
+        entry = self.snapshot_reader.entry(self.repository_slug(repository)) if use_snapshot else None
+        if entry is not None:
+            for env in entry['environments']:
+                if env['uuid'] == env_uuid:
+                    return [dict(var) for var in env['variables']]
 
-        if info['status'] == 200:
-            return variables
+        api_url=self.BITBUCKET_API_ENDPOINTS['repos-deployments'].format(
+                    url=self.module.params['url'],
+                    workspace='i2b',
+                    repo_slug=self.repository_slug(repository))
 
-        if info['status'] != 200:
-            self.module.fail_json(
-                msg=error_messages['unknown_error'].format(
-                    info=info,
-                )
-            )
+        return list(paginate(
+            self,
+            api_url + "/environments/" + env_uuid + "/variables",
+            fields=self.VARIABLE_FIELDS,
+            prefetch=True))
 
-        return None
+    def iter_workspace_repositories(
+        self,
+        prefetch=True):
+        """
+        Iterate over the repositories of the workspace.
+        prefetch: fetch the remaining pages at the same time, with False one page is requested
+        when the caller reaches it and only one page is kept in memory.
+        """
+
+        api_url=self.BITBUCKET_API_ENDPOINTS['workspace-repos'].format(
+                    url=self.module.params['url'],
+                    workspace='i2b')
+
+        return paginate(
+            self,
+            api_url,
+            fields=['slug', 'uuid', 'full_name'],
+            prefetch=prefetch)
 
     def manage_repository_variables(
         self,
@@ -426,7 +786,8 @@ class BitbucketHelper:
         name,
         value,
         uuid=None,
-        secured=False):
+        secured=False,
+        repository=None):
         """
         CRUD variables on repository
         """
@@ -434,7 +795,7 @@ class BitbucketHelper:
         api_url=self.BITBUCKET_API_ENDPOINTS['repos-pipeline'].format(
                     url=self.module.params['url'],
                     workspace='i2b',
-                    repo_slug=self.module.params['repository'])
+                    repo_slug=self.repository_slug(repository))
 
         if action == "create":
             api_verb = 'POST'
@@ -462,7 +823,8 @@ class BitbucketHelper:
             api_url + api_path,
             module=self.module,
             method=api_verb,
-            data=api_data
+            data=api_data,
+            fields='uuid',
         )
 
         if info['status'] == 200:
@@ -475,7 +837,7 @@ class BitbucketHelper:
             return content
 
         if info['status'] != 200:
-            self.module.fail_json(
+            self.fail(
                 msg=error_messages['unknown_error'].format(
                     info=info,
                 )
@@ -485,53 +847,37 @@ class BitbucketHelper:
 
         return None
 
-    def get_repository_environments(
-        self):
+    def iter_repository_environments(
+        self,
+        repository=None,
+        use_snapshot=True):
         """
-        Retrieve all environments for the specified repository.
+        Iterate over the environments of the specified repository.
         """
 
-        variables = []
-        is_last_page = False
+        entry = self.snapshot_reader.entry(self.repository_slug(repository)) if use_snapshot else None
+        if entry is not None:
+            return iter([
+                dict(uuid=env['uuid'], name=env['name'], environment_type=env['environment_type'])
+                for env in entry['environments']])
 
         api_url=self.BITBUCKET_API_ENDPOINTS['repos-environments'].format(
                     url=self.module.params['url'],
                     workspace='i2b',
-                    repo_slug=self.module.params['repository'])
-
-        while not is_last_page:
-            info, content = self.request(
-                api_url + "/",
-                module=self.module,
-                method='GET',
-            )
-
-            if 'values' in content:
-                variables.extend(content['values'])
+                    repo_slug=self.repository_slug(repository))
 
-            if 'next' in content:
-                api_url = content['next']
-            else:
-                is_last_page = True
-
-        if info['status'] == 200:
-            return variables
-
-        if info['status'] != 200:
-            self.module.fail_json(
-                msg=error_messages['unknown_error'].format(
-                    info=info,
-                )
-            )
-
-        return None
+        return paginate(
+            self,
+            api_url + "/",
+            fields=['uuid', 'name', 'environment_type.name'])
 
     def manage_repository_environments(
         self,
         action,
         name,
         category=None,
-        uuid=None):
+        uuid=None,
+        repository=None):
         """
         CRUD environments on repository
         """
@@ -539,7 +885,7 @@ class BitbucketHelper:
         api_url=self.BITBUCKET_API_ENDPOINTS['repos-environments'].format(
                     url=self.module.params['url'],
                     workspace='i2b',
-                    repo_slug=self.module.params['repository'])
+                    repo_slug=self.repository_slug(repository))
 
         if action == "create":
             api_verb = 'POST'
@@ -561,7 +907,8 @@ class BitbucketHelper:
             api_url + api_path,
             module=self.module,
             method=api_verb,
-            data=api_data
+            data=api_data,
+            fields='uuid',
         )
 
         if info['status'] == 201 and action == "create":
@@ -569,7 +916,7 @@ class BitbucketHelper:
         elif info['status'] == 204 and action == "delete":
             return content
         else:
-            self.module.fail_json(
+            self.fail(
                 msg=error_messages['unknown_error'].format(
                     info=info,
                 )
@@ -584,7 +931,8 @@ class BitbucketHelper:
         value,
         env_uuid=None,
         var_uuid=None,
-        secured=False):
+        secured=False,
+        repository=None):
         """
         CRUD variables on environment
         """
@@ -592,7 +940,7 @@ class BitbucketHelper:
         api_url=self.BITBUCKET_API_ENDPOINTS['repos-deployments'].format(
                     url=self.module.params['url'],
                     workspace='i2b',
-                    repo_slug=self.module.params['repository'])
+                    repo_slug=self.repository_slug(repository))
 
         if action == "create":
             api_verb = 'POST'
@@ -620,7 +968,8 @@ class BitbucketHelper:
             api_url + api_path,
             module=self.module,
             method=api_verb,
-            data=api_data
+            data=api_data,
+            fields='uuid',
         )
 
         if info['status'] == 200:
@@ -633,7 +982,7 @@ class BitbucketHelper:
             return content
 
         if info['status'] != 200:
-            self.module.fail_json(
+            self.fail(
                 msg=error_messages['unknown_error'].format(
                     info=info,
                 )
@@ -0,0 +1,898 @@
+"""
+Util classes to call the Bitbucket API from asyncio, and to read the workspace snapshot with them
+"""
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import asyncio
+import collections
+import http.client
+import json
+import ssl
+import zlib
+from urllib.parse import urljoin, urlsplit
+
+from ansible.module_utils._text import to_text
+from ansible.module_utils.urls import basic_auth_header
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket import (
+    BitbucketError,
+    BitbucketHelper,
+    backoff_delay,
+    error_messages,
+    retryable,
+)
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_pagination import PAGE_FIELDS, PAGE_LENGTH, add_query
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_session import BitbucketSession, RequestNotSent, new_decoder, same_host
+
+class StaleConnectionError(ConnectionResetError):
+    """
+    The server closed a keep-alive connection before answering
+    """
+
+#
+# class: AsyncConnectionPool
+#
+
+class AsyncConnectionPool:
+    """
+    Class AsyncConnectionPool
+
+    Keep-alive HTTP/1.1 connections opened with asyncio.open_connection, the non-blocking
+    counterpart of BitbucketSession, with the same redirects and resends of stale connections.
+    Responses are read as they arrive, chunked or not, and gzip/deflate bodies are decoded on the fly.
+    Requests go straight to the API, proxies are not supported.
+    """
+
+    def __init__(self, validate_certs=True, timeout=None):
+        self.validate_certs = validate_certs
+        self.timeout = timeout or BitbucketSession.DEFAULT_TIMEOUT
+        self.connections_opened = 0
+        self.requests_sent = 0
+        self.bytes_on_wire = 0
+        self._idle = {}
+        self._ssl_context = None
+
+    def ssl_context(self):
+        """
+        Build the SSL context once, honoring validate_certs
+        """
+
+        if self._ssl_context is None:
+            context = ssl.create_default_context()
+            if not self.validate_certs:
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+            self._ssl_context = context
+
+        return self._ssl_context
+
+    async def checkout(self, key):
+        """
+        Take an idle connection for the target or open a new one
+        """
+
+        idle = self._idle.get(key)
+        while idle:
+            reader, writer = idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+
+        scheme, host, port = key
+        reader, writer = await asyncio.open_connection(
+            host, port, ssl=self.ssl_context() if scheme == 'https' else None)
+        self.connections_opened += 1
+
+        return reader, writer, False
+
+    def checkin(self, key, reader, writer):
+        """
+        Give a connection back to the pool
+        """
+
+        self._idle.setdefault(key, []).append((reader, writer))
+
+    async def request(self, method, url, headers=None, data=None):
+        """
+        Send a request, see send_request. Redirects are followed like BitbucketSession.request does.
+        """
+
+        redirects = 0
+        while True:
+            status, reason, response_headers, body = await self.send_request(method, url, headers, data)
+
+            if status not in BitbucketSession.REDIRECT_STATUS_CODES or method.upper() not in ('GET', 'HEAD'):
+                break
+
+            location = dict((k.lower(), v) for k, v in response_headers).get('location')
+            if not location or redirects == BitbucketSession.MAX_REDIRECTS:
+                break
+
+            target = urljoin(url, location)
+            if not same_host(url, target):
+                break
+
+            url = target
+            redirects += 1
+
+        return status, reason, response_headers, body
+
+    async def send_request(self, method, url, headers=None, data=None):
+        """
+        Send one request reusing a pooled connection, resent on a new one like BitbucketSession.send_request.
+        Returns a tuple (status, reason, headers, body), network errors are raised to the caller,
+        as RequestNotSent when the request wasn't written.
+        """
+
+        parts = urlsplit(url)
+        scheme = parts.scheme or 'https'
+        port = parts.port or (443 if scheme == 'https' else 80)
+        key = (scheme, parts.hostname, port)
+
+        path = parts.path or '/'
+        if parts.query:
+            path = path + '?' + parts.query
+
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        data = data or b''
+
+        headers = dict(headers or {})
+        headers.setdefault('User-Agent', BitbucketSession.USER_AGENT)
+        headers.setdefault('Accept-Encoding', BitbucketSession.ACCEPT_ENCODING)
+        headers['Host'] = parts.netloc
+        if data or method in ('POST', 'PUT', 'PATCH'):
+            headers['Content-Length'] = str(len(data))
+
+        lines = ['{0} {1} HTTP/1.1'.format(method, path)]
+        lines.extend('{0}: {1}'.format(name, to_text(value)) for name, value in headers.items())
+        message = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + data
+
+        while True:
+            try:
+                reader, writer, reused = await asyncio.wait_for(self.checkout(key), self.timeout)
+            except (OSError, ssl.SSLError, asyncio.TimeoutError) as exc:
+                raise RequestNotSent(exc) from exc
+
+            self.requests_sent += 1
+            try:
+                writer.write(message)
+                await asyncio.wait_for(writer.drain(), self.timeout)
+            except (OSError, asyncio.TimeoutError) as exc:
+                writer.close()
+                if reused:
+                    # the server dropped an idle connection, retry on a fresh one
+                    self.requests_sent -= 1
+                    continue
+                raise RequestNotSent(exc) from exc
+
+            try:
+                status, reason, response_headers, body, keep_alive = await asyncio.wait_for(
+                    self.read_response(reader, method), self.timeout)
+            except StaleConnectionError:
+                writer.close()
+                if reused and method.upper() in BitbucketSession.IDEMPOTENT_METHODS:
+                    # a POST that was written may have been processed, it goes to the retries of the caller instead
+                    self.requests_sent -= 1
+                    continue
+                raise
+            except BaseException:
+                writer.close()
+                raise
+            break
+
+        if keep_alive:
+            self.checkin(key, reader, writer)
+        else:
+            writer.close()
+
+        return status, reason, response_headers, body
+
+    async def read_response(self, reader, method):
+        """
+        Read the response of the request written on a connection
+        """
+
+        try:
+            status_line = await reader.readline()
+        except (ConnectionResetError, BrokenPipeError) as exc:
+            raise StaleConnectionError(str(exc)) from exc
+
+        if not status_line:
+            raise StaleConnectionError('Connection closed by the server')
+
+        try:
+            version, status, reason = status_line.decode('latin-1').rstrip('\r\n').split(' ', 2)
+            status = int(status)
+        except ValueError as exc:
+            raise http.client.BadStatusLine(to_text(status_line)) from exc
+
+        headers = []
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, dummy, value = line.decode('latin-1').partition(':')
+            headers.append((name.strip(), value.strip()))
+
+        lookup = dict((name.lower(), value) for name, value in headers)
+        keep_alive = version != 'HTTP/1.0' and lookup.get('connection', '').lower() != 'close'
+
+        if method == 'HEAD' or status in (204, 304) or status < 200:
+            return status, reason, headers, b'', keep_alive
+
+        if lookup.get('transfer-encoding', '').lower() != 'chunked' and 'content-length' not in lookup:
+            # the body ends when the server closes the connection
+            keep_alive = False
+
+        encoding = lookup.get('content-encoding', 'identity').strip().lower()
+        decoder = None
+        body = bytearray()
+        try:
+            async for chunk in self.read_chunks(reader, lookup):
+                self.bytes_on_wire += len(chunk)
+                if encoding not in ('gzip', 'deflate'):
+                    body += chunk
+                    continue
+                if decoder is None:
+                    decoder = new_decoder(encoding, chunk)
+                body += decoder.decompress(chunk)
+            if decoder is not None:
+                body += decoder.flush()
+        except zlib.error as exc:
+            raise http.client.HTTPException('Invalid {0} response body: {1}'.format(encoding, exc)) from exc
+
+        return status, reason, headers, body, keep_alive
+
+    @staticmethod
+    async def read_chunks(reader, headers):
+        """
+        Iterate over the pieces of a body as they arrive
+        """
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            while True:
+                size = int((await reader.readline()).split(b';')[0].strip(), 16)
+                if size == 0:
+                    # skip the trailers
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    return
+                while size > 0:
+                    chunk = await reader.readexactly(min(size, BitbucketSession.CHUNK_SIZE))
+                    size -= len(chunk)
+                    yield chunk
+                await reader.readexactly(2)
+        elif 'content-length' in headers:
+            remaining = int(headers['content-length'])
+            while remaining > 0:
+                chunk = await reader.readexactly(min(remaining, BitbucketSession.CHUNK_SIZE))
+                remaining -= len(chunk)
+                yield chunk
+        else:
+            while True:
+                chunk = await reader.read(BitbucketSession.CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+
+    async def close(self):
+        """
+        Close every idle connection
+        """
+
+        idle = self._idle
+        self._idle = {}
+        for connections in idle.values():
+            for dummy, writer in connections:
+                writer.close()
+
+#
+# class: AsyncBitbucketClient
+#
+
+class AsyncBitbucketClient:
+    """
+    Class AsyncBitbucketClient
+
+    asyncio counterpart of BitbucketHelper for the code that fans out many requests across
+    repositories, pages and mutations. It covers the endpoints of BITBUCKET_API_ENDPOINTS with the
+    same retries, partial responses and pagination, but every call is a coroutine and a semaphore
+    bounds the requests in flight, so one thread can keep thousands of them going.
+    Errors raise BitbucketError instead of failing the module. There is no cache, snapshot or tracing,
+    see `supports` for the helpers it can stand in for.
+    """
+
+    # network errors and malformed responses, reported with status -1 like BitbucketHelper.send
+    NETWORK_ERRORS = (OSError, ssl.SSLError, http.client.HTTPException, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError)
+
+    def __init__(
+        self,
+        url=None,
+        username=None,
+        password=None,
+        workspace='i2b',
+        max_concurrency=10,
+        retries=3,
+        sleep=5,
+        max_retry_delay=60,
+        validate_certs=True,
+        timeout=None):
+        self.url = url or BitbucketHelper.BITBUCKET_API_URL
+        self.username = username
+        self.password = password
+        self.workspace = workspace
+        self.max_concurrency = max(1, max_concurrency)
+        self.retries = retries
+        self.sleep = sleep
+        self.max_retry_delay = max_retry_delay
+        self.pool = AsyncConnectionPool(validate_certs=validate_certs, timeout=timeout)
+        self._semaphore = None
+        self.stats = dict(
+            retries=0,
+            retry_wait_seconds=0.0,
+            pages_fetched=0,
+            bytes_received=0,
+        )
+
+    @classmethod
+    def from_params(cls, params, max_concurrency=None):
+        """
+        Client configured by the common arguments of the modules
+        """
+
+        return cls(
+            url=params['url'],
+            username=params['username'],
+            password=params['password'],
+            max_concurrency=max_concurrency or params['max_concurrency'],
+            retries=params['retries'],
+            sleep=params['sleep'],
+            max_retry_delay=params['max_retry_delay'],
+            validate_certs=params['validate_certs'])
+
+    @staticmethod
+    def supports(bitbucket):
+        """
+        Whether the client can send the requests of a BitbucketHelper instead of it.
+        It can't when the API is reached through a proxy, when the requests are cached on disk, traced,
+        rate limited, guarded by a circuit breaker or recorded for a plan, or when the calling thread
+        is already running an event loop.
+        """
+
+        parts = urlsplit(bitbucket.module.params['url'])
+        if bitbucket.session.get_proxy(parts.scheme or 'https', parts.hostname):
+            return False
+
+        if bitbucket.recorder.active() or any(feature is not None for feature in (
+                bitbucket.disk_cache, bitbucket.tracer, bitbucket.rate_limiter, bitbucket.circuit)):
+            return False
+
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return True
+
+        return False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        """
+        Close the connections of the client
+        """
+
+        await self.pool.close()
+
+    def semaphore(self):
+        """
+        Semaphore that bounds the requests in flight, created on first use so it belongs to the running loop
+        """
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        return self._semaphore
+
+    def endpoint(self, name, repository=None):
+        """
+        URL of an endpoint of BITBUCKET_API_ENDPOINTS
+        """
+
+        return BitbucketHelper.BITBUCKET_API_ENDPOINTS[name].format(
+            url=self.url,
+            workspace=self.workspace,
+            repo_slug=repository)
+
+    def get_stats(self):
+        """
+        Counters of the HTTP activity of the client
+        """
+
+        stats = dict(self.stats)
+        stats.update(
+            connections_opened=self.pool.connections_opened,
+            requests_sent=self.pool.requests_sent,
+            bytes_on_wire=self.pool.bytes_on_wire,
+            retry_wait_seconds=round(stats['retry_wait_seconds'], 3),
+        )
+
+        return stats
+
+    async def send(
+        self,
+        api_url,
+        method,
+        headers,
+        data):
+        """
+        Send one request once a slot of the semaphore is free.
+        Returns an `info` dict shaped like the one of BitbucketHelper.send and the body of successful responses.
+        """
+
+        info = dict(url=api_url, status=-1)
+
+        try:
+            async with self.semaphore():
+                status, reason, response_headers, body = await self.pool.request(
+                    method, api_url, headers=headers, data=data)
+        except self.NETWORK_ERRORS as exc:
+            info['msg'] = 'Request failed: {0}'.format(to_text(exc) or type(exc).__name__)
+            info['written'] = not isinstance(exc, RequestNotSent)
+            return info, None
+
+        self.stats['bytes_received'] += len(body)
+
+        info.update(dict((k.lower(), v) for k, v in response_headers))
+        info['status'] = status
+
+        if status >= 400:
+            info['msg'] = 'HTTP Error {0}: {1}'.format(status, reason)
+            info['body'] = to_text(bytes(body))
+            return info, None
+
+        info['msg'] = 'OK ({0} bytes)'.format(len(body))
+
+        return info, body
+
+    async def request(
+        self,
+        api_url,
+        method,
+        data=None,
+        fields=None):
+        """
+        Function to interact with Bitbucket API, retrying like BitbucketHelper.request, see retryable
+        fields: attributes of the response we need, sent as the `fields` query parameter
+        """
+
+        if fields:
+            api_url = add_query(api_url, fields=fields)
+
+        headers = {}
+        if self.username:
+            headers['Authorization'] = basic_auth_header(self.username, self.password)
+        if isinstance(data, dict):
+            data = json.dumps(data)
+            headers['Content-type'] = 'application/json'
+
+        retries = 1
+        while retries <= self.retries:
+            info, body = await self.send(api_url, method, headers, data)
+            if not retryable(method, info):
+                break
+            if retries == self.retries:
+                break
+            delay = backoff_delay(info, retries, self.sleep, self.max_retry_delay)
+            self.stats['retries'] += 1
+            self.stats['retry_wait_seconds'] += delay
+            # the slot of the semaphore is free while we wait
+            await asyncio.sleep(delay)
+            retries += 1
+
+        if method == 'DELETE' and retries > 1 and info['status'] == 404:
+            # an attempt that failed after being written already deleted it
+            info['status'] = 204
+            info['msg'] = 'No Content (deleted by a previous attempt)'
+
+        content = {}
+
+        if body:
+            try:
+                body_js = json.loads(body)
+                if isinstance(body_js, dict):
+                    content = body_js
+                else:
+                    content['json'] = body_js
+            except ValueError:
+                content['content'] = to_text(bytes(body))
+
+        content['fetch_url_retries'] = retries
+
+        return info, content
+
+    async def expect(
+        self,
+        api_url,
+        method,
+        statuses,
+        data=None,
+        fields=None):
+        """
+        Send a request and return its content, raise BitbucketError when the status is not one of `statuses`
+        """
+
+        info, content = await self.request(api_url, method, data=data, fields=fields)
+
+        if info['status'] not in statuses:
+            raise BitbucketError(error_messages['unknown_error'].format(info=info))
+
+        return content
+
+    async def fetch_page(
+        self,
+        api_url,
+        page,
+        fields=None):
+        """
+        Fetch one page of a listing
+        """
+
+        content = await self.expect(
+            add_query(api_url, page=page, pagelen=PAGE_LENGTH), 'GET', (200,), fields=fields)
+        self.stats['pages_fetched'] += 1
+
+        return content
+
+    async def paginate(
+        self,
+        api_url,
+        fields=None):
+        """
+        Iterate over every item of a paginated listing, see bitbucket_pagination.paginate.
+        Once the first page arrived, the next pages are fetched `max_concurrency` at a time and their
+        items are yielded in order, so memory only holds the pages in flight.
+        """
+
+        if fields:
+            fields = ','.join(['values.' + field for field in fields] + PAGE_FIELDS)
+
+        content = await self.fetch_page(api_url, 1, fields)
+        values = content.get('values', [])
+        for value in values:
+            yield value
+
+        if 'next' not in content or not values:
+            return
+
+        pagelen = content.get('pagelen', PAGE_LENGTH)
+        if 'size' not in content:
+            # without the size the pages can only be followed one after another
+            page = 2
+            while True:
+                content = await self.fetch_page(api_url, page, fields)
+                values = content.get('values', [])
+                for value in values:
+                    yield value
+                if 'next' not in content or not values:
+                    return
+                page += 1
+
+        pages = collections.deque(range(2, (content['size'] + pagelen - 1) // pagelen + 1))
+        in_flight = collections.deque()
+        try:
+            while pages or in_flight:
+                while pages and len(in_flight) < self.max_concurrency:
+                    in_flight.append(asyncio.ensure_future(self.fetch_page(api_url, pages.popleft(), fields)))
+                content = await in_flight.popleft()
+                for value in content.get('values', []):
+                    yield value
+        finally:
+            # the caller stopped early or a page failed
+            for future in in_flight:
+                future.cancel()
+
+    async def get_repository_info(
+        self,
+        repository):
+        """
+        Get information of repository on Bitbucket, False when it doesn't exist
+        """
+
+        info, content = await self.request(self.endpoint('repos', repository), 'GET', fields='uuid,full_name')
+
+        if info['status'] == 200:
+            return content
+
+        if info['status'] == 404:
+            return False
+
+        raise BitbucketError(error_messages['unknown_error'].format(info=info))
+
+    async def create_repository(
+        self,
+        repository,
+        project_key):
+        """
+        Create a private repository
+        """
+
+        info, content = await self.request(
+            self.endpoint('repos', repository),
+            'POST',
+            data={'project': {'key': project_key}, 'is_private': True})
+
+        if info['status'] == 200:
+            return content
+
+        if info['status'] == 400:
+            raise BitbucketError(error_messages['insufficient_permissions_to_create'].format(repositorySlug=repository))
+
+        raise BitbucketError(error_messages['unknown_error'].format(info=info))
+
+    async def enable_repository_pipeline(
+        self,
+        repository):
+        """
+        Enable pipeline on repository
+        """
+
+        return await self.expect(
+            self.endpoint('repos-pipeline', repository), 'PUT', (200,), data={'enabled': True}, fields='enabled')
+
+    def iter_workspace_repositories(self):
+        """
+        Iterate over the repositories of the workspace
+        """
+
+        return self.paginate(self.endpoint('workspace-repos'), fields=['slug', 'uuid', 'full_name'])
+
+    def iter_repository_variables(
+        self,
+        repository):
+        """
+        Iterate over the pipeline variables of a repository
+        """
+
+        return self.paginate(
+            self.endpoint('repos-pipeline', repository) + '/variables/',
+            fields=['uuid', 'key', 'value', 'secured'])
+
+    def iter_environment_variables(
+        self,
+        env_uuid,
+        repository):
+        """
+        Iterate over the variables of a deployment environment
+        """
+
+        return self.paginate(
+            self.endpoint('repos-deployments', repository) + '/environments/' + env_uuid + '/variables',
+            fields=['uuid', 'key', 'value', 'secured'])
+
+    def iter_repository_environments(
+        self,
+        repository):
+        """
+        Iterate over the deployment environments of a repository
+        """
+
+        return self.paginate(
+            self.endpoint('repos-environments', repository) + '/',
+            fields=['uuid', 'name', 'environment_type.name'])
+
+    async def iter_repository_permissions(
+        self,
+        scope,
+        repository):
+        """
+        Iterate over the users or groups granted a permission on a repository, as BitbucketHelper.get_repository_permissions_info
+        scope: either 'user' or 'group'.
+        """
+
+        if scope == 'user':
+            api_url = self.endpoint('repos-permissions-users', repository)
+            fields = ['permission', 'user.nickname', 'user.account_id', 'user.uuid']
+        else:
+            api_url = self.endpoint('repos-permissions-groups', repository)
+            fields = ['permission', 'group.slug']
+
+        async for value in self.paginate(api_url, fields=fields):
+            if scope == 'user':
+                yield {
+                    'type': scope,
+                    'name': value['user'].get('nickname'),
+                    'perm': value['permission'],
+                    'account_id': value['user'].get('account_id'),
+                    'uuid': value['user'].get('uuid'),
+                }
+            else:
+                yield {'type': scope, 'name': value['group']['slug'], 'perm': value['permission']}
+
+    async def collect(self, iterator):
+        """
+        Items of an async iterator as a list
+        """
+
+        return [item async for item in iterator]
+
+    async def manage_repository_variables(
+        self,
+        action,
+        name,
+        value,
+        uuid=None,
+        secured=False,
+        repository=None):
+        """
+        CRUD variables on repository
+        """
+
+        api_url = self.endpoint('repos-pipeline', repository) + '/variables/'
+
+        if action == 'create':
+            return await self.expect(
+                api_url, 'POST', (200, 201), data={'key': name, 'value': value, 'secured': secured}, fields='uuid')
+
+        if action == 'update':
+            return await self.expect(
+                api_url + uuid, 'PUT', (200,),
+                data={'key': name, 'value': value, 'secured': secured, 'uuid': uuid}, fields='uuid')
+
+        return await self.expect(api_url + uuid, 'DELETE', (200, 204), fields='uuid')
+
+    async def manage_repository_environments(
+        self,
+        action,
+        name,
+        category=None,
+        uuid=None,
+        repository=None):
+        """
+        Create or delete an environment on repository
+        """
+
+        api_url = self.endpoint('repos-environments', repository) + '/'
+
+        if action == 'create':
+            return await self.expect(
+                api_url, 'POST', (201,),
+                data={
+                    'name': name,
+                    'type': 'deployment_environment_type',
+                    'environment_type': {'type': 'deployment_environment_type', 'name': category},
+                },
+                fields='uuid')
+
+        return await self.expect(api_url + uuid, 'DELETE', (204,), fields='uuid')
+
+    async def manage_environment_variables(
+        self,
+        action,
+        name,
+        value,
+        env_uuid=None,
+        var_uuid=None,
+        secured=False,
+        repository=None):
+        """
+        CRUD variables on environment
+        """
+
+        api_url = self.endpoint('repos-deployments', repository) + '/environments/' + env_uuid + '/variables'
+
+        if action == 'create':
+            return await self.expect(
+                api_url, 'POST', (200, 201), data={'key': name, 'value': value, 'secured': secured}, fields='uuid')
+
+        if action == 'update':
+            return await self.expect(
+                api_url + '/' + var_uuid, 'PUT', (200,),
+                data={'key': name, 'value': value, 'secured': secured, 'uuid': var_uuid}, fields='uuid')
+
+        return await self.expect(api_url + '/' + var_uuid, 'DELETE', (200, 204), fields='uuid')
+
+    async def apply_repository_permissions(
+        self,
+        action,
+        scope,
+        name,
+        perm=None,
+        repository=None):
+        """
+        Promote or demote either a user's or a group's permission level on repository
+        scope: either 'user' or 'group'.
+        """
+
+        api_url = self.endpoint(
+            'repos-permissions-users' if scope == 'user' else 'repos-permissions-groups', repository) + '/' + name
+
+        if action == 'promote':
+            return await self.expect(api_url, 'PUT', (200, 201), data={'permission': perm}, fields='permission')
+
+        return await self.expect(api_url, 'DELETE', (200, 204), fields='permission')
+
+async def read_repository(
+    client,
+    repository,
+    info=None):
+    """
+    Counterpart of bitbucket_snapshot.read_repository, the listings of the repository are read at the same time.
+    Returns None when the repository doesn't exist.
+    """
+
+    if info is None:
+        info = await client.get_repository_info(repository)
+        if not info:
+            return None
+
+    async def read_environment(env):
+        return dict(
+            uuid=env['uuid'],
+            name=env['name'],
+            environment_type=dict(name=env['environment_type']['name']),
+            variables=await client.collect(client.iter_environment_variables(env['uuid'], repository)),
+        )
+
+    variables, environments, groups = await asyncio.gather(
+        client.collect(client.iter_repository_variables(repository)),
+        client.collect(client.iter_repository_environments(repository)),
+        client.collect(client.iter_repository_permissions('group', repository)),
+    )
+
+    return dict(
+        slug=repository,
+        info=dict(uuid=info.get('uuid'), full_name=info.get('full_name')),
+        variables=variables,
+        environments=list(await asyncio.gather(*[read_environment(env) for env in environments])),
+        groups=groups,
+    )
+
+async def read_repositories(
+    bitbucket,
+    repositories=None,
+    workers=None):
+    """
+    Read repositories with an AsyncBitbucketClient configured like the helper, every repository of
+    the workspace when `repositories` is None. The counters of the client are added to the helper.
+    """
+
+    async with AsyncBitbucketClient.from_params(bitbucket.module.params, max_concurrency=workers) as client:
+        if repositories is None:
+            targets = [(info['slug'], info) async for info in client.iter_workspace_repositories()]
+        else:
+            targets = [(repository, None) for repository in repositories]
+
+        entries = await asyncio.gather(*[read_repository(client, slug, info) for slug, info in targets])
+
+        stats = client.get_stats()
+        bitbucket.add_stats(**dict((name, stats[name]) for name in ('retries', 'retry_wait_seconds', 'pages_fetched', 'bytes_received')))
+
+    return [entry for entry in entries if entry is not None]
+
+def scan_workspace(
+    bitbucket,
+    snapshot,
+    repositories=None,
+    workers=None):
+    """
+    Read repositories from one thread with up to `workers` requests in flight (`max_concurrency` by default)
+    and save them on the snapshot, as bitbucket_snapshot.build_snapshot does with a pool of threads.
+    Every repository of the workspace is read, and the index saved, when `repositories` is None.
+    Use it only when AsyncBitbucketClient.supports the helper. Returns the entries by slug.
+    """
+
+    entries = asyncio.run(read_repositories(bitbucket, repositories, workers))
+
+    for entry in entries:
+        snapshot.store(entry)
+
+    if repositories is None:
+        snapshot.save_index([entry['slug'] for entry in entries])
+
+    return dict((entry['slug'], entry) for entry in entries)
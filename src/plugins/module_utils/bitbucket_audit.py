@@ -0,0 +1,190 @@
+"""
+Util class to audit the drift of the repositories of the workspace against a manifest
+"""
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import json
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from ansible.module_utils._text import to_text
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket import BitbucketError
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_reconcile import (
+    prepare_environment_variables,
+    prepare_permissions,
+    prepare_variables,
+)
+
+#
+# class: DriftAudit
+#
+
+class DriftAudit:
+    """
+    Class DriftAudit
+
+    Compare every repository of the workspace with its entry of the manifest, or with `default`
+    when it has none, and write a JSON line for every difference as soon as it is found.
+    The repositories are listed one page at a time, the variables, environments and permissions of
+    each repository are read as separate tasks and at most `workers` tasks are in flight, so the
+    memory used doesn't grow with the size of the workspace.
+    Nothing is changed on Bitbucket.
+    """
+
+    def __init__(self, bitbucket, manifest, params, default=None, workers=None):
+        self.bitbucket = bitbucket
+        self.manifest = dict((spec['name'].casefold(), spec) for spec in manifest)
+        self.params = params
+        self.default = default
+        self.workers = max(1, workers or params['max_concurrency'])
+
+    def audit_variables(self, repository, variables):
+        """
+        Drift of the pipeline variables of a repository
+        """
+
+        plan = prepare_variables(self.bitbucket, repository, variables, self.params).plan
+        return [dict(change, scope='variables') for change in plan.describe()]
+
+    def audit_environments(self, repository, environments):
+        """
+        Drift of the deployment environments of a repository and of their variables, environments that
+        are not in the manifest are not drift
+        """
+
+        current_environments = {}
+        for env in self.bitbucket.iter_repository_environments(repository):
+            current_environments[(env['name'].casefold(), env['environment_type']['name'].casefold())] = env['uuid']
+
+        records = []
+        for env in environments:
+            env_uuid = current_environments.get((env['name'].casefold(), env['type'].casefold()))
+            current_variables = None
+            if env_uuid is None:
+                records.append(dict(scope='environments', action='create', name=env['name']))
+                current_variables = []
+
+            if env.get('variables') is not None:
+                plan = prepare_environment_variables(
+                    self.bitbucket, repository, env_uuid, env['variables'], self.params, current_variables).plan
+                scope = 'environment:{0}'.format(env['name'])
+                records.extend(dict(change, scope=scope) for change in plan.describe())
+
+        return records
+
+    def audit_permissions(self, repository, permissions):
+        """
+        Drift of the permissions of a repository. Users given by nickname without permission on the
+        repository can't be matched to an account, they are reported as missing with a note.
+        """
+
+        unresolved = []
+        plan = prepare_permissions(self.bitbucket, repository, permissions, unresolved=unresolved).plan
+        records = [dict(change, scope='permissions') for change in plan.describe()]
+        records.extend(
+            dict(scope='permissions', action='create', name=name,
+                 msg='User given by nickname, it must be given by account ID or UUID to be applied')
+            for name in unresolved)
+
+        return records
+
+    def tasks(self, spec):
+        """
+        Reads needed to audit a repository, one for each part of it in the manifest
+        """
+
+        tasks = []
+        for scope, function in (
+                ('variables', self.audit_variables),
+                ('environments', self.audit_environments),
+                ('permissions', self.audit_permissions)):
+            if spec.get(scope) is not None:
+                tasks.append((scope, function, spec[scope]))
+
+        return tasks
+
+    def run_task(self, repository, scope, function, desired):
+        """
+        Run a read of a repository, an error becomes a record of the scope
+        """
+
+        try:
+            with self.bitbucket.raising_errors():
+                return function(repository, desired)
+        except BitbucketError as exc:
+            return [dict(scope=scope, action='error', msg=to_text(exc))]
+
+    def run(self, stream):
+        """
+        Audit the workspace writing the records to `stream`, returns a summary of the audit
+        """
+
+        summary = dict(repositories=0, drifted=0, failed=0, unmanaged=0, missing=0, records=0, actions={})
+        # repositories with tasks in flight: number of tasks left and actions found so far
+        in_flight = {}
+        running = {}
+        seen = set()
+
+        def write(repository, records):
+            for record in records:
+                record['repository'] = repository
+                stream.write(json.dumps(record, sort_keys=True) + '\n')
+                summary['records'] += 1
+                summary['actions'][record['action']] = summary['actions'].get(record['action'], 0) + 1
+            stream.flush()
+
+        def finish(actions):
+            summary['repositories'] += 1
+            if 'error' in actions:
+                summary['failed'] += 1
+            elif actions:
+                summary['drifted'] += 1
+
+        def collect(return_when):
+            done, dummy = wait(list(running), return_when=return_when)
+            for future in done:
+                repository = running.pop(future)
+                records = future.result()
+                write(repository, records)
+
+                state = in_flight[repository]
+                state['tasks'] -= 1
+                state['actions'].update(record['action'] for record in records)
+                if state['tasks'] == 0:
+                    finish(in_flight.pop(repository)['actions'])
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for info in self.bitbucket.iter_workspace_repositories(prefetch=False):
+                repository = info['slug']
+                spec = self.manifest.get(repository.casefold())
+                if spec is not None:
+                    seen.add(repository.casefold())
+                else:
+                    spec = self.default
+
+                if spec is None:
+                    write(repository, [dict(scope='repository', action='unmanaged')])
+                    summary['unmanaged'] += 1
+                    continue
+
+                tasks = self.tasks(spec)
+                if not tasks:
+                    finish(set())
+                    continue
+
+                in_flight[repository] = dict(tasks=len(tasks), actions=set())
+                for scope, function, desired in tasks:
+                    while len(running) >= self.workers:
+                        collect(FIRST_COMPLETED)
+                    running[executor.submit(self.run_task, repository, scope, function, desired)] = repository
+
+            while running:
+                collect(FIRST_COMPLETED)
+
+        for name, spec in self.manifest.items():
+            if name not in seen:
+                write(spec['name'], [dict(scope='repository', action='missing')])
+                summary['missing'] += 1
+
+        return summary
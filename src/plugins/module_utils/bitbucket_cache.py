@@ -0,0 +1,234 @@
+"""
+Util classes to cache the responses of BitbucketHelper
+"""
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import contextlib
+import copy
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+#
+# class: ResponseCache
+#
+
+class ResponseCache:
+    """
+    Class ResponseCache
+
+    In-memory cache of GET responses for one module run, keyed by method and URL.
+    Entries expire after `ttl` seconds and the least recently used one is evicted
+    once the cache holds `size` entries.
+    """
+
+    def __init__(self, ttl, size):
+        self.ttl = ttl
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def enabled(self):
+        """
+        The cache is disabled when ttl or size are 0
+        """
+
+        return self.ttl > 0 and self.size > 0
+
+    def get(self, method, url):
+        """
+        Return a copy of the cached (info, content) of a request, None when it isn't cached
+        """
+
+        key = (method, url)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(entry[1])
+
+    def put(self, method, url, response):
+        """
+        Store the (info, content) of a request
+        """
+
+        key = (method, url)
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, copy.deepcopy(response))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, url):
+        """
+        Drop the entries of the path changed by a mutation, of the resources below it
+        and of the collections above it
+        """
+
+        path = normalize_path(url)
+        with self._lock:
+            for key in list(self._entries):
+                cached = normalize_path(key[1])
+                if is_sub_path(cached, path) or is_sub_path(path, cached):
+                    del self._entries[key]
+
+#
+# class: DiskCache
+#
+
+class DiskCache:
+    """
+    Class DiskCache
+
+    On-disk cache of GET responses shared by every module run that uses the same directory.
+    Entries are keyed by URL and credential identity and keep the ETag/Last-Modified of the
+    response, so requests can be sent as conditional requests and a 304 served from disk.
+    Entries are replaced atomically and writers hold an exclusive lock on the entry, so
+    several Ansible forks can share the directory.
+    """
+
+    def __init__(self, path, identity):
+        self.path = os.path.expanduser(path)
+        self.identity = hashlib.sha256(identity.encode('utf-8')).hexdigest()
+        self.hits = 0
+        self.stores = 0
+        self._lock = threading.Lock()
+
+    def entry_path(self, url):
+        """
+        File that holds the entry of an URL
+        """
+
+        key = hashlib.sha256((self.identity + ' ' + url).encode('utf-8')).hexdigest()
+        return os.path.join(self.path, key[:2], key + '.json')
+
+    def load(self, url):
+        """
+        Return the entry of an URL, None when it isn't cached or can't be read
+        """
+
+        try:
+            with open(self.entry_path(url), 'r', encoding='utf-8') as entry_file:
+                entry = json.load(entry_file)
+        except (IOError, OSError, ValueError):
+            return None
+
+        if entry.get('url') != url:
+            return None
+
+        return entry
+
+    @staticmethod
+    def conditional_headers(entry):
+        """
+        Headers to validate a cached entry
+        """
+
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        return headers
+
+    def hit(self):
+        """
+        Count a response served from disk
+        """
+
+        with self._lock:
+            self.hits += 1
+
+    def store(self, url, info, body):
+        """
+        Save a response that carries an ETag or a Last-Modified header
+        """
+
+        if not info.get('etag') and not info.get('last-modified'):
+            return
+
+        entry_path = self.entry_path(url)
+        entry = dict(
+            url=url,
+            etag=info.get('etag'),
+            last_modified=info.get('last-modified'),
+            body=body.decode('utf-8'),
+        )
+
+        try:
+            make_private_dirs(self.path)
+            make_private_dirs(os.path.dirname(entry_path))
+            with file_lock(entry_path + '.lock'):
+                write_atomic(entry_path, json.dumps(entry))
+        except (IOError, OSError):
+            # the cache is an optimization, a failed write only means the next run downloads again
+            return
+
+        with self._lock:
+            self.stores += 1
+
+def make_private_dirs(path):
+    """
+    Create a directory only readable by the current user
+    """
+
+    if not os.path.isdir(path):
+        os.makedirs(path, mode=0o700, exist_ok=True)
+
+@contextlib.contextmanager
+def file_lock(path, shared=False):
+    """
+    Hold a lock on a file, it works across processes
+    """
+
+    with open(path, 'a', encoding='utf-8') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield lock_file
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def write_atomic(path, data):
+    """
+    Replace the content of a file so readers never see a partial write, data can be text or bytes
+    """
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb' if isinstance(data, bytes) else 'w') as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+def normalize_path(url):
+    """
+    Path of an URL without the query string and the trailing slash
+    """
+
+    return urlsplit(url).path.rstrip('/')
+
+def is_sub_path(path, parent):
+    """
+    Whether `path` is `parent` or is below it
+    """
+
+    return path == parent or path.startswith(parent + '/')
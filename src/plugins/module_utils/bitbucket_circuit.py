@@ -0,0 +1,172 @@
+"""
+Util class to stop sending requests to the Bitbucket API while it is failing
+"""
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_cache import file_lock, make_private_dirs, write_atomic
+
+#
+# class: CircuitBreaker
+#
+
+class CircuitBreaker:
+    """
+    Class CircuitBreaker
+
+    Circuit breaker shared by every module process of the controller through a local state file.
+    It opens after `threshold` consecutive failures (network errors and 5xx responses), then every
+    request fails at once without being sent. After `cooldown` seconds one process is allowed to
+    send a probe (half-open), the circuit closes if it succeeds and opens again if it fails.
+    A probe that doesn't report back in `cooldown` seconds lets another process probe.
+    """
+
+    DEFAULT_PATH = '~/.ansible/bitbucket/circuit'
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, threshold, cooldown, identity, path=None):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        directory = os.path.expanduser(path or self.DEFAULT_PATH)
+        name = hashlib.sha256(identity.encode('utf-8')).hexdigest()[:16]
+        self.path = os.path.join(directory, name + '.json')
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def argument_spec():
+        """
+        Arguments of the modules to enable the circuit breaker
+        """
+
+        return dict(
+            circuit_threshold=dict(
+                type='int',
+                default=0),
+            circuit_cooldown=dict(
+                type='int',
+                default=60),
+            circuit_path=dict(
+                type='path',
+                required=False,
+                default=None),
+        )
+
+    @classmethod
+    def from_params(cls, params):
+        """
+        Circuit breaker configured by the module parameters, None when `circuit_threshold` is 0
+        """
+
+        if not params.get('circuit_threshold'):
+            return None
+
+        return cls(
+            params['circuit_threshold'],
+            params['circuit_cooldown'],
+            identity=params['url'],
+            path=params['circuit_path'])
+
+    @staticmethod
+    def is_failure(status):
+        """
+        Whether a response means the API is degraded, 429 is left to the retries and the rate limit
+        """
+
+        return status == -1 or status >= 500
+
+    def load(self):
+        """
+        State of the circuit, a missing or unreadable file is a closed circuit
+        """
+
+        try:
+            with open(self.path, encoding='utf-8') as state_file:
+                state = json.load(state_file)
+            if state.get('state') in (self.CLOSED, self.OPEN, self.HALF_OPEN):
+                return state
+        except (IOError, OSError, ValueError):
+            pass
+
+        return dict(state=self.CLOSED, failures=0, since=0.0)
+
+    def save(self, state):
+        """
+        Write the state of the circuit
+        """
+
+        write_atomic(self.path, json.dumps(state))
+
+    def allow(self):
+        """
+        Whether a request can be sent, a process allowed while the circuit is not closed sends the probe
+        """
+
+        try:
+            make_private_dirs(os.path.dirname(self.path))
+            with file_lock(self.path + '.lock', shared=True):
+                state = self.load()
+            if state['state'] == self.CLOSED:
+                return True
+
+            with file_lock(self.path + '.lock'):
+                state = self.load()
+                now = time.time()
+                if state['state'] == self.CLOSED:
+                    return True
+                if now - state['since'] < self.cooldown:
+                    with self._lock:
+                        self.rejected += 1
+                    return False
+                # the cooldown of the open circuit or of a lost probe is over, send a probe
+                state.update(state=self.HALF_OPEN, since=now)
+                self.save(state)
+                return True
+        except (IOError, OSError):
+            # without its file the circuit can't be shared, let the requests go
+            return True
+
+    def record(self, status):
+        """
+        Count the outcome of a request that was sent
+        """
+
+        failure = self.is_failure(status)
+
+        try:
+            with file_lock(self.path + '.lock', shared=True):
+                state = self.load()
+            if not failure and state['state'] == self.CLOSED and state['failures'] == 0:
+                return
+
+            with file_lock(self.path + '.lock'):
+                state = self.load()
+                if not failure:
+                    state.update(state=self.CLOSED, failures=0, since=time.time())
+                else:
+                    state['failures'] += 1
+                    if state['state'] == self.HALF_OPEN or (
+                            state['state'] == self.CLOSED and state['failures'] >= self.threshold):
+                        state.update(state=self.OPEN, since=time.time())
+                self.save(state)
+        except (IOError, OSError):
+            pass
+
+    def remaining(self):
+        """
+        Seconds until the open circuit lets a probe through
+        """
+
+        state = self.load()
+        return max(0, int(math.ceil(self.cooldown - (time.time() - state['since']))))
@@ -0,0 +1,110 @@
+"""
+Util class to adapt the number of mutations sent at the same time to the Bitbucket API
+"""
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import threading
+
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_trace import percentile
+
+#
+# class: AdaptiveLimiter
+#
+
+class AdaptiveLimiter:
+    """
+    Class AdaptiveLimiter
+
+    Additive increase, multiplicative decrease (AIMD) of the requests in flight. The limit starts
+    at half of `ceiling` and, after every window of `limit` healthy completions, grows by one up
+    to `ceiling`. It is halved, down to `floor`, when a completion was throttled (429, 5xx or a
+    network error) or when the p95 latency of a window goes over `latency_factor` times the best
+    p95 seen so far. A throttled completion only cuts the limit once per window, the requests that
+    were already in flight are throttled by the same congestion.
+    """
+
+    def __init__(self, ceiling, floor=1, latency_factor=2.0):
+        self.ceiling = max(floor, ceiling)
+        self.floor = floor
+        self.latency_factor = latency_factor
+        self.limit = max(floor, self.ceiling // 2)
+        self.in_flight = 0
+        self.completed = 0
+        self.last_cut = 0
+        self.window = []
+        self.baseline = None
+        self.trajectory = [dict(completed=0, limit=self.limit, reason='start')]
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """
+        Wait until one more request fits in the limit
+        """
+
+        with self._condition:
+            while self.in_flight >= self.limit:
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, duration, throttled):
+        """
+        Record the completion of a request, its duration in seconds and whether it was throttled
+        """
+
+        with self._condition:
+            self.in_flight -= 1
+            self.completed += 1
+
+            if throttled:
+                if self.completed - self.last_cut >= self.limit:
+                    self.cut('throttled')
+            else:
+                self.window.append(duration * 1000)
+                if len(self.window) >= self.limit:
+                    self.close_window()
+
+            self._condition.notify_all()
+
+    def close_window(self):
+        """
+        Grow or cut the limit from the latency of a full window of completions
+        """
+
+        p95 = percentile(sorted(self.window), 95)
+        self.window = []
+
+        if self.baseline is not None and p95 > self.baseline * self.latency_factor:
+            self.cut('latency')
+            return
+
+        self.baseline = p95 if self.baseline is None else min(self.baseline, p95)
+        if self.limit < self.ceiling:
+            self.limit += 1
+            self.trajectory.append(dict(completed=self.completed, limit=self.limit, reason='healthy', p95_ms=round(p95, 3)))
+
+    def cut(self, reason):
+        """
+        Halve the limit
+        """
+
+        self.last_cut = self.completed
+        self.window = []
+        limit = max(self.floor, self.limit // 2)
+        if limit != self.limit:
+            self.limit = limit
+            self.trajectory.append(dict(completed=self.completed, limit=self.limit, reason=reason))
+
+    def report(self):
+        """
+        Limits used during the run, for the module result
+        """
+
+        with self._condition:
+            return dict(
+                ceiling=self.ceiling,
+                final=self.limit,
+                peak=max(point['limit'] for point in self.trajectory),
+                trajectory=list(self.trajectory),
+            )
@@ -0,0 +1,210 @@
+"""
+Util class to remember the values written to secured variables on Bitbucket
+"""
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import hashlib
+import hmac
+import json
+import os
+import threading
+
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_cache import file_lock, make_private_dirs, write_atomic
+
+#
+# class: FingerprintStore
+#
+
+class FingerprintStore:
+    """
+    Class FingerprintStore
+
+    Salted hashes (HMAC-SHA256) of the last value written to each secured variable of a scope,
+    a scope is the pipeline or one deployment environment of a repository. The API never returns
+    the value of secured variables, comparing fingerprints lets the modules skip the update when
+    the desired value didn't change.
+    Fingerprints are kept in a local file per scope or in a companion unsecured variable.
+    """
+
+    COMPANION_VARIABLE = 'ANSIBLE_SECURED_FINGERPRINTS'
+
+    DEFAULT_PATH = '~/.ansible/bitbucket/fingerprints'
+
+    def __init__(self, mode, salt, scope, path=None):
+        self.mode = mode
+        self.salt = salt.encode('utf-8')
+        self.scope = scope
+        self.path = os.path.expanduser(path or self.DEFAULT_PATH)
+        self.fingerprints = {}
+        self.changes = {}
+        self.companion = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def argument_spec():
+        """
+        Arguments of the modules that manage variables
+        """
+
+        return dict(
+            fingerprint_store=dict(
+                type='str',
+                choices=['none', 'local', 'variable'],
+                default='none'),
+            fingerprint_path=dict(
+                type='path',
+                required=False,
+                default=None),
+            fingerprint_salt=dict(
+                type='str',
+                no_log=True,
+                required=False,
+                default=None),
+        )
+
+    @classmethod
+    def from_params(cls, params, scope):
+        """
+        Build the store configured on the module, None when it is disabled
+        """
+
+        if params['fingerprint_store'] == 'none':
+            return None
+
+        return cls(params['fingerprint_store'], params['fingerprint_salt'], scope, params['fingerprint_path'])
+
+    def file_path(self):
+        """
+        Local file that holds the fingerprints of the scope
+        """
+
+        return os.path.join(self.path, hashlib.sha256(self.scope.encode('utf-8')).hexdigest() + '.json')
+
+    def read_file(self):
+        """
+        Fingerprints saved on the local file
+        """
+
+        try:
+            with open(self.file_path(), 'r', encoding='utf-8') as store_file:
+                return json.load(store_file).get('fingerprints', {})
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def load(self, current_variables):
+        """
+        Load the fingerprints of the scope.
+        Returns the current variables without the companion variable, so it is never reconciled.
+        """
+
+        variables = []
+        for var in current_variables:
+            if var['key'] == self.COMPANION_VARIABLE:
+                self.companion = var
+            else:
+                variables.append(var)
+
+        if self.mode == 'local':
+            self.fingerprints = self.read_file()
+        elif self.companion is not None:
+            try:
+                self.fingerprints = json.loads(self.companion.get('value') or '{}')
+            except ValueError:
+                self.fingerprints = {}
+
+        return variables
+
+    def fingerprint(self, var_uuid, value):
+        """
+        Salted hash of the value of a variable
+        """
+
+        message = '{0}/{1}\0{2}'.format(self.scope, var_uuid, value)
+        return hmac.new(self.salt, message.encode('utf-8'), hashlib.sha256).hexdigest()
+
+    def matches(self, var_uuid, value):
+        """
+        Whether the value is the last one we wrote to the variable
+        """
+
+        expected = self.fingerprints.get(var_uuid)
+        return expected is not None and hmac.compare_digest(expected, self.fingerprint(var_uuid, value))
+
+    def record(self, var_uuid, value):
+        """
+        Remember the value written to a secured variable, it can be called from several threads
+        """
+
+        with self._lock:
+            self.changes[var_uuid] = self.fingerprint(var_uuid, value)
+
+    def forget(self, var_uuid):
+        """
+        Drop the fingerprint of a variable that was deleted or is no longer secured
+        """
+
+        with self._lock:
+            if var_uuid in self.fingerprints or var_uuid in self.changes:
+                self.changes[var_uuid] = None
+
+    def written_callback(self, var, var_uuid=None):
+        """
+        Callback for the mutation that writes a variable, the UUID of new variables comes from the response
+        """
+
+        def callback(content):
+            written_uuid = var_uuid or content.get('uuid')
+            if var['secured']:
+                self.record(written_uuid, var['value'])
+            else:
+                self.forget(written_uuid)
+
+        return callback
+
+    def deleted_callback(self, var_uuid):
+        """
+        Callback for the mutation that deletes a variable
+        """
+
+        return lambda content: self.forget(var_uuid)
+
+    def merge(self, fingerprints):
+        """
+        Apply the changes of this run on top of saved fingerprints
+        """
+
+        merged = dict(fingerprints)
+        for var_uuid, fingerprint in self.changes.items():
+            if fingerprint is None:
+                merged.pop(var_uuid, None)
+            else:
+                merged[var_uuid] = fingerprint
+
+        return merged
+
+    def save(self, write_variable):
+        """
+        Save the fingerprints changed during the run.
+        write_variable: function receiving (action, name, value, uuid, secured) used to write the companion variable.
+        """
+
+        if not self.changes:
+            return
+
+        if self.mode == 'local':
+            make_private_dirs(self.path)
+            # other forks can save the same scope, merge with what is on disk under the lock
+            with file_lock(self.file_path() + '.lock'):
+                write_atomic(self.file_path(), json.dumps(dict(
+                    scope=self.scope,
+                    fingerprints=self.merge(self.read_file()),
+                )))
+            return
+
+        value = json.dumps(self.merge(self.fingerprints), sort_keys=True)
+        if self.companion is None:
+            write_variable('create', self.COMPANION_VARIABLE, value, None, False)
+        else:
+            write_variable('update', self.COMPANION_VARIABLE, value, self.companion['uuid'], False)
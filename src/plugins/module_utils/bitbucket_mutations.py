@@ -0,0 +1,141 @@
+"""
+Util class to run the changes computed by the Bitbucket modules
+"""
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import contextlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ansible.module_utils._text import to_text
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket import BitbucketError
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_concurrency import AdaptiveLimiter
+
+#
+# class: MutationExecutor
+#
+
+class MutationExecutor:
+    """
+    Class MutationExecutor
+
+    Runs mutations, dicts with `name`, `action` and `function`, a callable that sends the request,
+    and optionally `on_success`, a callable receiving the content returned by `function`.
+    Errors of a mutation are recorded on its outcome instead of failing the module, so every
+    mutation is tried. With `adaptive_concurrency` the limits used are kept on `reports`.
+    slot: context manager held while a mutation runs, to share a limit of work running at the same
+    time with other work, e.g. ProvisioningGraph.slot.
+    """
+
+    def __init__(self, bitbucket, slot=None):
+        self.bitbucket = bitbucket
+        self.slot = slot or contextlib.nullcontext
+        self.reports = []
+        self.lock = threading.Lock()
+
+    def run(self, mutation):
+        """
+        Run one mutation and return its outcome
+        """
+
+        outcome = dict(
+            name=mutation['name'],
+            action=mutation['action'],
+            status='ok',
+        )
+
+        try:
+            with self.slot(), self.bitbucket.raising_errors():
+                content = mutation['function']()
+                if mutation.get('on_success') is not None:
+                    mutation['on_success'](content)
+        except BitbucketError as exc:
+            outcome['status'] = 'failed'
+            outcome['msg'] = to_text(exc)
+
+        return outcome
+
+    def execute(
+        self,
+        mutations,
+        workers=None):
+        """
+        Run mutations using up to `workers` threads, `max_concurrency` by default.
+        Returns the outcome of every mutation in the same order they were given.
+        """
+
+        workers = min(workers or self.bitbucket.module.params['max_concurrency'], len(mutations))
+
+        if workers <= 1:
+            return [self.run(mutation) for mutation in mutations]
+
+        if self.bitbucket.module.params.get('adaptive_concurrency'):
+            return self.execute_adaptive(mutations, workers)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(self.run, mutations))
+
+    def execute_adaptive(
+        self,
+        mutations,
+        workers):
+        """
+        Run mutations with a number of them in flight adapted by an AdaptiveLimiter, up to `workers`.
+        The limits used are kept to be reported by apply.
+        """
+
+        limiter = AdaptiveLimiter(workers)
+
+        def run(mutation):
+            started = time.time()
+            self.bitbucket.local.throttled = False
+            try:
+                return self.run(mutation)
+            finally:
+                limiter.release(time.time() - started, self.bitbucket.local.throttled)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = []
+            for mutation in mutations:
+                limiter.acquire()
+                futures.append(executor.submit(run, mutation))
+            outcomes = [future.result() for future in futures]
+
+        with self.lock:
+            self.reports.append(limiter.report())
+
+        return outcomes
+
+    def apply(
+        self,
+        result,
+        mutations,
+        finalize=None):
+        """
+        Run the mutations computed by a module and record their outcome on the result.
+        finalize: callable run once every mutation finished, even if some of them failed.
+        Then, the module fails if any mutation failed.
+        """
+
+        reports = len(self.reports)
+        outcomes = self.execute(mutations)
+        result.setdefault('mutations', []).extend(outcomes)
+        if len(self.reports) > reports:
+            result.setdefault('concurrency', []).extend(self.reports[reports:])
+
+        if finalize is not None:
+            finalize()
+
+        if any(outcome['status'] == 'ok' for outcome in outcomes):
+            result['changed'] = True
+
+        failed = [outcome for outcome in outcomes if outcome['status'] == 'failed']
+        if failed:
+            result['api_stats'] = self.bitbucket.get_stats()
+            self.bitbucket.module.fail_json(
+                msg='{0} of {1} changes failed'.format(len(failed), len(outcomes)),
+                **result
+            )
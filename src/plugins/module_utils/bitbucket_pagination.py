@@ -0,0 +1,110 @@
+"""
+Util functions to iterate over the paginated listings of the Bitbucket API
+"""
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# biggest page length accepted by the API
+PAGE_LENGTH = 100
+
+# attributes of a listing used by the paginator
+PAGE_FIELDS = ['size', 'page', 'pagelen', 'next']
+
+# pages of a listing fetched at the same time when they are prefetched
+PREFETCH_WORKERS = 10
+
+def add_query(url, **params):
+    """
+    Add parameters to the query string of an URL, replacing the ones it already has
+    """
+
+    parts = urlsplit(url)
+    query = [(key, value) for key, value in parse_qsl(parts.query) if key not in params]
+    query.extend(params.items())
+
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(query), parts.fragment))
+
+def request_page(bitbucket, api_url, page, fields=None):
+    """
+    Send the request of one page of a listing, returns the `info` and the content of the response
+    """
+
+    return bitbucket.request(
+        add_query(api_url, page=page, pagelen=PAGE_LENGTH),
+        module=bitbucket.module,
+        method='GET',
+        fields=fields,
+    )
+
+def page_content(bitbucket, api_url, page, response):
+    """
+    Content of the response of a page, fails the module when the page couldn't be read
+    """
+
+    info, content = response
+    if info['status'] != 200:
+        bitbucket.fail(msg='Unable to read page {0} of {1}: {2}'.format(page, api_url, info))
+
+    bitbucket.add_stats(pages_fetched=1)
+
+    return content
+
+def fetch_page(bitbucket, api_url, page, fields=None):
+    """
+    Fetch one page of a listing
+    """
+
+    return page_content(bitbucket, api_url, page, request_page(bitbucket, api_url, page, fields))
+
+def prefetch_pages(bitbucket, api_url, pages, fields=None):
+    """
+    Fetch several pages of a listing at the same time, returns them in the order they were given.
+    The responses are checked once all of them arrived, so a failure is raised on the calling thread.
+    """
+
+    with ThreadPoolExecutor(max_workers=min(PREFETCH_WORKERS, len(pages))) as executor:
+        responses = list(executor.map(lambda page: request_page(bitbucket, api_url, page, fields), pages))
+
+    return [page_content(bitbucket, api_url, page, response) for page, response in zip(pages, responses)]
+
+def paginate(bitbucket, api_url, fields=None, prefetch=False):
+    """
+    Iterate over every item of a paginated listing.
+    Pages are requested with the biggest page length allowed and only when the caller reaches them,
+    so callers can stop early. The URL of each page is built from its number because the `next`
+    link returned by some endpoints doesn't work (https://jira.atlassian.com/browse/BCLOUD-13806).
+    prefetch: once the first page arrived, fetch all the remaining pages at the same time using
+    the `size` of the listing.
+    fields: attributes of each item we need, the attributes used to paginate are always requested.
+    """
+
+    if fields:
+        fields = ','.join(['values.' + field for field in fields] + PAGE_FIELDS)
+
+    current_page = 1
+    while True:
+        content = fetch_page(bitbucket, api_url, current_page, fields)
+
+        values = content.get('values', [])
+        for value in values:
+            yield value
+
+        if 'next' not in content or not values:
+            return
+
+        pagelen = content.get('pagelen', PAGE_LENGTH)
+        if 'size' in content and current_page * pagelen >= content['size']:
+            return
+
+        if prefetch and 'size' in content:
+            last_page = (content['size'] + pagelen - 1) // pagelen
+            for content in prefetch_pages(bitbucket, api_url, list(range(current_page + 1, last_page + 1)), fields):
+                for value in content.get('values', []):
+                    yield value
+            return
+
+        current_page += 1
@@ -0,0 +1,193 @@
+"""
+Util class to save the plan computed by a Bitbucket module in check mode and apply it later
+"""
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_cache import make_private_dirs, write_atomic
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_pagination import PREFETCH_WORKERS
+
+#
+# class: ReadRecorder
+#
+
+class ReadRecorder:
+    """
+    Class ReadRecorder
+
+    URL, status and ETag of every GET sent by BitbucketHelper while a module computes its plan.
+    Reads are kept by URL in the order they were first sent. Nothing is recorded until `start`
+    is called, and the workspace snapshot is not used while the reads are recorded.
+    """
+
+    def __init__(self):
+        self.reads = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        """
+        Start recording the reads
+        """
+
+        self.reads = {}
+
+    def active(self):
+        """
+        Whether the reads are being recorded
+        """
+
+        return self.reads is not None
+
+    def record(self, api_url, info):
+        """
+        Record a GET when the reads are being recorded
+        """
+
+        if self.reads is None:
+            return
+
+        with self.lock:
+            if api_url not in self.reads:
+                self.reads[api_url] = dict(url=api_url, status=info['status'], etag=info.get('etag'))
+
+#
+# class: PlanFile
+#
+
+class PlanFile:
+    """
+    Class PlanFile
+
+    Plan computed by a module in check mode, with the URL, status and ETag of every read it was
+    computed from. A later run of the same task validates the ETags with conditional requests and,
+    when nothing changed on Bitbucket, applies the saved plan without reading the listings again.
+    Values of the variables are not saved, they come from the task arguments; a keyed digest of the
+    arguments makes sure the plan is only applied by the task that computed it.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path, module_name, digest):
+        self.path = os.path.expanduser(path)
+        self.module_name = module_name
+        self.digest = digest
+
+    @staticmethod
+    def argument_spec():
+        """
+        Arguments of the modules that support plan files
+        """
+
+        return dict(
+            plan_file=dict(
+                type='path',
+                required=False,
+                default=None),
+        )
+
+    @classmethod
+    def from_params(cls, params, module_name, keys):
+        """
+        Plan file configured on the module, None when it is not used.
+        keys: arguments of the module that define the desired state.
+        """
+
+        if not params.get('plan_file'):
+            return None
+
+        desired = dict((key, params.get(key)) for key in ['url', 'username'] + keys)
+        message = json.dumps(desired, sort_keys=True).encode('utf-8')
+        secret = (params.get('password') or '').encode('utf-8')
+
+        return cls(params['plan_file'], module_name, hmac.new(secret, message, hashlib.sha256).hexdigest())
+
+    def save(self, reads, state):
+        """
+        Save the plan and the reads it was computed from
+        reads: reads recorded by a ReadRecorder, by URL
+        """
+
+        make_private_dirs(os.path.dirname(os.path.abspath(self.path)))
+        write_atomic(self.path, json.dumps(dict(
+            version=self.VERSION,
+            module=self.module_name,
+            digest=self.digest,
+            created=time.time(),
+            reads=list(reads.values()),
+            state=state,
+        )))
+
+    def load(self):
+        """
+        Return the saved plan when it was computed by the same task, None otherwise
+        """
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as plan_file:
+                plan = json.load(plan_file)
+        except (IOError, OSError, ValueError):
+            return None
+
+        if plan.get('version') != self.VERSION or plan.get('module') != self.module_name:
+            return None
+
+        if not hmac.compare_digest(plan.get('digest', ''), self.digest):
+            return None
+
+        return plan
+
+    def discard(self):
+        """
+        Drop the plan once it was applied, the ETags it was validated with are not current anymore
+        """
+
+        try:
+            os.unlink(self.path)
+        except (IOError, OSError):
+            pass
+
+def validate_reads(bitbucket, reads):
+    """
+    Whether the responses of recorded reads didn't change, checked with conditional requests
+    """
+
+    if not reads or any(read['status'] == 200 and not read['etag'] for read in reads):
+        return False
+
+    def validate(read):
+        headers = {}
+        if read['etag']:
+            headers['If-None-Match'] = read['etag']
+        started = time.time()
+        info, body = bitbucket.send(read['url'], 'GET', headers, None)
+        if bitbucket.tracer is not None:
+            bitbucket.tracer.record('GET', read['url'], info['status'], started, bytes_received=len(body or b''))
+        if read['status'] == 200:
+            return info['status'] == 304
+        return info['status'] == read['status']
+
+    with ThreadPoolExecutor(max_workers=min(PREFETCH_WORKERS, len(reads))) as executor:
+        return all(executor.map(validate, reads))
+
+def load_valid_plan(bitbucket, plan_file):
+    """
+    State of the plan saved on `plan_file` when Bitbucket didn't change since it was computed, None otherwise
+    """
+
+    if plan_file is None:
+        return None
+
+    plan = plan_file.load()
+    if plan is None or not validate_reads(bitbucket, plan['reads']):
+        return None
+
+    return plan['state']
@@ -0,0 +1,167 @@
+"""
+Util class to run the steps of the provisioning of a repository as a dependency graph
+"""
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import contextlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from ansible.module_utils._text import to_text
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket import BitbucketError
+
+Node = namedtuple('Node', ['name', 'function', 'requires'])
+
+class NodeSkipped(Exception):
+    """
+    Raised by a node that has nothing to do, the nodes that require it are skipped too
+    """
+
+#
+# class: ProvisioningGraph
+#
+
+class ProvisioningGraph:
+    """
+    Class ProvisioningGraph
+
+    Directed acyclic graph of provisioning steps. A node runs as soon as every node it requires
+    finished, so independent nodes run at the same time on a pool of `workers` threads. Nodes are
+    added after the nodes they require, which keeps the graph acyclic. When a node fails or is
+    skipped, the nodes that depend on it are skipped and the others keep running.
+    A running node holds one of `workers` slots, and gives it back while it waits on work that
+    holds slots of its own, e.g. its changes, so no more than `workers` nodes and changes run together.
+    Each node reports its status, when it started and how long it took since the graph started.
+    """
+
+    def __init__(self, guard=None):
+        self.nodes = OrderedDict()
+        self.guard = guard or contextlib.nullcontext
+        self.slots = threading.BoundedSemaphore(1)
+
+    def add(self, name, function, requires=()):
+        """
+        Add a node, `function` is called without arguments and returns a dict added to the report of the node
+        """
+
+        if name in self.nodes:
+            raise ValueError('Node {0} is already in the graph'.format(name))
+
+        unknown = [dependency for dependency in requires if dependency not in self.nodes]
+        if unknown:
+            raise ValueError('Node {0} requires nodes not in the graph yet: {1}'.format(name, ', '.join(unknown)))
+
+        self.nodes[name] = Node(name, function, tuple(requires))
+
+    @contextlib.contextmanager
+    def slot(self):
+        """
+        Hold a slot while a node or a change runs
+        """
+
+        self.slots.acquire()
+        try:
+            yield
+        finally:
+            self.slots.release()
+
+    @contextlib.contextmanager
+    def waiting(self):
+        """
+        Give the slot of the running node back while it waits on work done by other threads
+        """
+
+        self.slots.release()
+        try:
+            yield
+        finally:
+            self.slots.acquire()
+
+    def run_node(self, node, started):
+        """
+        Run the function of a node and build its report
+        """
+
+        report = dict(name=node.name, requires=list(node.requires), status='ok')
+        node_started = time.time()
+        try:
+            with self.slot(), self.guard():
+                report.update(node.function() or {})
+        except NodeSkipped as exc:
+            report.update(status='skipped', msg=to_text(exc))
+        except BitbucketError as exc:
+            report.update(status='failed', msg=to_text(exc))
+        except Exception as exc:  # pylint: disable=broad-except
+            # a bug in one node must not stop the others, it is reported like any failure
+            report.update(status='failed', msg='{0}: {1}'.format(type(exc).__name__, to_text(exc)))
+
+        report['start_ms'] = round((node_started - started) * 1000, 3)
+        report['duration_ms'] = round((time.time() - node_started) * 1000, 3)
+
+        return report
+
+    def run(self, workers):
+        """
+        Run every node and return their reports in the order they were added
+        """
+
+        started = time.time()
+        reports = {}
+        pending = OrderedDict(self.nodes)
+        running = {}
+        self.slots = threading.BoundedSemaphore(max(1, workers))
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            while pending or running:
+                for name, node in list(pending.items()):
+                    blocked = [dependency for dependency in node.requires
+                               if dependency in reports and reports[dependency]['status'] != 'ok']
+                    if blocked:
+                        reports[name] = dict(
+                            name=name,
+                            requires=list(node.requires),
+                            status='skipped',
+                            msg='Required node {0} did not finish'.format(blocked[0]),
+                            start_ms=None,
+                            duration_ms=0.0,
+                        )
+                        del pending[name]
+                    elif all(dependency in reports for dependency in node.requires):
+                        running[executor.submit(self.run_node, node, started)] = name
+                        del pending[name]
+
+                if not running:
+                    break
+
+                done, dummy = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    reports[running.pop(future)] = future.result()
+
+        return [reports[name] for name in self.nodes]
+
+def critical_path(reports):
+    """
+    Chain of nodes that finished last, each one waiting on the dependency that finished last.
+    Shortening any of them shortens the whole run.
+    """
+
+    by_name = dict((report['name'], report) for report in reports if report['start_ms'] is not None)
+
+    def end(report):
+        return report['start_ms'] + report['duration_ms']
+
+    if not by_name:
+        return []
+
+    path = []
+    current = max(by_name.values(), key=end)
+    while current is not None:
+        path.append(current['name'])
+        dependencies = [by_name[name] for name in current['requires'] if name in by_name]
+        current = max(dependencies, key=end) if dependencies else None
+
+    return list(reversed(path))
@@ -0,0 +1,137 @@
+"""
+Util class to share the request budget of the Bitbucket API between module processes
+"""
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import hashlib
+import json
+import os
+import time
+
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_cache import file_lock, make_private_dirs, write_atomic
+
+#
+# class: SharedTokenBucket
+#
+
+class SharedTokenBucket:
+    """
+    Class SharedTokenBucket
+
+    Token bucket kept in a local file, so every module process of the controller (one per fork)
+    draws from the same budget of requests. The bucket refills at `rate` requests per hour and
+    holds up to `burst` tokens. A caller that finds it empty reserves the next token anyway and
+    sleeps until it is due, outside the lock, which spaces the requests evenly instead of letting
+    them go out at once and come back as 429.
+    """
+
+    DEFAULT_PATH = '~/.ansible/bitbucket/ratelimit'
+
+    def __init__(self, rate, burst, identity, path=None):
+        self.rate = rate / 3600.0
+        self.burst = max(1, burst)
+        directory = os.path.expanduser(path or self.DEFAULT_PATH)
+        # the quota of Bitbucket is counted by user, each one has its own bucket
+        name = hashlib.sha256(identity.encode('utf-8')).hexdigest()[:16]
+        self.path = os.path.join(directory, name + '.json')
+
+    @staticmethod
+    def argument_spec():
+        """
+        Arguments of the modules to share a rate limit
+        """
+
+        return dict(
+            rate_limit=dict(
+                type='int',
+                default=0),
+            rate_limit_burst=dict(
+                type='int',
+                default=10),
+            rate_limit_path=dict(
+                type='path',
+                required=False,
+                default=None),
+        )
+
+    @classmethod
+    def from_params(cls, params):
+        """
+        Bucket configured by the module parameters, None when `rate_limit` is 0
+        """
+
+        if not params.get('rate_limit'):
+            return None
+
+        return cls(
+            params['rate_limit'],
+            params['rate_limit_burst'],
+            identity='{0}:{1}'.format(params['url'], params['username']),
+            path=params['rate_limit_path'])
+
+    def load(self):
+        """
+        Tokens left and time they were counted, a missing or unreadable file is a full bucket
+        """
+
+        try:
+            with open(self.path, encoding='utf-8') as state_file:
+                state = json.load(state_file)
+            return float(state['tokens']), float(state['updated'])
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return float(self.burst), time.time()
+
+    def save(self, tokens, updated):
+        """
+        Write the state of the bucket
+        """
+
+        write_atomic(self.path, json.dumps(dict(tokens=tokens, updated=updated)))
+
+    def update(self, take=1, drain=False):
+        """
+        Refill the bucket, take tokens from it and return the seconds until they are due
+        """
+
+        make_private_dirs(os.path.dirname(self.path))
+        with file_lock(self.path + '.lock'):
+            tokens, updated = self.load()
+            now = time.time()
+            tokens = min(self.burst, tokens + max(0.0, now - updated) * self.rate)
+            if drain:
+                tokens = min(tokens, 0.0)
+            tokens -= take
+            self.save(tokens, now)
+
+        if tokens >= 0:
+            return 0.0
+
+        return -tokens / self.rate
+
+    def acquire(self):
+        """
+        Wait for a token before sending a request, returns the seconds waited
+        """
+
+        try:
+            delay = self.update()
+        except (IOError, OSError):
+            # the limiter can't be shared without its file, don't hold the requests back
+            return 0.0
+
+        if delay > 0:
+            time.sleep(delay)
+
+        return delay
+
+    def drain(self):
+        """
+        Empty the bucket after Bitbucket answered 429, so every process slows down instead of retrying at once
+        """
+
+        try:
+            self.update(take=0, drain=True)
+        except (IOError, OSError):
+            pass
@@ -0,0 +1,452 @@
+"""
+Util functions to compare the desired and current state of Bitbucket resources
+"""
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from ansible.module_utils._text import to_text
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket import BitbucketError
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_fingerprint import FingerprintStore
+
+# one change of a plan
+# action: create, update or delete
+# key: case-folded key that matched both sides
+# desired: item requested by the user, None for deletes
+# current: item returned by the API, None for creates
+Change = namedtuple('Change', ['action', 'key', 'desired', 'current'])
+
+# changes ready to be applied with BitbucketHelper
+# plan: the ReconcilePlan
+# mutations: list of mutations for MutationExecutor.execute
+# finalize: callable to run once the mutations finished, or None
+# state: what the plan was computed from, it can be saved on a plan file and given back to prepare the same changes
+PreparedChanges = namedtuple('PreparedChanges', ['plan', 'mutations', 'finalize', 'state'])
+
+#
+# class: ReconcilePlan
+#
+
+class ReconcilePlan:
+    """
+    Class ReconcilePlan
+
+    Ordered list of changes needed to move the current items to the desired ones.
+    Creates and updates follow the order of the desired items, deletes come last.
+    """
+
+    def __init__(self, changes=None):
+        self.changes = changes or []
+
+    def __len__(self):
+        return len(self.changes)
+
+    def __iter__(self):
+        return iter(self.changes)
+
+    def by_action(self, action):
+        """
+        Changes of one action
+        """
+
+        return [change for change in self.changes if change.action == action]
+
+    @property
+    def creates(self):
+        """
+        Items that need to be created
+        """
+
+        return self.by_action('create')
+
+    @property
+    def updates(self):
+        """
+        Items that need to be updated
+        """
+
+        return self.by_action('update')
+
+    @property
+    def deletes(self):
+        """
+        Items that need to be deleted
+        """
+
+        return self.by_action('delete')
+
+    def summary(self):
+        """
+        Number of changes by action
+        """
+
+        return dict(
+            create=len(self.creates),
+            update=len(self.updates),
+            delete=len(self.deletes),
+        )
+
+    def describe(self):
+        """
+        Action and name of every change, without values
+        """
+
+        return [
+            dict(action=change.action, name=item_name(change.desired or change.current))
+            for change in self.changes]
+
+    def export(self):
+        """
+        Changes without the desired items, that come from the module arguments when the plan is restored
+        """
+
+        return [dict(action=change.action, key=change.key, current=change.current) for change in self.changes]
+
+    @classmethod
+    def restore(cls, changes, desired, desired_key):
+        """
+        Rebuild an exported plan with the desired items
+        """
+
+        desired_index = index_by_key(desired, desired_key)
+
+        return cls([
+            Change(change['action'], change['key'],
+                   None if change['action'] == 'delete' else desired_index[change['key']],
+                   change['current'])
+            for change in changes])
+
+def item_name(item):
+    """
+    Name of a desired or current item, variables from the API use `key`
+    """
+
+    return item['name'] if 'name' in item else item['key']
+
+def index_by_key(items, key_of):
+    """
+    Index items by their case-folded key, the last item wins when keys are repeated
+    """
+
+    index = {}
+    for item in items:
+        index[key_of(item).casefold()] = item
+
+    return index
+
+def plan_changes(
+    desired,
+    current,
+    desired_key,
+    current_key,
+    needs_update,
+    keep=None):
+    """
+    Compare desired and current items indexing both sides once by their case-folded key.
+    desired_key, current_key: functions returning the key of an item of each side.
+    needs_update: function receiving (desired, current) items that returns True when they differ.
+    keep: function receiving a current item that returns True when it is never deleted.
+    """
+
+    desired_index = index_by_key(desired, desired_key)
+    current_index = index_by_key(current, current_key)
+
+    changes = []
+
+    for key, item in desired_index.items():
+        existing = current_index.get(key)
+        if existing is None:
+            changes.append(Change('create', key, item, None))
+        elif needs_update(item, existing):
+            changes.append(Change('update', key, item, existing))
+
+    for key, existing in current_index.items():
+        if key not in desired_index and not (keep is not None and keep(existing)):
+            changes.append(Change('delete', key, None, existing))
+
+    return ReconcilePlan(changes)
+
+def plan_variables(desired, current, fingerprints=None):
+    """
+    Plan the changes of pipeline or deployment variables.
+    The API never returns the value of secured variables, they are always updated unless
+    `fingerprints` (a FingerprintStore) knows the desired value is the last one we wrote.
+    The companion variable of a fingerprint store is never deleted, even by tasks that don't use the store.
+    """
+
+    def needs_update(new, old):
+        if old.get('secured'):
+            return not (fingerprints is not None and new['secured'] and fingerprints.matches(old['uuid'], new['value']))
+        return new['value'] != old.get('value')
+
+    return plan_changes(
+        desired,
+        current,
+        desired_key=lambda var: var['name'],
+        current_key=lambda var: var['key'],
+        needs_update=needs_update,
+        keep=lambda var: var['key'] == FingerprintStore.COMPANION_VARIABLE,
+    )
+
+def plan_permissions(desired, current):
+    """
+    Plan the changes of repository permissions of users or groups
+    """
+
+    return plan_changes(
+        desired,
+        current,
+        desired_key=lambda perm: perm['name'],
+        current_key=lambda perm: perm['name'],
+        needs_update=lambda new, old: new['perm'].lower() != old['perm'].lower(),
+    )
+
+def user_id(user):
+    """
+    Identifier of a current user on the API, its account ID or its UUID
+    """
+
+    return user.get('account_id') or user['uuid']
+
+def is_user_id(name):
+    """
+    Whether a desired user is given by account ID (`557058:...`) or UUID (`{...}`) instead of nickname
+    """
+
+    return ':' in name or (name.startswith('{') and name.endswith('}'))
+
+def user_aliases(current_users):
+    """
+    Identifier of every current user indexed by each case-folded name it can be given by: nickname, account ID and UUID
+    """
+
+    aliases = {}
+    for user in current_users:
+        for alias in (user.get('name'), user.get('account_id'), user.get('uuid')):
+            if alias:
+                aliases[alias.casefold()] = user_id(user)
+
+    return aliases
+
+def plan_user_permissions(desired, current, aliases):
+    """
+    Plan the changes of repository permissions of users, desired users are matched by nickname, account ID or UUID
+    """
+
+    return plan_changes(
+        desired,
+        current,
+        desired_key=lambda perm: aliases.get(perm['name'].casefold(), perm['name']),
+        current_key=user_id,
+        needs_update=lambda new, old: new['perm'].lower() != old['perm'].lower(),
+    )
+
+def variable_mutations(plan, write_variable, fingerprints=None):
+    """
+    Mutations that apply a plan of variables.
+    write_variable: function receiving (action, name, value, uuid, secured) that sends the request.
+    """
+
+    mutations = []
+    for change in plan:
+        if change.action == 'delete':
+            # current variable doesn't exists on new variables, delete
+            mutations.append(dict(
+                name=change.current['key'],
+                action=change.action,
+                function=partial(write_variable, 'delete', None, None, change.current['uuid'], None),
+                on_success=fingerprints.deleted_callback(change.current['uuid']) if fingerprints else None))
+        else:
+            # variable doesn't exist on current variables, add
+            # secured variable or value are different, update variable
+            var = change.desired
+            var_uuid = change.current['uuid'] if change.current else None
+            mutations.append(dict(
+                name=var['name'],
+                action=change.action,
+                function=partial(write_variable, change.action, var['name'], var['value'], var_uuid, var['secured']),
+                on_success=fingerprints.written_callback(var, var_uuid) if fingerprints else None))
+
+    return mutations
+
+def permission_mutations(plan, scope, apply_permission, member_id=None):
+    """
+    Mutations that apply a plan of permissions.
+    apply_permission: function receiving (action, scope, name, perm) that sends the request.
+    member_id: function receiving a change that returns the member to send to the API, its name by default.
+    """
+
+    mutations = []
+    for change in plan:
+        if change.action == 'delete':
+            # current member doesn't exists on new members, delete
+            mutations.append(dict(
+                name=change.current['name'],
+                action='demote',
+                function=partial(apply_permission, 'demote', scope,
+                                 member_id(change) if member_id else change.current['name'])))
+        else:
+            # member doesn't exist on current members or permissions are different, add or update
+            mutations.append(dict(
+                name=change.desired['name'],
+                action='promote',
+                function=partial(apply_permission, 'promote', scope,
+                                 member_id(change) if member_id else change.desired['name'], change.desired['perm'])))
+
+    return mutations
+
+def prepare_variables(
+    bitbucket,
+    repository,
+    variables,
+    params,
+    state=None):
+    """
+    Read the pipeline variables of a repository and prepare the changes to reach `variables`.
+    params: module parameters with the fingerprint options.
+    state: state of a previous PreparedChanges, the variables are not read and its plan is used.
+    """
+
+    fingerprints = FingerprintStore.from_params(params, scope='i2b/{0}/pipeline'.format(repository))
+
+    def write_variable(action, name, value, var_uuid, secured):
+        return bitbucket.manage_repository_variables(action, name, value, var_uuid, secured, repository=repository)
+
+    if state is not None:
+        return restore_variables(state, variables, fingerprints, write_variable)
+
+    current_variables = bitbucket.get_repository_variables(repository)
+
+    return compute_variables(current_variables, variables, fingerprints, write_variable)
+
+def prepare_environment_variables(
+    bitbucket,
+    repository,
+    env_uuid,
+    variables,
+    params,
+    current_variables=None,
+    state=None):
+    """
+    Prepare the changes to reach `variables` on a deployment environment.
+    current_variables: variables of the environment, they are read when not given.
+    params: module parameters with the fingerprint options.
+    state: state of a previous PreparedChanges, the variables are not read and its plan is used.
+    """
+
+    fingerprints = FingerprintStore.from_params(params, scope='i2b/{0}/{1}'.format(repository, env_uuid))
+
+    def write_variable(action, name, value, var_uuid, secured):
+        return bitbucket.manage_environment_variables(action, name, value, env_uuid, var_uuid, secured, repository=repository)
+
+    if state is not None:
+        return restore_variables(state, variables, fingerprints, write_variable)
+
+    if current_variables is None:
+        current_variables = bitbucket.get_environment_variables(env_uuid, repository)
+
+    return compute_variables(current_variables, variables, fingerprints, write_variable)
+
+def compute_variables(current_variables, variables, fingerprints, write_variable):
+    """
+    Plan the changes of variables of a scope from its current variables
+    """
+
+    if fingerprints is not None:
+        current_variables = fingerprints.load(current_variables)
+
+    plan = plan_variables(variables, current_variables, fingerprints)
+
+    return PreparedChanges(
+        plan,
+        variable_mutations(plan, write_variable, fingerprints),
+        partial(fingerprints.save, write_variable) if fingerprints else None,
+        dict(changes=plan.export(), companion=fingerprints.companion if fingerprints else None))
+
+def restore_variables(state, variables, fingerprints, write_variable):
+    """
+    Rebuild the changes of variables of a scope from a saved state
+    """
+
+    if fingerprints is not None:
+        fingerprints.load([state['companion']] if state['companion'] else [])
+
+    plan = ReconcilePlan.restore(state['changes'], variables, lambda var: var['name'])
+
+    return PreparedChanges(
+        plan,
+        variable_mutations(plan, write_variable, fingerprints),
+        partial(fingerprints.save, write_variable) if fingerprints else None,
+        state)
+
+def prepare_permissions(
+    bitbucket,
+    repository,
+    permissions,
+    state=None,
+    unresolved=None):
+    """
+    Read the group and user permissions of a repository and prepare the changes to reach `permissions`.
+    Both scopes are read at the same time. User permissions are only reconciled when `permissions` has users,
+    users that have no permission yet must be given by account ID or UUID.
+    state: state of a previous PreparedChanges, the permissions are not read and its plan is used.
+    unresolved: list that receives the users without permission given by nickname instead of failing,
+    they are left out of the plan.
+    """
+
+    def apply_permission(action, scope, name, perm=None):
+        return bitbucket.apply_repository_permissions(action, scope, name, perm, repository=repository)
+
+    def user_target(change):
+        return user_id(change.current) if change.current else change.desired['name']
+
+    def read(scope):
+        with bitbucket.raising_errors():
+            return bitbucket.get_repository_permissions_info(scope=scope, repository=repository)
+
+    new_groups = [perm for perm in permissions if perm['type'] == 'group']
+    new_users = [perm for perm in permissions if perm['type'] == 'user']
+
+    if state is not None:
+        aliases = state.get('aliases', {})
+        group_plan = ReconcilePlan.restore(state['changes'], new_groups, lambda perm: perm['name'])
+        user_plan = ReconcilePlan.restore(
+            state.get('users', []), new_users, lambda perm: aliases.get(perm['name'].casefold(), perm['name']))
+    else:
+        scopes = ['group', 'user'] if new_users else ['group']
+        with ThreadPoolExecutor(max_workers=len(scopes)) as executor:
+            futures = [executor.submit(read, scope) for scope in scopes]
+
+        try:
+            current = [future.result() for future in futures]
+        except BitbucketError as exc:
+            bitbucket.fail(msg=to_text(exc))
+
+        current_users = current[1] if new_users else []
+        # only the aliases of the desired users are needed to restore the plan
+        desired_names = set(perm['name'].casefold() for perm in new_users)
+        aliases = dict(
+            (alias, member) for alias, member in user_aliases(current_users).items() if alias in desired_names)
+        group_plan = plan_permissions(new_groups, current[0])
+        user_plan = plan_user_permissions(new_users, current_users, aliases)
+
+    unknown = [change.desired['name'] for change in user_plan.creates if not is_user_id(change.desired['name'])]
+    if unknown and unresolved is not None:
+        unresolved.extend(unknown)
+        user_plan = ReconcilePlan([
+            change for change in user_plan.changes
+            if change.action != 'create' or is_user_id(change.desired['name'])])
+    elif unknown:
+        bitbucket.fail(msg='Users without permission on the repository must be given by account ID or UUID: {0}'.format(
+            ', '.join(unknown)))
+
+    return PreparedChanges(
+        ReconcilePlan(group_plan.changes + user_plan.changes),
+        permission_mutations(group_plan, 'group', apply_permission)
+        + permission_mutations(user_plan, 'user', apply_permission, user_target),
+        None,
+        dict(changes=group_plan.export(), users=user_plan.export(), aliases=aliases))
@@ -0,0 +1,312 @@
+"""
+Util class for the HTTP session used by BitbucketHelper
+"""
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import base64
+import http.client
+import socket
+import ssl
+import threading
+import zlib
+from urllib.parse import unquote, urljoin, urlsplit
+from urllib.request import getproxies, proxy_bypass
+
+class RequestNotSent(http.client.HTTPException):
+    """
+    The request failed before it was written, Bitbucket never received it
+    """
+
+#
+# class: BitbucketSession
+#
+
+class BitbucketSession:
+    """
+    Class BitbucketSession
+
+    Pool of keep-alive connections shared by every request of a module run.
+    Idle connections are kept per (scheme, host, port) and handed out to one
+    caller at a time, so the session can be used from several threads.
+    """
+
+    # same default timeout used by fetch_url
+    DEFAULT_TIMEOUT = 10
+
+    USER_AGENT = 'ansible-httpget'
+
+    # encodings we can decode, Bitbucket compresses big listings
+    ACCEPT_ENCODING = 'gzip, deflate'
+
+    # bytes read from the socket at once when a compressed body is decoded
+    CHUNK_SIZE = 64 * 1024
+
+    # methods that can be sent again without changing the outcome, a request with other methods
+    # is only sent again when it failed before being written
+    IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
+    # redirects followed for GET and HEAD when they stay on the same host, as fetch_url did
+    REDIRECT_STATUS_CODES = (301, 302, 303, 307, 308)
+
+    # same limit as urllib
+    MAX_REDIRECTS = 10
+
+    # errors raised when the server closed a keep-alive connection we reused
+    STALE_CONNECTION_ERRORS = (
+        http.client.RemoteDisconnected,
+        http.client.BadStatusLine,
+        BrokenPipeError,
+        ConnectionResetError,
+        ConnectionAbortedError,
+    )
+
+    def __init__(self, validate_certs=True, use_proxy=True, timeout=None):
+        self.validate_certs = validate_certs
+        self.use_proxy = use_proxy
+        self.timeout = timeout or self.DEFAULT_TIMEOUT
+        self.connections_opened = 0
+        self.requests_sent = 0
+        self.bytes_on_wire = 0
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._ssl_context = None
+
+    def ssl_context(self):
+        """
+        Build the SSL context once, honoring validate_certs
+        """
+
+        if self._ssl_context is None:
+            context = ssl.create_default_context()
+            if not self.validate_certs:
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+            self._ssl_context = context
+
+        return self._ssl_context
+
+    def get_proxy(self, scheme, host):
+        """
+        Return the proxy URL for a target, read from the environment the same way urllib does
+        """
+
+        if not self.use_proxy or proxy_bypass(host):
+            return None
+
+        return getproxies().get(scheme)
+
+    def new_connection(self, scheme, host, port):
+        """
+        Open a connection to the target, tunneling through a proxy when one is configured
+        """
+
+        proxy = self.get_proxy(scheme, host)
+
+        if proxy:
+            proxy_url = urlsplit(proxy)
+            proxy_port = proxy_url.port or (443 if proxy_url.scheme == 'https' else 80)
+            if scheme == 'https':
+                conn = http.client.HTTPSConnection(
+                    proxy_url.hostname, proxy_port, timeout=self.timeout, context=self.ssl_context())
+                tunnel_headers = {}
+                if proxy_url.username:
+                    credentials = '{0}:{1}'.format(unquote(proxy_url.username), unquote(proxy_url.password or ''))
+                    tunnel_headers['Proxy-Authorization'] = 'Basic ' + to_ascii_b64(credentials)
+                conn.set_tunnel(host, port, headers=tunnel_headers)
+            else:
+                conn = http.client.HTTPConnection(proxy_url.hostname, proxy_port, timeout=self.timeout)
+            conn.is_proxied = scheme != 'https'
+        elif scheme == 'https':
+            conn = http.client.HTTPSConnection(host, port, timeout=self.timeout, context=self.ssl_context())
+            conn.is_proxied = False
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=self.timeout)
+            conn.is_proxied = False
+
+        with self._lock:
+            self.connections_opened += 1
+
+        return conn
+
+    def checkout(self, key):
+        """
+        Take an idle connection for the target or open a new one
+        """
+
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+
+        return self.new_connection(*key), False
+
+    def checkin(self, key, conn):
+        """
+        Give a connection back to the pool
+        """
+
+        with self._lock:
+            self._idle.setdefault(key, []).append(conn)
+
+    def request(self, method, url, headers=None, data=None):
+        """
+        Send a request, see send_request. Redirects of GET and HEAD to the same host are followed,
+        e.g. when a repository or a workspace was renamed. Other redirects are returned as they came.
+        """
+
+        redirects = 0
+        while True:
+            status, reason, response_headers, body = self.send_request(method, url, headers, data)
+
+            if status not in self.REDIRECT_STATUS_CODES or method.upper() not in ('GET', 'HEAD'):
+                break
+
+            location = dict((k.lower(), v) for k, v in response_headers).get('location')
+            if not location or redirects == self.MAX_REDIRECTS:
+                break
+
+            target = urljoin(url, location)
+            if not same_host(url, target):
+                break
+
+            url = target
+            redirects += 1
+
+        return status, reason, response_headers, body
+
+    def send_request(self, method, url, headers=None, data=None):
+        """
+        Send one request reusing a pooled connection. When a reused connection turns out to be closed,
+        the request is sent again on a new one if it wasn't written yet or its method is idempotent.
+        Returns a tuple (status, reason, headers, body), network errors are raised to the caller,
+        as RequestNotSent when the request wasn't written.
+        """
+
+        parts = urlsplit(url)
+        scheme = parts.scheme or 'https'
+        port = parts.port or (443 if scheme == 'https' else 80)
+        key = (scheme, parts.hostname, port)
+
+        path = parts.path or '/'
+        if parts.query:
+            path = path + '?' + parts.query
+
+        headers = dict(headers or {})
+        headers.setdefault('User-Agent', self.USER_AGENT)
+        headers.setdefault('Accept-Encoding', self.ACCEPT_ENCODING)
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+
+        while True:
+            conn, reused = self.checkout(key)
+            target = url if conn.is_proxied else path
+            written = False
+            try:
+                with self._lock:
+                    self.requests_sent += 1
+                conn.request(method, target, body=data, headers=headers)
+                written = True
+                response = conn.getresponse()
+                body = self.read_body(response)
+            except self.STALE_CONNECTION_ERRORS as exc:
+                conn.close()
+                if reused and (not written or method.upper() in self.IDEMPOTENT_METHODS):
+                    # the server dropped an idle connection, retry on a fresh one. A POST that was
+                    # written may have been processed, it goes to the retries of the caller instead
+                    with self._lock:
+                        self.requests_sent -= 1
+                    continue
+                if not written:
+                    raise RequestNotSent(exc) from exc
+                raise
+            except (socket.error, ssl.SSLError, http.client.HTTPException) as exc:
+                conn.close()
+                if not written:
+                    raise RequestNotSent(exc) from exc
+                raise
+            break
+
+        if response.will_close:
+            conn.close()
+        else:
+            self.checkin(key, conn)
+
+        return response.status, response.reason, response.getheaders(), body
+
+    def read_body(self, response):
+        """
+        Read the body of a response, decoding it while it arrives when it is compressed.
+        Compressed bodies are returned as a bytearray, so the decoded data is not copied again.
+        """
+
+        encoding = (response.getheader('Content-Encoding') or 'identity').strip().lower()
+
+        if encoding not in ('gzip', 'deflate'):
+            body = response.read()
+            with self._lock:
+                self.bytes_on_wire += len(body)
+            return body
+
+        decoder = None
+        body = bytearray()
+        received = 0
+        try:
+            while True:
+                chunk = response.read(self.CHUNK_SIZE)
+                if not chunk:
+                    break
+                received += len(chunk)
+                if decoder is None:
+                    decoder = new_decoder(encoding, chunk)
+                body += decoder.decompress(chunk)
+            if decoder is not None:
+                body += decoder.flush()
+        except zlib.error as exc:
+            raise http.client.HTTPException('Invalid {0} response body: {1}'.format(encoding, exc))
+        finally:
+            with self._lock:
+                self.bytes_on_wire += received
+
+        return body
+
+    def close(self):
+        """
+        Close every idle connection
+        """
+
+        with self._lock:
+            for idle in self._idle.values():
+                for conn in idle:
+                    conn.close()
+            self._idle = {}
+
+def same_host(url, other):
+    """
+    Whether two URLs point to the same scheme, host and port
+    """
+
+    parts, other_parts = urlsplit(url), urlsplit(other)
+
+    return (parts.scheme, parts.hostname, parts.port) == (other_parts.scheme, other_parts.hostname, other_parts.port)
+
+def new_decoder(encoding, first_chunk):
+    """
+    Streaming decoder of a compressed body, `deflate` can come with or without the zlib header
+    """
+
+    if encoding == 'gzip':
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    if len(first_chunk) >= 2 and first_chunk[0] & 0x0F == 8 and (first_chunk[0] * 256 + first_chunk[1]) % 31 == 0:
+        return zlib.decompressobj(zlib.MAX_WBITS)
+
+    return zlib.decompressobj(-zlib.MAX_WBITS)
+
+def to_ascii_b64(value):
+    """
+    Encode a string for a Basic authorization header
+    """
+
+    return base64.b64encode(value.encode('utf-8')).decode('ascii')
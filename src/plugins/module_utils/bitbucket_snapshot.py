@@ -0,0 +1,262 @@
+"""
+Util classes to keep a snapshot of the repositories of a Bitbucket workspace on disk
+"""
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import gzip
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_cache import file_lock, make_private_dirs, write_atomic
+
+#
+# class: WorkspaceSnapshot
+#
+
+class WorkspaceSnapshot:
+    """
+    Class WorkspaceSnapshot
+
+    Repositories of a workspace with their pipeline variables, deployment environments (and their
+    variables) and group permissions, as read from the API. Each repository is kept on its own
+    gzip-compressed JSON file, so a module that changes a repository only drops that file, and
+    an index lists the repositories found by the last full build.
+    Entries older than `ttl` seconds are ignored. Values of secured variables are never returned
+    by the API so they are not on the snapshot either.
+    """
+
+    DEFAULT_TTL = 3600
+
+    def __init__(self, path, workspace, ttl=None):
+        self.path = os.path.join(os.path.expanduser(path), workspace)
+        self.workspace = workspace
+        self.ttl = self.DEFAULT_TTL if ttl is None else ttl
+
+    @staticmethod
+    def argument_spec():
+        """
+        Arguments of the modules that can read the snapshot
+        """
+
+        return dict(
+            snapshot_path=dict(
+                type='path',
+                required=False,
+                default=None),
+            snapshot_ttl=dict(
+                type='int',
+                default=WorkspaceSnapshot.DEFAULT_TTL),
+            snapshot_refresh=dict(
+                type='bool',
+                default=False),
+        )
+
+    def index_path(self):
+        """
+        File with the list of repositories of the workspace
+        """
+
+        return os.path.join(self.path, 'index.json')
+
+    def entry_path(self, repository):
+        """
+        File that holds the entry of a repository
+        """
+
+        return os.path.join(self.path, 'repos', repository.lower() + '.json.gz')
+
+    def fresh(self, entry):
+        """
+        Whether an entry or the index was built less than `ttl` seconds ago
+        """
+
+        return entry is not None and entry.get('created', 0) + self.ttl > time.time()
+
+    def load_index(self):
+        """
+        Return the index when it is fresh, None otherwise
+        """
+
+        try:
+            with open(self.index_path(), 'r', encoding='utf-8') as index_file:
+                index = json.load(index_file)
+        except (IOError, OSError, ValueError):
+            return None
+
+        return index if self.fresh(index) else None
+
+    def save_index(self, repositories):
+        """
+        Save the list of repositories found on the workspace
+        """
+
+        make_private_dirs(self.path)
+        with file_lock(self.index_path() + '.lock'):
+            write_atomic(self.index_path(), json.dumps(dict(
+                workspace=self.workspace,
+                created=time.time(),
+                repositories=sorted(repositories),
+            )))
+
+    def load(self, repository):
+        """
+        Return the entry of a repository when it is fresh, None otherwise
+        """
+
+        try:
+            with gzip.open(self.entry_path(repository), 'rt') as entry_file:
+                entry = json.load(entry_file)
+        except (IOError, OSError, EOFError, ValueError):
+            return None
+
+        return entry if self.fresh(entry) else None
+
+    def store(self, entry):
+        """
+        Save the entry of a repository
+        """
+
+        entry_path = self.entry_path(entry['slug'])
+        entry = dict(entry, created=time.time())
+
+        make_private_dirs(self.path)
+        make_private_dirs(os.path.dirname(entry_path))
+        with file_lock(entry_path + '.lock'):
+            write_atomic(entry_path, gzip.compress(json.dumps(entry, separators=(',', ':')).encode('utf-8')))
+
+    def discard(self, repository):
+        """
+        Drop the entry of a repository, called once it is changed
+        """
+
+        try:
+            os.unlink(self.entry_path(repository))
+        except (IOError, OSError):
+            pass
+
+    def repository_of(self, api_url):
+        """
+        Slug of the repository an URL of the API belongs to, None for other URLs
+        """
+
+        match = re.search(r'/repositories/{0}/([^/?]+)'.format(re.escape(self.workspace)), api_url)
+        return match.group(1).lower() if match else None
+
+#
+# class: SnapshotReader
+#
+
+class SnapshotReader:
+    """
+    Class SnapshotReader
+
+    Entries of the workspace snapshot used by one module run. Each entry is loaded once and kept
+    in memory, and dropped when a request changes its repository so the following reads go to the API.
+    """
+
+    def __init__(self, bitbucket, snapshot, refresh=False):
+        self.bitbucket = bitbucket
+        self.snapshot = snapshot
+        self.refresh = refresh
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def entry(self, repository):
+        """
+        Entry of a repository, None when there is no fresh entry or the reads of a plan are recorded.
+        With `refresh` the entry is read again from the API the first time it is used.
+        """
+
+        if self.snapshot is None or self.bitbucket.recorder.active():
+            return None
+
+        key = repository.lower()
+        with self.lock:
+            cached = key in self.entries
+            entry = self.entries.get(key)
+
+        if not cached:
+            if self.refresh:
+                entry = read_repository(self.bitbucket, repository)
+                if entry is not None:
+                    self.snapshot.store(entry)
+            else:
+                entry = self.snapshot.load(key)
+            with self.lock:
+                self.entries.setdefault(key, entry)
+
+        if entry is not None:
+            self.bitbucket.add_stats(snapshot_hits=1)
+
+        return entry
+
+    def discard(self, api_url):
+        """
+        Drop the entry of the repository changed by a request
+        """
+
+        if self.snapshot is None:
+            return
+
+        repository = self.snapshot.repository_of(api_url)
+        if repository is None:
+            return
+
+        self.snapshot.discard(repository)
+        with self.lock:
+            self.entries[repository] = None
+
+def read_repository(bitbucket, repository, info=None):
+    """
+    Read everything the snapshot keeps of one repository, None when it doesn't exist
+    """
+
+    if info is None:
+        info = bitbucket.get_repository_info(repository, use_snapshot=False)
+        if not info:
+            return None
+
+    environments = []
+    for env in bitbucket.iter_repository_environments(repository, use_snapshot=False):
+        environments.append(dict(
+            uuid=env['uuid'],
+            name=env['name'],
+            environment_type=dict(name=env['environment_type']['name']),
+            variables=bitbucket.get_environment_variables(env['uuid'], repository, use_snapshot=False),
+        ))
+
+    return dict(
+        slug=repository,
+        info=dict(uuid=info.get('uuid'), full_name=info.get('full_name')),
+        variables=bitbucket.get_repository_variables(repository, use_snapshot=False),
+        environments=environments,
+        groups=bitbucket.get_repository_permissions_info('group', repository, use_snapshot=False),
+    )
+
+def build_snapshot(bitbucket, snapshot, workers=None):
+    """
+    Read every repository of the workspace, `workers` at a time (`max_concurrency` by default),
+    and save them on the snapshot. Returns the entries by slug.
+    """
+
+    repositories = list(bitbucket.iter_workspace_repositories())
+
+    def worker(info):
+        with bitbucket.raising_errors():
+            entry = read_repository(bitbucket, info['slug'], info)
+        snapshot.store(entry)
+        return entry
+
+    workers = max(1, min(workers or bitbucket.module.params['max_concurrency'], len(repositories)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        entries = list(executor.map(worker, repositories))
+
+    snapshot.save_index([entry['slug'] for entry in entries])
+
+    return dict((entry['slug'], entry) for entry in entries)
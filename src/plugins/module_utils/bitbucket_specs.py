@@ -0,0 +1,120 @@
+"""
+Argument specs shared by the Bitbucket modules
+"""
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+# every function returns a new dict, AnsibleModule may change the spec it is given
+
+def variable_spec():
+    """
+    Pipeline variable of a repository or of a deployment environment
+    """
+
+    return dict(
+        name=dict(
+            required=True,
+            type='str',
+            no_log=False,),
+        value=dict(
+            required=True,
+            no_log=True,
+            type='str'),
+        secured=dict(
+            required=False,
+            type='bool',
+            default=False)
+    )
+
+def environment_spec():
+    """
+    Deployment environment with its variables
+    """
+
+    return dict(
+        name=dict(
+            required=True,
+            type='str'),
+        type=dict(
+            required=True,
+            type='str',
+            choices=['Staging', 'Test', 'Production']),
+        variables=dict(
+            required=False,
+            no_log=False,
+            type='list',
+            elements='dict',
+            options=variable_spec()),
+    )
+
+def permission_spec():
+    """
+    Permission of a user or a group on a repository
+    """
+
+    return dict(
+        type=dict(
+            required=True,
+            type='str',
+            choices=['user', 'group']),
+        name=dict(
+            required=True,
+            type='str'),
+        perm=dict(
+            required=False,
+            type='str',
+            choices=['admin', 'write', 'read'])
+    )
+
+def desired_state_spec():
+    """
+    Variables, deployment environments and permissions wanted on a repository
+    """
+
+    return dict(
+        variables=dict(
+            required=False,
+            no_log=False,
+            type='list',
+            elements='dict',
+            options=variable_spec()),
+        environments=dict(
+            required=False,
+            type='list',
+            elements='dict',
+            options=environment_spec()),
+        permissions=dict(
+            required=False,
+            type='list',
+            elements='dict',
+            options=permission_spec()),
+    )
+
+def repository_spec():
+    """
+    Repository of a manifest with its desired state
+    """
+
+    spec = dict(
+        name=dict(
+            required=True,
+            type='str'),
+        project_key=dict(
+            required=False,
+            type='str',
+            no_log=False),
+    )
+    spec.update(desired_state_spec())
+
+    return spec
+
+def fingerprint_required_if():
+    """
+    Validation of the fingerprint options of FingerprintStore.argument_spec
+    """
+
+    return [
+        ('fingerprint_store', 'local', ['fingerprint_salt']),
+        ('fingerprint_store', 'variable', ['fingerprint_salt']),
+    ]
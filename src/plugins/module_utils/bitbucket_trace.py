@@ -0,0 +1,178 @@
+"""
+Util class to trace the requests sent by BitbucketHelper
+"""
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import json
+import os
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_cache import file_lock, make_private_dirs
+
+#
+# class: RequestTracer
+#
+
+class RequestTracer:
+    """
+    Class RequestTracer
+
+    One span per HTTP call of a module run: method, endpoint, status, bytes, retries, wait and
+    duration. Spans are returned on the module result or appended to a JSONL file that several
+    runs can share, and are aggregated in a summary of latency by endpoint.
+    """
+
+    DEFAULT_PATH = '~/.ansible/bitbucket/trace.jsonl'
+
+    def __init__(self, endpoints, mode, path=None, task=None):
+        self.mode = mode
+        self.path = os.path.expanduser(path or self.DEFAULT_PATH)
+        self.task = task
+        self.spans = []
+        self.flushed = 0
+        self._lock = threading.Lock()
+        # longest templates first, so sub-resources don't match the template of their parent
+        self._patterns = []
+        for name, template in sorted(endpoints.items(), key=lambda item: -len(item[1])):
+            path = urlsplit(template.replace('{url}', 'http://host')).path
+            pattern = re.escape(path).replace(re.escape('{workspace}'), '[^/]+').replace(re.escape('{repo_slug}'), '[^/]+')
+            self._patterns.append((name, re.compile(pattern + '(/|$)')))
+
+    @staticmethod
+    def argument_spec():
+        """
+        Arguments of the modules to enable the tracing
+        """
+
+        return dict(
+            trace=dict(
+                type='str',
+                choices=['none', 'result', 'file'],
+                default='none'),
+            trace_file=dict(
+                type='path',
+                required=False,
+                default=None),
+        )
+
+    def endpoint_name(self, api_url):
+        """
+        Name of the endpoint template an URL was built from
+        """
+
+        path = urlsplit(api_url).path
+        for name, pattern in self._patterns:
+            if pattern.search(path):
+                return name
+
+        return 'other'
+
+    def record(
+        self,
+        method,
+        api_url,
+        status,
+        started,
+        bytes_received=0,
+        retries=0,
+        wait_seconds=0.0,
+        cache=None):
+        """
+        Record the span of a request, it can be called from several threads
+        """
+
+        span = dict(
+            start=round(started, 6),
+            method=method,
+            endpoint=self.endpoint_name(api_url),
+            path=urlsplit(api_url).path,
+            status=status,
+            bytes=bytes_received,
+            retries=retries,
+            wait_seconds=round(wait_seconds, 3),
+            duration_ms=round((time.time() - started) * 1000, 3),
+            cache=cache,
+        )
+        if self.task:
+            span['task'] = self.task
+
+        with self._lock:
+            self.spans.append(span)
+
+    def summary(self):
+        """
+        Requests, errors, bytes, retries and latency percentiles by endpoint
+        """
+
+        with self._lock:
+            spans = list(self.spans)
+
+        grouped = {}
+        for span in spans:
+            grouped.setdefault(span['endpoint'], []).append(span)
+
+        summary = {}
+        for endpoint, endpoint_spans in grouped.items():
+            durations = sorted(span['duration_ms'] for span in endpoint_spans)
+            summary[endpoint] = dict(
+                requests=len(endpoint_spans),
+                errors=len([span for span in endpoint_spans if span['status'] < 0 or span['status'] >= 400]),
+                cached=len([span for span in endpoint_spans if span['cache']]),
+                bytes=sum(span['bytes'] for span in endpoint_spans),
+                retries=sum(span['retries'] for span in endpoint_spans),
+                wait_seconds=round(sum(span['wait_seconds'] for span in endpoint_spans), 3),
+                total_ms=round(sum(durations), 3),
+                p50_ms=percentile(durations, 50),
+                p95_ms=percentile(durations, 95),
+                max_ms=durations[-1],
+            )
+
+        return summary
+
+    def flush(self):
+        """
+        Append the spans not written yet to the trace file
+        """
+
+        with self._lock:
+            pending = self.spans[self.flushed:]
+            self.flushed = len(self.spans)
+
+        if not pending:
+            return
+
+        make_private_dirs(os.path.dirname(self.path))
+        with file_lock(self.path + '.lock'):
+            with open(self.path, 'a', encoding='utf-8') as trace_file:
+                for span in pending:
+                    trace_file.write(json.dumps(span, sort_keys=True) + '\n')
+
+    def report(self):
+        """
+        Tracing data for the module result, spans are only included when they are not written to a file
+        """
+
+        report = dict(endpoints=self.summary())
+        if self.mode == 'file':
+            self.flush()
+        else:
+            with self._lock:
+                report['spans'] = list(self.spans)
+
+        return report
+
+def percentile(values, rank):
+    """
+    Nearest-rank percentile of sorted values
+    """
+
+    if not values:
+        return 0.0
+
+    index = max(0, int(round(rank / 100.0 * len(values) + 0.5)) - 1)
+    return values[min(index, len(values) - 1)]
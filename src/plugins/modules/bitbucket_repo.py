@@ -15,16 +15,6 @@ version_added: "1.0.0"
 description:
     - Manage repositories on Bitbucket Cloud
 options:
-    username:
-        description:
-            - Username used for authentication.
-        type: str
-        required: true
-    password:
-        description:
-            - Password used for authentication.
-        type: str
-        required: true
     repository:
         description:
             - Repository name.
@@ -42,6 +32,10 @@ options:
         default: present
         choices: [ absent, present ]
         required: true
+extends_documentation_fragment:
+    - i2btech.ops.bitbucket
+    - i2btech.ops.bitbucket.snapshot
+    - i2btech.ops.bitbucket.plan_file
 author:
     - IT I2B (it@i2btech.com)
 '''
@@ -62,15 +56,35 @@ message:
     type: dict
     returned: always
     sample: []
+plan:
+    description: Changes the module would apply, only in check mode. Check mode reads the current state but doesn't change it
+    type: list
+    elements: dict
+    returned: check mode
+    sample: [{"action": "create", "name": "user"}]
+plan_reused:
+    description: Whether the plan saved on I(plan_file) was applied without reading the current state again
+    type: bool
+    returned: always
+    sample: false
+api_stats:
+    description: Counters of the HTTP activity against the Bitbucket API
+    type: dict
+    returned: always
+    sample: {"connections_opened": 1, "requests_sent": 4}
 '''
 
 #pylint: disable=wrong-import-position
 from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket import BitbucketHelper
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_plan import PlanFile, load_valid_plan
 from ansible.module_utils.basic import AnsibleModule
 #pylint: disable=wrong-import-position
 
-def run_module():
-    """ main module """
+def run_module(module_class=AnsibleModule):
+    """
+    main module
+    module_class: AnsibleModule or the stand-in used by the action plugin on the controller
+    """
 
     # define available arguments/parameters a user can pass to the module
 
@@ -91,6 +105,7 @@ def run_module():
             choices=['present', 'absent'],
             default='present'),
     )
+    module_args.update(PlanFile.argument_spec())
 
     # seed the result dict in the object
     # we primarily care about changed and state
@@ -106,29 +121,43 @@ def run_module():
     # this includes instantiation, a couple of common attr would be the
     # args/params passed to the execution, as well as if the module
     # supports check mode
-    module = AnsibleModule(
+    module = module_class(
         argument_spec=module_args,
         supports_check_mode=True
     )
 
-    # if the user is working with this module in only check mode we do not
-    # want to make any changes to the environment, just return the current
-    # state with no modifications
+    bitbucket = BitbucketHelper(module)
+    plan_file = PlanFile.from_params(module.params, 'bitbucket_repo', ['repository', 'project_key', 'state'])
+
+    # in check mode, only read the current state and return the plan of changes
     if module.check_mode:
-        module.exit_json(**result)
+        result['plan'] = []
+        bitbucket.recorder.start()
 
-    bitbucket = BitbucketHelper(module)
+    state = None if module.check_mode else load_valid_plan(bitbucket, plan_file)
+    result['plan_reused'] = state is not None
 
-    existing_repository = bitbucket.get_repository_info()
+    if state is None:
+        state = dict(exists=bool(bitbucket.get_repository_info()))
 
     # Create new repository in case it doesn't exist
-    if not existing_repository and (module.params['state'] == 'present'):
-        if not module.check_mode:
+    if not state['exists'] and (module.params['state'] == 'present'):
+        if module.check_mode:
+            result['plan'].append(dict(action='create', name=module.params['repository']))
+            result['changed'] = True
+        else:
             result['changed'] = bitbucket.create_repository()
             # TODO: maybe we can check if the pipeline is enabled already, if not, enable
             # Get configuration of pipeline: GET /2.0/repositories/{workspace}/{repo_slug}/pipelines_config
             bitbucket.enable_repository_pipeline()
 
+    if module.check_mode and plan_file is not None:
+        plan_file.save(bitbucket.recorder.reads, state)
+    elif result['plan_reused']:
+        plan_file.discard()
+
+    result['api_stats'] = bitbucket.get_stats()
+
     if result is not None:
         module.exit_json(**result)
     else:
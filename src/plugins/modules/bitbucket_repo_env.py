@@ -15,16 +15,6 @@ version_added: "1.0.0"
 description:
     - Manage deployment environment for a repository on Bitbucket Cloud
 options:
-    username:
-        description:
-            - Username used for authentication.
-        type: str
-        required: true
-    password:
-        description:
-            - Password used for authentication.
-        type: str
-        required: true
     repository:
         description:
             - Repository name.
@@ -34,18 +24,48 @@ options:
         type: str
         description:
             - Name of environment
-        required: true
+            - Required unless I(environments) is given
+        required: false
     type:
         type: str
         description:
             - Type of deployment environment
+            - Required with I(name)
         choices: [ Test, Staging, Production ]
-        required: true
+        required: false
+    environments:
+        type: list
+        elements: dict
+        description:
+            - Several deployment environments managed in one task, instead of I(name), I(type) and I(variables)
+            - The environments of the repository are listed once, the missing ones are created and then the variables of every
+              environment are read and reconciled at the same time
+            - Names of the changes in C(mutations) and C(plan) are prefixed with the name of their environment
+        required: false
+        suboptions:
+            name:
+                type: str
+                description:
+                    - Name of environment
+                required: true
+            type:
+                type: str
+                description:
+                    - Type of deployment environment
+                choices: [ Test, Staging, Production ]
+                required: true
+            variables:
+                type: list
+                elements: dict
+                description:
+                    - Variables of the environment, same format of I(variables)
+                    - If omitted, the variables of the environment are not managed
+                required: false
     variables:
         description: List of variables that will be managed
         type: list
         elements: dict
-        required: true
+        required: false
         suboptions:
             name:
                 type: str
@@ -61,10 +81,22 @@ options:
                 type: bool
                 description:
                 - If true, variable will be encrypted and masked in the logs
-                - If true, the module will always finish with a state of changed. The Bitbucket Cloud API don't allow to check
-                the current value of a secured variable thus we need to always update tha value to applies possible changes on the value
+                - The Bitbucket Cloud API never returns the value of a secured variable, so it is updated on every run and the task
+                  reports a change, unless I(fingerprint_store) knows the desired value is the last one written
                 - If false, you need to delete the variable to change it to secured
                 required: false
+    max_concurrency:
+        type: int
+        description:
+            - Number of changes sent at the same time to the API
+            - Every change is tried, the module fails after all of them finished if any failed
+        default: 1
+        required: false
+extends_documentation_fragment:
+    - i2btech.ops.bitbucket
+    - i2btech.ops.bitbucket.fingerprint
+    - i2btech.ops.bitbucket.snapshot
+    - i2btech.ops.bitbucket.plan_file
 author:
     - IT I2B (it@i2btech.com)
 '''
@@ -83,6 +115,28 @@ EXAMPLES = r'''
     - name: pass
       value: _super_secret_pass_
       secured: true
+
+- name: "Set the deployment environments of repository X in one task"
+  i2btech.ops.bitbucket_repo_env:
+  username: "alice"
+  password: "app_password"
+  repository: "example-X"
+  environments:
+    - name: Test
+      type: Test
+      variables:
+        - name: user
+          value: user_test
+    - name: Staging
+      type: Staging
+      variables:
+        - name: user
+          value: user_staging
+    - name: Production
+      type: Production
+      variables:
+        - name: user
+          value: user_prod
 '''
 
 RETURN = r'''
@@ -91,104 +145,214 @@ message:
     type: dict
     returned: always
     sample: []
+environments:
+    description: Environments managed with I(environments), with their UUID and whether they were created
+    type: list
+    elements: dict
+    returned: when I(environments) is given
+    sample: [{"name": "Test", "type": "Test", "uuid": "{7b9f4b4e-9c1a-4d1c-8a57-8d0d3e3b7a11}", "created": false}]
+mutations:
+    description: Outcome of every change applied, in the order they were computed
+    type: list
+    elements: dict
+    returned: when changes were applied
+    sample: [{"name": "user", "action": "update", "status": "ok"}]
+concurrency:
+    description:
+        - Concurrency used by each batch of changes when I(adaptive_concurrency=true), the limit starts at half of I(max_concurrency)
+        - C(trajectory) lists every change of the limit, after how many changes completed and why
+    type: list
+    elements: dict
+    returned: when changes were applied with I(adaptive_concurrency)
+    sample: [{"ceiling": 20, "final": 6, "peak": 12, "trajectory": [{"completed": 0, "limit": 10, "reason": "start"},
+             {"completed": 10, "limit": 11, "reason": "healthy", "p95_ms": 180.5}, {"completed": 34, "limit": 6, "reason": "throttled"}]}]
+plan:
+    description: Changes the module would apply, only in check mode. Check mode reads the current state but doesn't change it
+    type: list
+    elements: dict
+    returned: check mode
+    sample: [{"action": "create", "name": "user"}]
+plan_reused:
+    description: Whether the plan saved on I(plan_file) was applied without reading the current state again
+    type: bool
+    returned: always
+    sample: false
+api_stats:
+    description: Counters of the HTTP activity against the Bitbucket API
+    type: dict
+    returned: always
+    sample: {"connections_opened": 1, "requests_sent": 4}
 '''
 
 #pylint: disable=wrong-import-position
-from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket import BitbucketHelper
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from ansible.module_utils._text import to_text
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket import BitbucketError, BitbucketHelper
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_fingerprint import FingerprintStore
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_mutations import MutationExecutor
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_pagination import PREFETCH_WORKERS
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_plan import PlanFile, load_valid_plan
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_reconcile import prepare_environment_variables
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_specs import environment_spec, fingerprint_required_if, variable_spec
 from ansible.module_utils.basic import AnsibleModule
 #pylint: disable=wrong-import-position
 
-def manage_environments(result, bitbucket, module):
-    """ CRUD environments """
+def manage_environments(result, bitbucket, module, state=None):
+    """
+    CRUD environments
+    state: state saved on a plan file, the environment and its variables are not read
+    Returns the state of the changes, to save it on a plan file
+    """
 
-    current_environments = bitbucket.get_repository_environments()
-    env_exists = False
-    env_uuid = None
-    for x in current_environments:
-        if module.params['name'].lower() == x['name'].lower() and module.params['type'].lower() == x['environment_type']['name'].lower():
-            env_exists = True
-            env_uuid = x['uuid']
-            break
+    if state is None:
+        # stop listing environments once the one we manage is found
+        env_uuid = None
+        for x in bitbucket.iter_repository_environments():
+            if module.params['name'].lower() == x['name'].lower() and module.params['type'].lower() == x['environment_type']['name'].lower():
+                env_uuid = x['uuid']
+                break
+    else:
+        env_uuid = state['env_uuid']
 
-    if env_exists:
+    variables_state = None
+    if env_uuid is not None:
         # environment exists, manage variables associated with it if they exists
         if module.params['variables'] is not None:
-            api_url=bitbucket.BITBUCKET_API_ENDPOINTS['repos-deployments'].format(
-                        url=module.params['url'],
-                        workspace='i2b',
-                        repo_slug=module.params['repository'])
-            current_variables = bitbucket.get_variables(api_url + "/environments/" + env_uuid + "/variables")
-            manage_environment_variables(result, bitbucket, env_uuid, current_variables, module.params['variables'])
+            variables_state = manage_environment_variables(
+                result, bitbucket, env_uuid, None, module.params['variables'], state and state['variables'])
 
     else:
         # environment doesn't exist on current environments, add it
-        new_env = bitbucket.manage_repository_environments('create', module.params['name'], module.params['type'])
-        env_uuid = new_env['uuid']
+        result['changed'] = True
+        if module.check_mode:
+            result['plan'].append(dict(action='create', name=module.params['name']))
+        else:
+            new_env = bitbucket.manage_repository_environments('create', module.params['name'], module.params['type'])
+            env_uuid = new_env['uuid']
         # manage variables associated with it
         if module.params['variables'] is not None:
             manage_environment_variables(result, bitbucket, env_uuid, [], module.params['variables'])
+
+    return dict(env_uuid=env_uuid, variables=variables_state)
+
+def manage_environment_list(result, bitbucket, module, state=None):
+    """
+    CRUD the environments of the `environments` option: list them once, create the missing ones,
+    then read and reconcile the variables of every environment at the same time
+    state: state saved on a plan file, the environments and their variables are not read
+    Returns the state of the changes, to save it on a plan file
+    """
+
+    environments = module.params['environments']
+
+    if state is None:
+        current_environments = {}
+        for env in bitbucket.iter_repository_environments():
+            current_environments[(env['name'].lower(), env['environment_type']['name'].lower())] = env['uuid']
+        env_uuids = [current_environments.get((env['name'].lower(), env['type'].lower())) for env in environments]
+    else:
+        env_uuids = [saved['env_uuid'] for saved in state['environments']]
+
+    missing = [index for index, env_uuid in enumerate(env_uuids) if env_uuid is None]
+    if missing:
         result['changed'] = True
 
-def manage_environment_variables(result, bitbucket, env_uuid, current_variables, new_variables):
+    if module.check_mode:
+        result['plan'].extend(dict(action='create', name=environments[index]['name']) for index in missing)
+    elif missing:
+        mutations = []
+        for index in missing:
+            def on_success(content, index=index):
+                env_uuids[index] = content['uuid']
+            mutations.append(dict(
+                name=environments[index]['name'],
+                action='create',
+                function=partial(
+                    bitbucket.manage_repository_environments, 'create', environments[index]['name'], environments[index]['type']),
+                on_success=on_success))
+        MutationExecutor(bitbucket).apply(result, mutations)
+
+    def prepare(index):
+        env = environments[index]
+        if env['variables'] is None:
+            return None
+        with bitbucket.raising_errors():
+            if index in missing:
+                # environment just created, it has no variables
+                return prepare_environment_variables(
+                    bitbucket, module.params['repository'], env_uuids[index], env['variables'], module.params, [])
+            return prepare_environment_variables(
+                bitbucket, module.params['repository'], env_uuids[index], env['variables'], module.params,
+                state=state and state['environments'][index]['variables'])
+
+    workers = max(1, min(PREFETCH_WORKERS, len(environments)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(prepare, index) for index in range(len(environments))]
+
+    try:
+        prepared = [future.result() for future in futures]
+    except BitbucketError as exc:
+        bitbucket.fail(msg=to_text(exc))
+
+    # the changes of every environment go through the same pool of mutations
+    mutations = []
+    finalizers = []
+    for env, changes in zip(environments, prepared):
+        if changes is None:
+            continue
+        if module.check_mode:
+            result['plan'].extend(
+                dict(entry, name='{0}/{1}'.format(env['name'], entry['name'])) for entry in changes.plan.describe())
+            result['changed'] = result['changed'] or len(changes.plan) > 0
+        for mutation in changes.mutations:
+            mutation['name'] = '{0}/{1}'.format(env['name'], mutation['name'])
+        mutations.extend(changes.mutations)
+        if changes.finalize is not None:
+            finalizers.append(changes.finalize)
+
+    def finalize_all():
+        for finalize in finalizers:
+            finalize()
+
+    if not module.check_mode:
+        MutationExecutor(bitbucket).apply(result, mutations, finalize_all)
+
+    result['environments'] = [
+        dict(name=env['name'], type=env['type'], uuid=env_uuid, created=index in missing)
+        for index, (env, env_uuid) in enumerate(zip(environments, env_uuids))]
+
+    return dict(environments=[
+        dict(env_uuid=None if index in missing else env_uuid, variables=changes and changes.state)
+        for index, (env_uuid, changes) in enumerate(zip(env_uuids, prepared))])
+
+def manage_environment_variables(result, bitbucket, env_uuid, current_variables, new_variables, state=None):
     """ CRUD variables of environment """
 
-    # actions for new variables
-    for i in new_variables:
-        var_exists = False
-        var_value = None
-        var_uuid = None
-        for x in current_variables:
-            if i['name'].lower() == x['key'].lower():
-                var_exists = True
-                var_uuid = x['uuid']
-                if not x['secured']:
-                    var_value = x['value']
-                break
+    module = bitbucket.module
+    changes = prepare_environment_variables(
+        bitbucket,
+        module.params['repository'],
+        env_uuid,
+        new_variables,
+        module.params,
+        current_variables,
+        state)
 
-        if var_exists:
-            # always update secured variable
-            if var_value is None:
-                bitbucket.manage_environment_variables('update', i['name'], i['value'], env_uuid, var_uuid, i['secured'])
-                result['changed'] = True
-            # if not secured and value are different, update variable
-            else:
-                if i['value'] != var_value:
-                    bitbucket.manage_environment_variables('update', i['name'], i['value'], env_uuid, var_uuid, i['secured'])
-                    result['changed'] = True
+    if module.check_mode:
+        result['plan'].extend(changes.plan.describe())
+        result['changed'] = result['changed'] or len(changes.plan) > 0
+    else:
+        MutationExecutor(bitbucket).apply(result, changes.mutations, changes.finalize)
 
-        else:
-            # variable doesn't exist on current variables, add
-            bitbucket.manage_environment_variables('create', i['name'], i['value'], env_uuid, None, i['secured'])
-            result['changed'] = True
-
-    # action for current variables
-    for i in current_variables:
-        if not any(
-            i['key'].lower() == x['name'].lower()
-                for x in new_variables
-        ):
-            # current variable doesn't exists on new variables, delete
-            bitbucket.manage_environment_variables('delete', None, None, env_uuid, i['uuid'], None)
-            result['changed'] = True
-
-def run_module():
-    """ main module """
-    # define available arguments/parameters a user can pass to the module
+    return changes.state
 
-    variable_spec = dict(
-        name=dict(
-            required=True,
-            type='str',
-            no_log=False,),
-        value=dict(
-            required=True,
-            no_log=True,
-            type='str'),
-        secured=dict(
-            required=False,
-            type='bool',
-            default=False)
-    )
+def run_module(module_class=AnsibleModule):
+    """
+    main module
+    module_class: AnsibleModule or the stand-in used by the action plugin on the controller
+    """
+    # define available arguments/parameters a user can pass to the module
 
     module_args = BitbucketHelper.bitbucket_argument_spec()
     module_args.update(
@@ -197,21 +361,28 @@ def run_module():
             required=True,
             no_log=False),
         name=dict(
-            required=True,
+            required=False,
             type='str',
             no_log=False,),
         type=dict(
-            required=True,
+            required=False,
             type='str',
             no_log=False,
             choices=['Staging', 'Test', 'Production']),
+        environments=dict(
+            required=False,
+            type='list',
+            elements='dict',
+            options=environment_spec()),
         variables=dict(
             required=False,
             no_log=False,
             type='list',
             elements='dict',
-            options=variable_spec),
+            options=variable_spec()),
     )
+    module_args.update(FingerprintStore.argument_spec())
+    module_args.update(PlanFile.argument_spec())
 
     # seed the result dict in the object
     # we primarily care about changed and state
@@ -227,25 +398,41 @@ def run_module():
     # this includes instantiation, a couple of common attr would be the
     # args/params passed to the execution, as well as if the module
     # supports check mode
-    module = AnsibleModule(
+    module = module_class(
         argument_spec=module_args,
-        supports_check_mode=True
+        supports_check_mode=True,
+        required_if=fingerprint_required_if(),
+        required_one_of=[('name', 'environments')],
+        required_together=[('name', 'type')],
+        mutually_exclusive=[('name', 'environments'), ('variables', 'environments')],
     )
 
-    # if the user is working with this module in only check mode we do not
-    # want to make any changes to the environment, just return the current
-    # state with no modifications
-    if module.check_mode:
-        module.exit_json(**result)
-
     bitbucket = BitbucketHelper(module)
+    plan_file = PlanFile.from_params(
+        module.params, 'bitbucket_repo_env', ['repository', 'name', 'type', 'variables', 'environments', 'fingerprint_store'])
 
-    existing_repository = bitbucket.get_repository_info()
+    # in check mode, only read the current state and return the plan of changes
+    if module.check_mode:
+        result['plan'] = []
+        bitbucket.recorder.start()
 
-    if existing_repository:
-        manage_environments(result, bitbucket, module)
+    state = None if module.check_mode else load_valid_plan(bitbucket, plan_file)
+    result['plan_reused'] = state is not None
+
+    if state is not None or bitbucket.get_repository_info():
+        if module.params['environments'] is not None:
+            state = manage_environment_list(result, bitbucket, module, state)
+        else:
+            state = manage_environments(result, bitbucket, module, state)
     else:
-        module.fail_json(msg="Repository doesn't exists")
+        bitbucket.fail(msg="Repository doesn't exists")
+
+    if module.check_mode and plan_file is not None:
+        plan_file.save(bitbucket.recorder.reads, state)
+    elif result['plan_reused']:
+        plan_file.discard()
+
+    result['api_stats'] = bitbucket.get_stats()
 
     if result is not None:
         module.exit_json(**result)
@@ -15,16 +15,6 @@ version_added: "1.0.0"
 description:
     - Manage permissions for a repository on Bitbucket Cloud
 options:
-    username:
-        description:
-            - Username used for authentication.
-        type: str
-        required: true
-    password:
-        description:
-            - Password used for authentication.
-        type: str
-        required: true
     repository:
         description:
             - Repository name.
@@ -40,13 +30,17 @@ options:
                 type: str
                 description:
                 - Type of member to grant permission
-                - Currently we only support type group
+                - Group permissions are always reconciled, groups that are not listed lose their permission
+                - User permissions are only reconciled when at least one user is listed, then users that are not listed
+                  lose their permission. Both scopes are read at the same time and their changes share the I(max_concurrency) pool
                 choices: [ group, user ]
                 required: true
             name:
                 type: str
                 description:
-                - Name of group or user
+                - Slug of the group
+                - Nickname, account ID or UUID of the user. Users that have no permission on the repository yet must be given
+                  by account ID (e.g. C(557058:0a1b2c3d-...)) or UUID, the API doesn't accept nicknames to grant a permission
                 required: true
             permission:
                 type: str
@@ -54,6 +48,17 @@ options:
                 - Type of permission that will be granted
                 choices: [ admin, write, read ]
                 required: true
+    max_concurrency:
+        type: int
+        description:
+            - Number of changes sent at the same time to the API
+            - Every change is tried, the module fails after all of them finished if any failed
+        default: 1
+        required: false
+extends_documentation_fragment:
+    - i2btech.ops.bitbucket
+    - i2btech.ops.bitbucket.snapshot
+    - i2btech.ops.bitbucket.plan_file
 author:
     - IT I2B (it@i2btech.com)
 '''
@@ -79,72 +84,76 @@ message:
     type: dict
     returned: always
     sample: []
+mutations:
+    description: Outcome of every change applied, in the order they were computed
+    type: list
+    elements: dict
+    returned: when changes were applied
+    sample: [{"name": "user", "action": "update", "status": "ok"}]
+concurrency:
+    description:
+        - Concurrency used by each batch of changes when I(adaptive_concurrency=true), the limit starts at half of I(max_concurrency)
+        - C(trajectory) lists every change of the limit, after how many changes completed and why
+    type: list
+    elements: dict
+    returned: when changes were applied with I(adaptive_concurrency)
+    sample: [{"ceiling": 20, "final": 6, "peak": 12, "trajectory": [{"completed": 0, "limit": 10, "reason": "start"},
+             {"completed": 10, "limit": 11, "reason": "healthy", "p95_ms": 180.5}, {"completed": 34, "limit": 6, "reason": "throttled"}]}]
+plan:
+    description: Changes the module would apply, only in check mode. Check mode reads the current state but doesn't change it
+    type: list
+    elements: dict
+    returned: check mode
+    sample: [{"action": "create", "name": "user"}]
+plan_reused:
+    description: Whether the plan saved on I(plan_file) was applied without reading the current state again
+    type: bool
+    returned: always
+    sample: false
+api_stats:
+    description: Counters of the HTTP activity against the Bitbucket API
+    type: dict
+    returned: always
+    sample: {"connections_opened": 1, "requests_sent": 4}
 '''
 
 #pylint: disable=wrong-import-position
 from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket import BitbucketHelper
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_mutations import MutationExecutor
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_plan import PlanFile, load_valid_plan
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_reconcile import prepare_permissions
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_specs import permission_spec
 from ansible.module_utils.basic import AnsibleModule
 #pylint: disable=wrong-import-position
 
-def manage_permissions(result, bitbucket, module):
-    """ CRUD repo permissions """
-
-    # get current groups assigned to the repo
-    current_groups = bitbucket.get_repository_permissions_info(scope='group')
-    # get new groups assigned to the repo
-    new_groups = []
-    for perm in module.params['permissions']:
-        if perm['type'] == 'group':
-            new_groups.extend([perm])
-
-    # actions for new groups
-    for i in new_groups:
-        group_exists = False
-        group_perm = None
-        for x in current_groups:
-            if i['name'].lower() == x['name'].lower():
-                group_exists = True
-                group_perm = x['perm'].lower()
-                break
-
-        if group_exists:
-            # group exists on current groups, update permissions if they are different
-            if not i['perm'].lower() == group_perm:
-                bitbucket.apply_repository_permissions('promote', 'group', i['name'], i['perm'])
-                result['changed'] = True
-        else:
-            # group doesn't exist on current groups, add
-            bitbucket.apply_repository_permissions('promote', 'group', i['name'], i['perm'])
-            result['changed'] = True
-
-    # action for current groups
-    for i in current_groups:
-        if not any(
-            i['name'].lower() == x['name'].lower()
-                for x in new_groups
-        ):
-            # current group doesn't exists on new groups, delete
-            bitbucket.apply_repository_permissions('demote', 'group', i['name'])
-            result['changed'] = True
-
-def run_module():
-    """ main module """
+def manage_permissions(result, bitbucket, module, state=None):
+    """
+    CRUD repo permissions
+    state: state saved on a plan file, the permissions are not read
+    Returns the state of the changes, to save it on a plan file
+    """
 
-    # define available arguments/parameters a user can pass to the module
+    changes = prepare_permissions(
+        bitbucket,
+        module.params['repository'],
+        module.params['permissions'],
+        state and state['permissions'])
 
-    perm_spec = dict(
-        type=dict(
-            required=True,
-            type='str',
-            choices=['user', 'group']),
-        name=dict(
-            required=True,
-            type='str'),
-        perm=dict(
-            required=False,
-            type='str',
-            choices=['admin', 'write', 'read'])
-    )
+    if module.check_mode:
+        result['plan'] = changes.plan.describe()
+        result['changed'] = len(changes.plan) > 0
+    else:
+        MutationExecutor(bitbucket).apply(result, changes.mutations, changes.finalize)
+
+    return dict(permissions=changes.state)
+
+def run_module(module_class=AnsibleModule):
+    """
+    main module
+    module_class: AnsibleModule or the stand-in used by the action plugin on the controller
+    """
+
+    # define available arguments/parameters a user can pass to the module
 
     module_args = BitbucketHelper.bitbucket_argument_spec()
     module_args.update(
@@ -158,8 +167,9 @@ def run_module():
             elements='dict',
             required=False,
             no_log=False,
-            options=perm_spec),
+            options=permission_spec()),
     )
+    module_args.update(PlanFile.argument_spec())
 
     # seed the result dict in the object
     # we primarily care about changed and state
@@ -175,25 +185,34 @@ def run_module():
     # this includes instantiation, a couple of common attr would be the
     # args/params passed to the execution, as well as if the module
     # supports check mode
-    module = AnsibleModule(
+    module = module_class(
         argument_spec=module_args,
         supports_check_mode=True
     )
 
-    # if the user is working with this module in only check mode we do not
-    # want to make any changes to the environment, just return the current
-    # state with no modifications
-    if module.check_mode:
-        module.exit_json(**result)
-
     bitbucket = BitbucketHelper(module)
+    plan_file = PlanFile.from_params(
+        module.params, 'bitbucket_repo_perm', ['repository', 'permissions'])
 
-    existing_repository = bitbucket.get_repository_info()
+    # in check mode, only read the current state and return the plan of changes
+    if module.check_mode:
+        result['plan'] = []
+        bitbucket.recorder.start()
 
-    if existing_repository:
-        manage_permissions(result, bitbucket, module)
+    state = None if module.check_mode else load_valid_plan(bitbucket, plan_file)
+    result['plan_reused'] = state is not None
+
+    if state is not None or bitbucket.get_repository_info():
+        state = manage_permissions(result, bitbucket, module, state)
     else:
-        module.fail_json(msg="Repository doesn't exists")
+        bitbucket.fail(msg="Repository doesn't exists")
+
+    if module.check_mode and plan_file is not None:
+        plan_file.save(bitbucket.recorder.reads, state)
+    elif result['plan_reused']:
+        plan_file.discard()
+
+    result['api_stats'] = bitbucket.get_stats()
 
     if result is not None:
         module.exit_json(**result)
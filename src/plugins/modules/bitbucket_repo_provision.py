@@ -0,0 +1,318 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" bitbucket_repo_provision module """
+
+# Copyright: (c) 2018, Terry Jones <terry.jones@example.org>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = r'''
+---
+module: bitbucket_repo_provision
+short_description: Provision a repository on Bitbucket Cloud with its variables, environments and permissions
+version_added: "2.2.0"
+description:
+    - Create a repository if needed and reconcile its pipeline variables, deployment environments and permissions in one task
+    - The steps run as a dependency graph, every step starts as soon as the steps it needs finished, e.g. the pipeline,
+      the variables and the permissions of a new repository are applied at the same time and each environment is
+      handled on its own
+    - A failed step skips the steps that depend on it, the others go on and the task fails at the end
+    - In check mode the steps only read and return their plan, when the repository doesn't exist the other steps are skipped
+options:
+    repository:
+        description:
+            - Repository name.
+        type: str
+        required: true
+    project_key:
+        description:
+            - Bitbucket project key
+            - If given, the repository is created when it doesn't exist, otherwise the task fails
+        type: str
+        required: false
+    variables:
+        description:
+            - Pipeline variables of the repository, same format of the option C(variables) of M(i2btech.ops.bitbucket_repo_var)
+            - If omitted, the variables of the repository are not managed
+        type: list
+        elements: dict
+        required: false
+    environments:
+        description:
+            - Deployment environments of the repository, each one with C(name), C(type) and C(variables)
+              like the options of M(i2btech.ops.bitbucket_repo_env)
+            - Environments that are not listed are not deleted
+        type: list
+        elements: dict
+        required: false
+    permissions:
+        description:
+            - Permissions of the repository, same format of the option C(permissions) of M(i2btech.ops.bitbucket_repo_perm)
+            - If omitted, the permissions of the repository are not managed
+        type: list
+        elements: dict
+        required: false
+    max_concurrency:
+        type: int
+        description:
+            - Number of steps and changes run at the same time, the changes sent by every step share this limit with the steps
+        default: 1
+        required: false
+extends_documentation_fragment:
+    - i2btech.ops.bitbucket
+    - i2btech.ops.bitbucket.fingerprint
+author:
+    - IT I2B (it@i2btech.com)
+'''
+
+EXAMPLES = r'''
+- name: "Provision repository X"
+  i2btech.ops.bitbucket_repo_provision:
+  username: "alice"
+  password: "app_password"
+  repository: "example-X"
+  project_key: "POC"
+  max_concurrency: 5
+  variables:
+    - name: user
+      value: xxx
+  environments:
+    - name: Integration
+      type: Test
+      variables:
+        - name: pass
+          value: _super_secret_pass_
+          secured: true
+    - name: Production
+      type: Production
+  permissions:
+    - type: group
+      name: developers
+      perm: write
+'''
+
+RETURN = r'''
+nodes:
+    description:
+        - Every step of the provisioning in the order they were added to the graph, with the steps they required,
+          their status (C(ok), C(failed) or C(skipped)), when they started and how long they took in milliseconds
+          since the graph started
+        - Steps that changed something report C(changed) and the outcome of their changes in C(mutations), or their C(plan) in check mode
+    type: list
+    elements: dict
+    returned: always
+    sample: [{"name": "repository", "requires": [], "status": "ok", "changed": true, "start_ms": 0.1, "duration_ms": 412.5},
+             {"name": "pipeline", "requires": ["repository"], "status": "ok", "changed": true, "start_ms": 413.0, "duration_ms": 180.2}]
+critical_path:
+    description: Chain of steps that finished last, each one waiting on the one it required that finished last
+    type: list
+    elements: str
+    returned: always
+    sample: ["repository", "environments", "environment:Production"]
+wall_ms:
+    description: Milliseconds the whole graph took
+    type: float
+    returned: always
+    sample: 1250.8
+api_stats:
+    description: Counters of the HTTP activity against the Bitbucket API
+    type: dict
+    returned: always
+    sample: {"connections_opened": 5, "requests_sent": 40}
+'''
+
+#pylint: disable=wrong-import-position
+import time
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket import BitbucketError, BitbucketHelper
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_fingerprint import FingerprintStore
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_mutations import MutationExecutor
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_provision import (
+    NodeSkipped,
+    ProvisioningGraph,
+    critical_path,
+)
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_reconcile import (
+    prepare_environment_variables,
+    prepare_permissions,
+    prepare_variables,
+)
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_specs import desired_state_spec, fingerprint_required_if
+from ansible.module_utils.basic import AnsibleModule
+#pylint: disable=wrong-import-position
+
+def apply_changes(bitbucket, graph, changes, check_mode):
+    """ apply the changes prepared by a step, or describe them in check mode """
+
+    if check_mode:
+        return dict(changed=len(changes.plan) > 0, plan=changes.plan.describe())
+
+    # the changes take the slots of the graph, the step gives its own back meanwhile
+    with graph.waiting():
+        outcomes = MutationExecutor(bitbucket, slot=graph.slot).execute(changes.mutations)
+    if changes.finalize is not None:
+        changes.finalize()
+
+    failed = [outcome for outcome in outcomes if outcome['status'] == 'failed']
+    if failed:
+        raise BitbucketError('{0} of {1} changes failed: {2}'.format(
+            len(failed), len(outcomes), ', '.join('{0} ({1})'.format(outcome['name'], outcome['msg']) for outcome in failed)))
+
+    return dict(changed=len(outcomes) > 0, mutations=outcomes)
+
+def build_graph(bitbucket, module):
+    """ nodes of the provisioning of the repository """
+
+    params = module.params
+    repository = params['repository']
+    check_mode = module.check_mode
+    # data passed from a node to the nodes that require it
+    context = dict(created=False, environments={})
+
+    graph = ProvisioningGraph(guard=bitbucket.raising_errors)
+
+    def ensure_repository():
+        if bitbucket.get_repository_info(repository):
+            return dict(changed=False)
+        if not params['project_key']:
+            raise BitbucketError("Repository doesn't exists")
+        if check_mode:
+            raise NodeSkipped('Repository {0} would be created'.format(repository))
+        bitbucket.create_repository(repository, params['project_key'])
+        context['created'] = True
+        return dict(changed=True)
+
+    def enable_pipeline():
+        # an existing repository keeps its pipeline configuration
+        if not context['created']:
+            return dict(changed=False)
+        bitbucket.enable_repository_pipeline(repository)
+        return dict(changed=True)
+
+    graph.add('repository', ensure_repository)
+    graph.add('pipeline', enable_pipeline, requires=['repository'])
+
+    if params['variables'] is not None:
+        graph.add(
+            'variables',
+            lambda: apply_changes(bitbucket, graph, prepare_variables(bitbucket, repository, params['variables'], params), check_mode),
+            requires=['repository'])
+
+    if params['permissions'] is not None:
+        graph.add(
+            'permissions',
+            lambda: apply_changes(bitbucket, graph, prepare_permissions(bitbucket, repository, params['permissions']), check_mode),
+            requires=['repository'])
+
+    if params['environments']:
+        def list_environments():
+            for env in bitbucket.iter_repository_environments(repository):
+                context['environments'][(env['name'].casefold(), env['environment_type']['name'].casefold())] = env['uuid']
+            return dict(changed=False)
+
+        graph.add('environments', list_environments, requires=['repository'])
+
+        for env in params['environments']:
+            graph.add(
+                'environment:{0}'.format(env['name']),
+                lambda env=env: provision_environment(bitbucket, graph, env, context, params, check_mode),
+                requires=['environments'])
+
+    return graph
+
+def provision_environment(bitbucket, graph, env, context, params, check_mode):
+    """ create a deployment environment when it is missing and reconcile its variables """
+
+    repository = params['repository']
+    env_uuid = context['environments'].get((env['name'].casefold(), env['type'].casefold()))
+    report = dict(changed=False)
+    current_variables = None
+
+    if env_uuid is None:
+        report['changed'] = True
+        if check_mode:
+            report['plan'] = [dict(action='create', name=env['name'])]
+            return report
+        env_uuid = bitbucket.manage_repository_environments('create', env['name'], env['type'], repository=repository)['uuid']
+        current_variables = []
+
+    if env.get('variables') is not None:
+        changes = prepare_environment_variables(
+            bitbucket, repository, env_uuid, env['variables'], params, current_variables)
+        variables_report = apply_changes(bitbucket, graph, changes, check_mode)
+        report['changed'] = report['changed'] or variables_report.pop('changed')
+        report.update(variables_report)
+
+    return report
+
+def run_module(module_class=AnsibleModule):
+    """
+    main module
+    module_class: AnsibleModule or the stand-in used by the action plugin on the controller
+    """
+
+    # define available arguments/parameters a user can pass to the module
+
+    module_args = BitbucketHelper.bitbucket_argument_spec()
+    module_args.update(
+        repository=dict(
+            type='str',
+            required=True,
+            no_log=False),
+        project_key=dict(
+            type='str',
+            required=False,
+            no_log=False),
+    )
+    module_args.update(desired_state_spec())
+    module_args.update(FingerprintStore.argument_spec())
+
+    result = dict(
+        changed=False,
+        nodes=[]
+    )
+
+    module = module_class(
+        argument_spec=module_args,
+        supports_check_mode=True,
+        required_if=fingerprint_required_if()
+    )
+
+    # every environment is a node of the graph, named after it
+    seen = set()
+    for env in module.params['environments'] or []:
+        if env['name'].casefold() in seen:
+            module.fail_json(msg='Environment {0} is listed more than once'.format(env['name']))
+        seen.add(env['name'].casefold())
+
+    bitbucket = BitbucketHelper(module)
+    graph = build_graph(bitbucket, module)
+
+    started = time.time()
+    result['nodes'] = graph.run(module.params['max_concurrency'])
+    result['wall_ms'] = round((time.time() - started) * 1000, 3)
+    result['critical_path'] = critical_path(result['nodes'])
+
+    result['changed'] = any(node.get('changed') for node in result['nodes'])
+    if module.check_mode and result['nodes'][0]['status'] == 'skipped':
+        # the repository would be created
+        result['changed'] = True
+    result['api_stats'] = bitbucket.get_stats()
+
+    failed = [node['name'] for node in result['nodes'] if node['status'] == 'failed']
+    if failed:
+        module.fail_json(
+            msg='{0} of {1} steps failed: {2}'.format(len(failed), len(result['nodes']), ', '.join(failed)),
+            **result
+        )
+
+    module.exit_json(**result)
+
+def main():
+    """ main function """
+
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
@@ -15,16 +15,6 @@ version_added: "1.0.0"
 description:
     - Manage variables for a repository on Bitbucket Cloud
 options:
-    username:
-        description:
-            - Username used for authentication.
-        type: str
-        required: true
-    password:
-        description:
-            - Password used for authentication.
-        type: str
-        required: true
     repository:
         description:
             - Repository name.
@@ -50,10 +40,22 @@ options:
                 type: bool
                 description:
                 - If true, variable will be encrypted and masked in the logs
-                - If true, the module will always finish with a state of changed. The Bitbucket Cloud API don't allow to check
-                  the current value of a secured variable thus we need to always update tha value to applies possible changes on the value
+                - The Bitbucket Cloud API never returns the value of a secured variable, so it is updated on every run and the task
+                  reports a change, unless I(fingerprint_store) knows the desired value is the last one written
                 - If false, you need to delete the variable to change it to secured
                 required: false
+    max_concurrency:
+        type: int
+        description:
+            - Number of changes sent at the same time to the API
+            - Every change is tried, the module fails after all of them finished if any failed
+        default: 1
+        required: false
+extends_documentation_fragment:
+    - i2btech.ops.bitbucket
+    - i2btech.ops.bitbucket.fingerprint
+    - i2btech.ops.bitbucket.snapshot
+    - i2btech.ops.bitbucket.plan_file
 author:
     - IT I2B (it@i2btech.com)
 '''
@@ -78,84 +80,78 @@ message:
     type: dict
     returned: always
     sample: []
+mutations:
+    description: Outcome of every change applied, in the order they were computed
+    type: list
+    elements: dict
+    returned: when changes were applied
+    sample: [{"name": "user", "action": "update", "status": "ok"}]
+concurrency:
+    description:
+        - Concurrency used by each batch of changes when I(adaptive_concurrency=true), the limit starts at half of I(max_concurrency)
+        - C(trajectory) lists every change of the limit, after how many changes completed and why
+    type: list
+    elements: dict
+    returned: when changes were applied with I(adaptive_concurrency)
+    sample: [{"ceiling": 20, "final": 6, "peak": 12, "trajectory": [{"completed": 0, "limit": 10, "reason": "start"},
+             {"completed": 10, "limit": 11, "reason": "healthy", "p95_ms": 180.5}, {"completed": 34, "limit": 6, "reason": "throttled"}]}]
+plan:
+    description: Changes the module would apply, only in check mode. Check mode reads the current state but doesn't change it
+    type: list
+    elements: dict
+    returned: check mode
+    sample: [{"action": "create", "name": "user"}]
+plan_reused:
+    description: Whether the plan saved on I(plan_file) was applied without reading the current state again
+    type: bool
+    returned: always
+    sample: false
+api_stats:
+    description: Counters of the HTTP activity against the Bitbucket API
+    type: dict
+    returned: always
+    sample: {"connections_opened": 1, "requests_sent": 4}
 '''
 
 #pylint: disable=wrong-import-position
 from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket import BitbucketHelper
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_fingerprint import FingerprintStore
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_mutations import MutationExecutor
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_plan import PlanFile, load_valid_plan
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_reconcile import prepare_variables
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_specs import fingerprint_required_if, variable_spec
 from ansible.module_utils.basic import AnsibleModule
 #pylint: disable=wrong-import-position
 
-def manage_variables(result, bitbucket, module):
-    """ CRUD variables """
-
-    api_url=bitbucket.BITBUCKET_API_ENDPOINTS['repos-pipeline'].format(
-                url=module.params['url'],
-                workspace='i2b',
-                repo_slug=module.params['repository'])
-
-    current_variables = bitbucket.get_variables(api_url + "/variables/")
-    new_variables = []
-    for var in module.params['variables']:
-        new_variables.extend([var])
-
-    # actions for new variables
-    for i in new_variables:
-        var_exists = False
-        var_value = None
-        var_uuid = None
-        for x in current_variables:
-            if i['name'].lower() == x['key'].lower():
-                var_exists = True
-                var_uuid = x['uuid']
-                if not x['secured']:
-                    var_value = x['value']
-                break
-
-        if var_exists:
-            # always update secured variable
-            if var_value is None:
-                bitbucket.manage_repository_variables('update', i['name'], i['value'], var_uuid, i['secured'])
-                result['changed'] = True
-            # if not secured and value are different, update variable
-            else:
-                if i['value'] != var_value:
-                    bitbucket.manage_repository_variables('update', i['name'], i['value'], var_uuid, i['secured'])
-                    result['changed'] = True
-
-        else:
-            # variable doesn't exist on current variables, add
-            bitbucket.manage_repository_variables('create', i['name'], i['value'], None, i['secured'])
-            result['changed'] = True
-
-    # action for current variables
-    for i in current_variables:
-        if not any(
-            i['key'].lower() == x['name'].lower()
-                for x in new_variables
-        ):
-            # current variable doesn't exists on new variables, delete
-            bitbucket.manage_repository_variables('delete', None, None, i['uuid'], None)
-            result['changed'] = True
-
-def run_module():
-    """ main module """
+def manage_variables(result, bitbucket, module, state=None):
+    """
+    CRUD variables
+    state: state saved on a plan file, the variables are not read
+    Returns the state of the changes, to save it on a plan file
+    """
 
-    # define available arguments/parameters a user can pass to the module
+    changes = prepare_variables(
+        bitbucket,
+        module.params['repository'],
+        module.params['variables'],
+        module.params,
+        state and state['variables'])
 
-    variable_spec = dict(
-        name=dict(
-            required=True,
-            type='str',
-            no_log=False,),
-        value=dict(
-            required=True,
-            no_log=True,
-            type='str'),
-        secured=dict(
-            required=False,
-            type='bool',
-            default=False)
-    )
+    if module.check_mode:
+        result['plan'] = changes.plan.describe()
+        result['changed'] = len(changes.plan) > 0
+    else:
+        MutationExecutor(bitbucket).apply(result, changes.mutations, changes.finalize)
+
+    return dict(variables=changes.state)
+
+def run_module(module_class=AnsibleModule):
+    """
+    main module
+    module_class: AnsibleModule or the stand-in used by the action plugin on the controller
+    """
+
+    # define available arguments/parameters a user can pass to the module
 
     module_args = BitbucketHelper.bitbucket_argument_spec()
     module_args.update(
@@ -169,8 +165,10 @@ def run_module():
             elements='dict',
             required=False,
             no_log=False,
-            options=variable_spec),
+            options=variable_spec()),
     )
+    module_args.update(FingerprintStore.argument_spec())
+    module_args.update(PlanFile.argument_spec())
 
     # seed the result dict in the object
     # we primarily care about changed and state
@@ -186,25 +184,35 @@ def run_module():
     # this includes instantiation, a couple of common attr would be the
     # args/params passed to the execution, as well as if the module
     # supports check mode
-    module = AnsibleModule(
+    module = module_class(
         argument_spec=module_args,
-        supports_check_mode=True
+        supports_check_mode=True,
+        required_if=fingerprint_required_if()
     )
 
-    # if the user is working with this module in only check mode we do not
-    # want to make any changes to the environment, just return the current
-    # state with no modifications
-    if module.check_mode:
-        module.exit_json(**result)
-
     bitbucket = BitbucketHelper(module)
+    plan_file = PlanFile.from_params(
+        module.params, 'bitbucket_repo_var', ['repository', 'variables', 'fingerprint_store'])
 
-    existing_repository = bitbucket.get_repository_info()
+    # in check mode, only read the current state and return the plan of changes
+    if module.check_mode:
+        result['plan'] = []
+        bitbucket.recorder.start()
 
-    if existing_repository:
-        manage_variables(result, bitbucket, module)
+    state = None if module.check_mode else load_valid_plan(bitbucket, plan_file)
+    result['plan_reused'] = state is not None
+
+    if state is not None or bitbucket.get_repository_info():
+        state = manage_variables(result, bitbucket, module, state)
     else:
-        module.fail_json(msg="Repository doesn't exists")
+        bitbucket.fail(msg="Repository doesn't exists")
+
+    if module.check_mode and plan_file is not None:
+        plan_file.save(bitbucket.recorder.reads, state)
+    elif result['plan_reused']:
+        plan_file.discard()
+
+    result['api_stats'] = bitbucket.get_stats()
 
     if result is not None:
         module.exit_json(**result)
@@ -0,0 +1,168 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" bitbucket_workspace_audit module """
+
+# Copyright: (c) 2018, Terry Jones <terry.jones@example.org>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = r'''
+---
+module: bitbucket_workspace_audit
+short_description: Audit the drift of every repository of a workspace on Bitbucket Cloud against a manifest
+version_added: "2.2.0"
+description:
+    - Compare the variables, deployment environments and permissions of every repository of the workspace with a manifest
+      and write every difference to a JSON lines file as soon as it is found, nothing is changed on Bitbucket
+    - The repositories are listed one page at a time and the reads of each repository run at the same time, the memory
+      used doesn't grow with the size of the workspace
+    - Each line has the C(repository), the C(scope) (C(repository), C(variables), C(environments), C(environment:<name>)
+      or C(permissions)), the C(action) that would fix it (C(create), C(update), C(delete), C(promote), C(demote)) and
+      the C(name) of the item. Repositories without entry in the manifest nor C(default) are C(unmanaged), repositories
+      of the manifest that are not in the workspace are C(missing) and reads that failed are C(error) with a C(msg)
+    - Secured variables always show up as C(update) unless C(fingerprint_store) is used, the API never returns their values
+    - Users of C(permissions) given by nickname that have no permission on a repository are reported as C(create) with a
+      C(msg), only users with a permission can be matched by nickname
+options:
+    repositories:
+        description:
+            - Manifest of the repositories, same format of the option C(repositories) of M(i2btech.ops.bitbucket_workspace_sync)
+            - C(project_key) is accepted and ignored, so the same manifest can be given to both modules
+        type: list
+        elements: dict
+        required: true
+    default:
+        description:
+            - Desired C(variables), C(environments) and C(permissions) of the repositories that are not in the manifest
+            - If omitted, those repositories are reported as C(unmanaged)
+        type: dict
+        required: false
+    audit_file:
+        description:
+            - File where the drift records are written, one JSON object per line, it is replaced on every run
+        type: path
+        required: true
+    max_concurrency:
+        type: int
+        description:
+            - Number of reads in flight, each repository needs one read for its variables, environments and permissions
+        default: 1
+        required: false
+extends_documentation_fragment:
+    - i2btech.ops.bitbucket
+    - i2btech.ops.bitbucket.fingerprint
+author:
+    - IT I2B (it@i2btech.com)
+'''
+
+EXAMPLES = r'''
+- name: "Audit the workspace"
+  i2btech.ops.bitbucket_workspace_audit:
+  username: "alice"
+  password: "app_password"
+  max_concurrency: 20
+  audit_file: "/var/log/bitbucket/audit.jsonl"
+  default:
+    permissions:
+      - type: group
+        name: developers
+        perm: write
+  repositories:
+    - name: "example-X"
+      variables:
+        - name: user
+          value: xxx
+      environments:
+        - name: Production
+          type: Production
+'''
+
+RETURN = r'''
+audit_file:
+    description: File with the drift records
+    type: str
+    returned: always
+    sample: "/var/log/bitbucket/audit.jsonl"
+summary:
+    description:
+        - Repositories audited, with drift (C(drifted)) and with failed reads (C(failed)), repositories C(unmanaged) and C(missing),
+          number of records written and number of records of each action
+    type: dict
+    returned: always
+    sample: {"repositories": 120, "drifted": 3, "failed": 0, "unmanaged": 4, "missing": 1, "records": 12,
+             "actions": {"update": 7, "create": 4, "missing": 1}}
+api_stats:
+    description: Counters of the HTTP activity against the Bitbucket API
+    type: dict
+    returned: always
+    sample: {"connections_opened": 20, "requests_sent": 361}
+'''
+
+#pylint: disable=wrong-import-position
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket import BitbucketHelper
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_audit import DriftAudit
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_fingerprint import FingerprintStore
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_specs import desired_state_spec, fingerprint_required_if, repository_spec
+from ansible.module_utils.basic import AnsibleModule
+#pylint: disable=wrong-import-position
+
+def run_module(module_class=AnsibleModule):
+    """
+    main module
+    module_class: AnsibleModule or the stand-in used by the action plugin on the controller
+    """
+
+    # define available arguments/parameters a user can pass to the module
+
+    module_args = BitbucketHelper.bitbucket_argument_spec()
+    module_args.update(
+        repositories=dict(
+            type='list',
+            elements='dict',
+            required=True,
+            options=repository_spec()),
+        default=dict(
+            type='dict',
+            required=False,
+            options=desired_state_spec()),
+        audit_file=dict(
+            type='path',
+            required=True),
+    )
+    module_args.update(FingerprintStore.argument_spec())
+
+    result = dict(
+        changed=False,
+        audit_file=None,
+        summary={}
+    )
+
+    module = module_class(
+        argument_spec=module_args,
+        supports_check_mode=True,
+        required_if=fingerprint_required_if()
+    )
+
+    bitbucket = BitbucketHelper(module)
+    audit = DriftAudit(bitbucket, module.params['repositories'], module.params, default=module.params['default'])
+
+    result['audit_file'] = module.params['audit_file']
+    try:
+        with open(module.params['audit_file'], 'w', encoding='utf-8') as stream:
+            result['summary'] = audit.run(stream)
+    except (IOError, OSError) as exc:
+        module.fail_json(msg='Unable to write {0}: {1}'.format(module.params['audit_file'], exc), **result)
+
+    result['api_stats'] = bitbucket.get_stats()
+
+    module.exit_json(**result)
+
+def main():
+    """ main function """
+
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" bitbucket_workspace_sync module """
+
+# Copyright: (c) 2018, Terry Jones <terry.jones@example.org>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = r'''
+---
+module: bitbucket_workspace_sync
+short_description: Manage many repositories of a workspace on Bitbucket Cloud in one task
+version_added: "2.2.0"
+description:
+    - Reconcile repositories, their variables, deployment environments and permissions from one manifest
+    - All the repositories are managed by the same process, sharing the connections to the API
+    - In check mode the repositories are only read and the changes they need are listed in the C(plan) of each repository,
+      nothing else is planned for a repository that would be created
+options:
+    repositories:
+        description: Manifest of the repositories that will be managed
+        type: list
+        elements: dict
+        required: true
+        suboptions:
+            name:
+                type: str
+                description:
+                    - Repository name
+                required: true
+            project_key:
+                type: str
+                description:
+                    - Bitbucket project key
+                    - If given, the repository is created when it doesn't exist, otherwise the repository is reported as failed
+                required: false
+            variables:
+                type: list
+                elements: dict
+                description:
+                    - Pipeline variables of the repository, same format of the option C(variables) of M(i2btech.ops.bitbucket_repo_var)
+                    - If omitted, the variables of the repository are not managed
+                required: false
+            environments:
+                type: list
+                elements: dict
+                description:
+                    - Deployment environments of the repository, each one with C(name), C(type) and C(variables)
+                      like the options of M(i2btech.ops.bitbucket_repo_env)
+                    - Environments that are not listed are not deleted
+                required: false
+            permissions:
+                type: list
+                elements: dict
+                description:
+                    - Permissions of the repository, same format of the option C(permissions) of M(i2btech.ops.bitbucket_repo_perm)
+                    - If omitted, the permissions of the repository are not managed
+                required: false
+    max_concurrency:
+        type: int
+        description:
+            - Number of repositories reconciled at the same time, the changes of each repository are applied one after another
+        default: 1
+        required: false
+extends_documentation_fragment:
+    - i2btech.ops.bitbucket
+    - i2btech.ops.bitbucket.fingerprint
+    - i2btech.ops.bitbucket.snapshot
+author:
+    - IT I2B (it@i2btech.com)
+'''
+
+EXAMPLES = r'''
+- name: "Sync repositories of the workspace"
+  i2btech.ops.bitbucket_workspace_sync:
+  username: "alice"
+  password: "app_password"
+  max_concurrency: 10
+  repositories:
+    - name: "example-X"
+      project_key: "POC"
+      variables:
+        - name: user
+          value: xxx
+      environments:
+        - name: Integration
+          type: Test
+          variables:
+            - name: pass
+              value: _super_secret_pass_
+              secured: true
+      permissions:
+        - type: group
+          name: developers
+          perm: write
+'''
+
+RETURN = r'''
+repositories:
+    description: Summary of every repository, in the order of the manifest
+    type: list
+    elements: dict
+    returned: always
+    sample: [{"name": "example-X", "status": "ok", "changed": true, "created": false,
+              "changes": {"create": 1, "update": 0, "delete": 0}, "failures": []}]
+    contains:
+        plan:
+            description: In check mode, action, name and scope (C(repository), C(variables), C(environments), C(environment:<name>)
+                         or C(permissions)) of every change the repository needs
+            type: list
+            elements: dict
+            returned: check mode
+            sample: [{"action": "update", "name": "user", "scope": "variables"}]
+api_stats:
+    description: Counters of the HTTP activity against the Bitbucket API
+    type: dict
+    returned: always
+    sample: {"connections_opened": 10, "requests_sent": 400}
+'''
+
+#pylint: disable=wrong-import-position
+from concurrent.futures import ThreadPoolExecutor
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket import BitbucketError, BitbucketHelper
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_fingerprint import FingerprintStore
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_mutations import MutationExecutor
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_reconcile import (
+    prepare_environment_variables,
+    prepare_permissions,
+    prepare_variables,
+)
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_specs import fingerprint_required_if, repository_spec
+from ansible.module_utils.basic import AnsibleModule
+#pylint: disable=wrong-import-position
+
+def count_change(summary, action):
+    """ count a change on the summary of a repository """
+
+    summary['changed'] = True
+    action = {'promote': 'update', 'demote': 'delete'}.get(action, action)
+    summary['changes'][action] += 1
+
+def apply_changes(summary, bitbucket, changes, scope, check_mode):
+    """ apply the changes of one part of a repository and count them on its summary, in check mode only plan them """
+
+    if check_mode:
+        for change in changes.plan.describe():
+            count_change(summary, change['action'])
+            summary['plan'].append(dict(change, scope=scope))
+        return
+
+    outcomes = MutationExecutor(bitbucket).execute(changes.mutations, workers=1)
+    if changes.finalize is not None:
+        changes.finalize()
+
+    for outcome in outcomes:
+        if outcome['status'] == 'ok':
+            count_change(summary, outcome['action'])
+        else:
+            summary['failures'].append(outcome)
+
+def sync_environments(summary, bitbucket, repository, environments, params, check_mode):
+    """ create the missing environments and reconcile their variables """
+
+    current_environments = {}
+    for env in bitbucket.iter_repository_environments(repository):
+        current_environments[(env['name'].casefold(), env['environment_type']['name'].casefold())] = env['uuid']
+
+    for env in environments:
+        env_uuid = current_environments.get((env['name'].casefold(), env['type'].casefold()))
+        current_variables = None
+        if env_uuid is None:
+            if check_mode:
+                summary['plan'].append(dict(scope='environments', action='create', name=env['name']))
+            else:
+                new_env = bitbucket.manage_repository_environments('create', env['name'], env['type'], repository=repository)
+                env_uuid = new_env['uuid']
+            current_variables = []
+            count_change(summary, 'create')
+
+        if env.get('variables') is not None:
+            changes = prepare_environment_variables(
+                bitbucket, repository, env_uuid, env['variables'], params, current_variables)
+            apply_changes(summary, bitbucket, changes, 'environment:{0}'.format(env['name']), check_mode)
+
+def sync_repository(bitbucket, spec, params, check_mode=False):
+    """
+    reconcile one repository of the manifest, errors are reported on its summary
+    check_mode: only read the repository and list the changes in the `plan` of the summary
+    """
+
+    repository = spec['name']
+    summary = dict(
+        name=repository,
+        status='ok',
+        changed=False,
+        created=False,
+        changes=dict(create=0, update=0, delete=0),
+        failures=[],
+    )
+    if check_mode:
+        summary['plan'] = []
+
+    try:
+        with bitbucket.raising_errors():
+            if not bitbucket.get_repository_info(repository):
+                if not spec.get('project_key'):
+                    raise BitbucketError("Repository doesn't exists")
+                summary['created'] = True
+                summary['changed'] = True
+                if check_mode:
+                    # the rest of a repository that doesn't exist yet can't be read
+                    summary['plan'].append(dict(scope='repository', action='create', name=repository))
+                    return summary
+                bitbucket.create_repository(repository, spec['project_key'])
+                bitbucket.enable_repository_pipeline(repository)
+
+            if spec.get('variables') is not None:
+                apply_changes(summary, bitbucket, prepare_variables(bitbucket, repository, spec['variables'], params),
+                              'variables', check_mode)
+
+            if spec.get('environments') is not None:
+                sync_environments(summary, bitbucket, repository, spec['environments'], params, check_mode)
+
+            if spec.get('permissions') is not None:
+                apply_changes(summary, bitbucket, prepare_permissions(bitbucket, repository, spec['permissions']),
+                              'permissions', check_mode)
+
+    except BitbucketError as exc:
+        summary['failures'].append(dict(name=repository, status='failed', msg=str(exc)))
+
+    if summary['failures']:
+        summary['status'] = 'failed'
+
+    return summary
+
+def run_module(module_class=AnsibleModule):
+    """
+    main module
+    module_class: AnsibleModule or the stand-in used by the action plugin on the controller
+    """
+
+    # define available arguments/parameters a user can pass to the module
+
+    module_args = BitbucketHelper.bitbucket_argument_spec()
+    module_args.update(
+        repositories=dict(
+            type='list',
+            elements='dict',
+            required=True,
+            options=repository_spec()),
+    )
+    module_args.update(FingerprintStore.argument_spec())
+
+    result = dict(
+        changed=False,
+        repositories=[]
+    )
+
+    module = module_class(
+        argument_spec=module_args,
+        supports_check_mode=True,
+        required_if=fingerprint_required_if()
+    )
+
+    bitbucket = BitbucketHelper(module)
+
+    repositories = module.params['repositories']
+    workers = max(1, min(module.params['max_concurrency'], len(repositories)))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        result['repositories'] = list(executor.map(
+            lambda spec: sync_repository(bitbucket, spec, module.params, module.check_mode),
+            repositories))
+
+    result['changed'] = any(summary['changed'] for summary in result['repositories'])
+    result['api_stats'] = bitbucket.get_stats()
+
+    failed = [summary['name'] for summary in result['repositories'] if summary['status'] == 'failed']
+    if failed:
+        module.fail_json(
+            msg='{0} of {1} repositories failed: {2}'.format(len(failed), len(repositories), ', '.join(failed)),
+            **result
+        )
+
+    module.exit_json(**result)
+
+def main():
+    """ main function """
+
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
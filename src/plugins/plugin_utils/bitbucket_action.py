@@ -0,0 +1,191 @@
+"""
+Util classes to run the Bitbucket modules on the controller
+"""
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import importlib
+import json
+import os
+from functools import partial
+
+from ansible import constants as C
+from ansible.module_utils._text import to_text
+from ansible.module_utils.common.arg_spec import ArgumentSpecValidator
+from ansible.module_utils.errors import UnsupportedError
+from ansible.module_utils.common.parameters import remove_values
+from ansible.plugins.action import ActionBase
+from ansible.utils.display import Display
+
+display = Display()
+
+class ModuleExit(Exception):
+    """ Raised by ControllerModule to end the module with a result """
+
+    def __init__(self, result):
+        super().__init__(result.get('msg'))
+        self.result = result
+
+#
+# class: ControllerModule
+#
+
+class ControllerModule:
+    """
+    Class ControllerModule
+
+    Stand-in of AnsibleModule with the attributes used by the Bitbucket modules and BitbucketHelper.
+    Parameters come from the task arguments and exit_json/fail_json raise ModuleExit instead of
+    printing the result and ending the process.
+    """
+
+    def __init__(
+        self,
+        name,
+        task_args,
+        check_mode,
+        argument_spec,
+        supports_check_mode=False,
+        **validation_options):
+        self._name = name
+        self.argument_spec = argument_spec
+        self.check_mode = check_mode
+        self.no_log_values = set()
+
+        validation = ArgumentSpecValidator(argument_spec, **validation_options).validate(task_args)
+        self.params = validation.validated_parameters
+        self.no_log_values.update(no_log_values(argument_spec, self.params))
+
+        if validation.error_messages:
+            msg = validation.errors.msg
+            if isinstance(validation.errors[0], UnsupportedError):
+                msg = 'Unsupported parameters for ({0}) module: {1}'.format(name, msg)
+            self.fail_json(msg=msg)
+
+        if check_mode and not supports_check_mode:
+            self.exit_json(skipped=True, msg='module does not support check mode')
+
+    def exit_json(self, **kwargs):
+        """
+        End the module with a result
+        """
+
+        raise ModuleExit(remove_values(kwargs, self.no_log_values))
+
+    def fail_json(self, msg, **kwargs):
+        """
+        End the module with a failure
+        """
+
+        kwargs['failed'] = True
+        kwargs['msg'] = msg
+        self.exit_json(**kwargs)
+
+    @staticmethod
+    def jsonify(data):
+        """
+        Serialize the body of a request
+        """
+
+        return json.dumps(data)
+
+    @staticmethod
+    def debug(msg):
+        """
+        Log a message when ANSIBLE_DEBUG is enabled
+        """
+
+        display.debug(msg)
+
+    @staticmethod
+    def warn(msg):
+        """
+        Show a warning
+        """
+
+        display.warning(msg)
+
+def no_log_values(argument_spec, params):
+    """
+    Values of the parameters marked no_log, suboptions included, they are masked on the results
+    """
+
+    values = set()
+    for name, spec in argument_spec.items():
+        value = params.get(name)
+        if value is None:
+            continue
+
+        if spec.get('no_log'):
+            values.update(scalar_values(value))
+
+        if spec.get('options'):
+            for item in value if isinstance(value, list) else [value]:
+                if isinstance(item, dict):
+                    values.update(no_log_values(spec['options'], item))
+
+    return values
+
+def scalar_values(value):
+    """
+    Text of the strings and numbers of a parameter value, looking into dicts and lists
+    """
+
+    if isinstance(value, (str, bytes)):
+        if value:
+            yield to_text(value)
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from scalar_values(item)
+    elif isinstance(value, (list, tuple, set)):
+        for item in value:
+            yield from scalar_values(item)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield to_text(value)
+
+#
+# class: BitbucketAction
+#
+
+class BitbucketAction(ActionBase):
+    """
+    Class BitbucketAction
+
+    Base of the action plugins that run a Bitbucket module inside the controller worker instead of
+    shipping it to a new Python process. Every task shares the responses read by the previous
+    ones through a cache directory on the controller that lives as long as the playbook run.
+    """
+
+    TRANSFERS_FILES = False
+    _requires_connection = False
+
+    # name of the module under plugins/modules
+    MODULE_NAME = None
+
+    CACHE_DIR = 'bitbucket-cache'
+
+    def task_args(self):
+        """
+        Arguments of the task, reads go through the controller cache unless cache_dir is set
+        """
+
+        task_args = dict(self._task.args)
+        if not task_args.get('cache_dir'):
+            # the constants of the configuration are set when ansible loads, pylint can't see them
+            task_args['cache_dir'] = os.path.join(C.DEFAULT_LOCAL_TMP, self.CACHE_DIR)  # pylint: disable=no-member
+
+        return task_args
+
+    def run(self, tmp=None, task_vars=None):
+        result = super().run(tmp, task_vars)
+        del tmp  # tmp no longer has any effect
+
+        module = importlib.import_module('ansible_collections.i2btech.ops.plugins.modules.' + self.MODULE_NAME)
+
+        try:
+            module.run_module(partial(ControllerModule, self._task.action, self.task_args(), self._task.check_mode))
+        except ModuleExit as exc:
+            result.update(exc.result)
+
+        return result
@@ -0,0 +1,535 @@
+#!/usr/bin/env python
+"""
+Local stand-in of the Bitbucket Cloud API used by the benchmarks.
+
+It keeps the workspace in memory and emulates the endpoints of `BitbucketHelper.BITBUCKET_API_ENDPOINTS`:
+repositories, pipeline variables, deployment environments and their variables, and user and group
+permissions. Listings are paginated with `page`/`pagelen` (100 items at most) and return `size` and
+`next`, partial responses honor `fields`, GET responses carry an `ETag` and bodies are gzipped when
+the client accepts it, like Bitbucket does. A latency can be added
+to every request and a share of them answered with 429 to exercise the retries.
+
+It can also be started alone to point a playbook to it:
+
+    python benchmarks/bitbucket_stub.py --port 8080
+"""
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import argparse
+import gzip
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+MAX_PAGE_LENGTH = 100
+
+# smaller bodies are sent as they are
+GZIP_MIN_LENGTH = 1024
+
+def new_uuid():
+    """ UUID in the format used by Bitbucket """
+
+    return '{{{0}}}'.format(uuid.uuid4())
+
+def pick(value, fields):
+    """ keep only the attributes listed in `fields`, nested attributes are separated by dots """
+
+    if isinstance(value, list):
+        return [pick(item, fields) for item in value]
+
+    if not isinstance(value, dict):
+        return value
+
+    nested = {}
+    for field in fields:
+        head, _, rest = field.partition('.')
+        nested.setdefault(head, [])
+        if rest:
+            nested[head].append(rest)
+
+    picked = {}
+    for head, rest in nested.items():
+        if head in value:
+            picked[head] = pick(value[head], rest) if rest else value[head]
+
+    return picked
+
+#
+# class: StubServer
+#
+
+class StubServer(ThreadingHTTPServer):
+    """
+    Class StubServer
+
+    HTTP server of the stand-in, one thread per connection
+    """
+
+    daemon_threads = True
+
+    # clients open up to max_concurrency connections at once, the default backlog of 5 drops them
+    request_queue_size = 128
+
+#
+# class: Repository
+#
+
+class Repository:
+    """
+    Class Repository
+
+    State of one repository of the stand-in
+    """
+
+    def __init__(self, slug, workspace, project_key=None):
+        self.slug = slug
+        self.uuid = new_uuid()
+        self.full_name = '{0}/{1}'.format(workspace, slug)
+        self.project_key = project_key
+        self.pipeline = False
+        self.variables = {}
+        self.environments = {}
+        self.groups = {}
+        self.users = {}
+
+    def describe(self):
+        """ repository as returned by the API, with some of the attributes we don't read """
+
+        return dict(
+            type='repository',
+            slug=self.slug,
+            uuid=self.uuid,
+            full_name=self.full_name,
+            is_private=True,
+            project=dict(key=self.project_key),
+            links=dict(html=dict(href='https://bitbucket.org/' + self.full_name)),
+        )
+
+#
+# class: BitbucketStub
+#
+
+class BitbucketStub:
+    """
+    Class BitbucketStub
+
+    HTTP server emulating the Bitbucket API, it runs on a background thread.
+    latency: seconds added to every request.
+    throttle: share of the requests, between 0 and 1, answered with 429.
+    throttle_methods: methods that can be throttled.
+    """
+
+    def __init__(
+        self,
+        workspace='i2b',
+        latency=0.0,
+        throttle=0.0,
+        throttle_methods=('GET', 'POST', 'PUT', 'DELETE'),
+        port=0):
+        self.workspace = workspace
+        self.latency = latency
+        self.throttle = throttle
+        self.throttle_methods = throttle_methods
+        self.repositories = {}
+        self.requests = {}
+        self.connections = 0
+        self.lock = threading.Lock()
+        self.server = StubServer(('127.0.0.1', port), self.handler())
+        self.thread = None
+
+    @property
+    def url(self):
+        """ base URL of the API, to give as the `url` option of the modules """
+
+        return 'http://127.0.0.1:{0}/2.0'.format(self.server.server_address[1])
+
+    def start(self):
+        """ serve requests on a background thread """
+
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """ stop the server """
+
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset_counters(self):
+        """ forget the requests counted so far """
+
+        with self.lock:
+            self.requests = {}
+            self.connections = 0
+
+    def count(self, method):
+        """ count a request """
+
+        with self.lock:
+            self.requests[method] = self.requests.get(method, 0) + 1
+
+    def total_requests(self):
+        """ requests received since the counters were reset """
+
+        with self.lock:
+            return sum(self.requests.values())
+
+    def add_repository(self, slug, project_key='BENCH'):
+        """ create a repository and return it """
+
+        with self.lock:
+            repository = Repository(slug, self.workspace, project_key)
+            self.repositories[slug.lower()] = repository
+            return repository
+
+    @staticmethod
+    def add_variable(variables, key, value, secured=False):
+        """ add a variable to the variables of a repository or an environment """
+
+        var_uuid = new_uuid()
+        variables[var_uuid] = dict(type='pipeline_variable', uuid=var_uuid, key=key, value=value, secured=secured)
+        return var_uuid
+
+    @staticmethod
+    def add_environment(repository, name, environment_type):
+        """ add a deployment environment to a repository """
+
+        env_uuid = new_uuid()
+        repository.environments[env_uuid] = dict(name=name, type=environment_type, variables={})
+        return env_uuid
+
+    def handler(self):
+        """ request handler class bound to this stand-in """
+
+        stub = self
+
+        class Handler(StubRequestHandler):
+            """ request handler of the stand-in """
+
+            def setup(self):
+                super().setup()
+                with stub.lock:
+                    stub.connections += 1
+
+        Handler.stub = stub
+        return Handler
+
+#
+# class: StubRequestHandler
+#
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    """
+    Class StubRequestHandler
+
+    Routes the requests to the state of the stand-in
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    stub = None
+
+    ROUTES = [
+        (re.compile(r'^/2\.0/repositories/(?P<workspace>[^/]+)/?$'), 'workspace_repositories'),
+        (re.compile(r'^/2\.0/repositories/(?P<workspace>[^/]+)/(?P<slug>[^/]+)/?$'), 'repository'),
+        (re.compile(r'^/2\.0/repositories/(?P<workspace>[^/]+)/(?P<slug>[^/]+)/pipelines_config/?$'), 'pipeline'),
+        (re.compile(r'^/2\.0/repositories/(?P<workspace>[^/]+)/(?P<slug>[^/]+)/pipelines_config/variables/?(?P<item>[^/]*)$'),
+         'pipeline_variables'),
+        (re.compile(r'^/2\.0/repositories/(?P<workspace>[^/]+)/(?P<slug>[^/]+)/environments/?(?P<item>[^/]*)$'), 'environments'),
+        (re.compile(r'^/2\.0/repositories/(?P<workspace>[^/]+)/(?P<slug>[^/]+)/deployments_config/environments/(?P<env>[^/]+)'
+                    r'/variables/?(?P<item>[^/]*)$'), 'environment_variables'),
+        (re.compile(r'^/2\.0/repositories/(?P<workspace>[^/]+)/(?P<slug>[^/]+)/permissions-config/(?P<scope>groups|users)'
+                    r'/?(?P<item>[^/]*)$'), 'permissions'),
+    ]
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        self.dispatch()
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        self.dispatch()
+
+    def do_PUT(self):  # pylint: disable=invalid-name
+        self.dispatch()
+
+    def do_DELETE(self):  # pylint: disable=invalid-name
+        self.dispatch()
+
+    def dispatch(self):
+        """ read the request, apply latency and throttling and route it """
+
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        self.payload = json.loads(body) if body else {}
+
+        stub = self.stub
+        stub.count(self.command)
+
+        if stub.latency:
+            time.sleep(stub.latency)
+
+        if stub.throttle and self.command in stub.throttle_methods and random.random() < stub.throttle:
+            self.reply(429, dict(type='error', error=dict(message='Rate limit exceeded')), {'Retry-After': '0'})
+            return
+
+        split = urlsplit(self.path)
+        self.query = parse_qs(split.query)
+        for pattern, route in self.ROUTES:
+            match = pattern.match(split.path)
+            if match:
+                params = match.groupdict()
+                if params.pop('workspace') != stub.workspace:
+                    break
+                with stub.lock:
+                    getattr(self, 'route_' + route)(**params)
+                return
+
+        self.reply(404, dict(type='error', error=dict(message='Resource not found')))
+
+    def reply(self, status, content=None, headers=None):
+        """ send a JSON response, with an ETag and the partial response requested on GETs """
+
+        headers = dict(headers or {})
+
+        if content is not None and status < 300 and 'fields' in self.query:
+            content = pick(content, self.query['fields'][0].split(','))
+
+        body = json.dumps(content).encode('utf-8') if content is not None else b''
+
+        if self.command == 'GET' and status == 200:
+            headers['ETag'] = '"{0}"'.format(hashlib.sha1(body).hexdigest())
+            if self.headers.get('If-None-Match') == headers['ETag']:
+                status = 304
+                body = b''
+
+        if len(body) > GZIP_MIN_LENGTH and 'gzip' in (self.headers.get('Accept-Encoding') or ''):
+            headers['Content-Encoding'] = 'gzip'
+            body = gzip.compress(body, compresslevel=6)
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if status != 304:
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def page(self, items):
+        """ one page of a listing """
+
+        pagelen = min(int(self.query.get('pagelen', ['10'])[0]), MAX_PAGE_LENGTH)
+        page = int(self.query.get('page', ['1'])[0])
+
+        content = dict(
+            size=len(items),
+            page=page,
+            pagelen=pagelen,
+            values=items[(page - 1) * pagelen:page * pagelen],
+        )
+        if page * pagelen < len(items):
+            content['next'] = 'http://{0}{1}?page={2}&pagelen={3}'.format(
+                self.headers['Host'], urlsplit(self.path).path, page + 1, pagelen)
+
+        self.reply(200, content)
+
+    def repository(self, slug):
+        """ repository of the request, None after answering 404 """
+
+        repository = self.stub.repositories.get(slug.lower())
+        if repository is None:
+            self.reply(404, dict(type='error', error=dict(message='Repository not found')))
+
+        return repository
+
+    def route_workspace_repositories(self):
+        if self.command != 'GET':
+            self.reply(405)
+            return
+
+        self.page([repository.describe() for _, repository in sorted(self.stub.repositories.items())])
+
+    def route_repository(self, slug):
+        if self.command == 'POST':
+            repository = self.stub.repositories.get(slug.lower())
+            if repository is None:
+                repository = Repository(slug, self.stub.workspace, self.payload.get('project', {}).get('key'))
+                self.stub.repositories[slug.lower()] = repository
+            self.reply(200, repository.describe())
+            return
+
+        repository = self.repository(slug)
+        if repository is None:
+            return
+
+        if self.command == 'GET':
+            self.reply(200, repository.describe())
+        elif self.command == 'DELETE':
+            del self.stub.repositories[slug.lower()]
+            self.reply(204)
+        else:
+            self.reply(405)
+
+    def route_pipeline(self, slug):
+        repository = self.repository(slug)
+        if repository is None:
+            return
+
+        if self.command == 'PUT':
+            repository.pipeline = bool(self.payload.get('enabled'))
+
+        self.reply(200, dict(type='repository_pipelines_configuration', enabled=repository.pipeline))
+
+    def variables(self, variables, item):
+        """ CRUD of the variables of a repository or an environment """
+
+        if self.command == 'GET' and not item:
+            self.page([
+                dict((key, value) for key, value in var.items() if not (key == 'value' and var['secured']))
+                for var in variables.values()])
+            return
+
+        if self.command == 'POST' and not item:
+            if any(var['key'] == self.payload.get('key') for var in variables.values()):
+                self.reply(409, dict(type='error', error=dict(message='Variable already exists')))
+                return
+            var_uuid = BitbucketStub.add_variable(
+                variables, self.payload['key'], self.payload.get('value'), self.payload.get('secured', False))
+            self.reply(201, variables[var_uuid])
+            return
+
+        if item not in variables:
+            self.reply(404, dict(type='error', error=dict(message='Variable not found')))
+            return
+
+        if self.command == 'GET':
+            self.reply(200, variables[item])
+        elif self.command == 'PUT':
+            variables[item].update(
+                key=self.payload.get('key', variables[item]['key']),
+                value=self.payload.get('value'),
+                secured=self.payload.get('secured', False))
+            self.reply(200, variables[item])
+        elif self.command == 'DELETE':
+            del variables[item]
+            self.reply(204)
+        else:
+            self.reply(405)
+
+    def route_pipeline_variables(self, slug, item):
+        repository = self.repository(slug)
+        if repository is not None:
+            self.variables(repository.variables, item)
+
+    def route_environment_variables(self, slug, env, item):
+        repository = self.repository(slug)
+        if repository is None:
+            return
+
+        if env not in repository.environments:
+            self.reply(404, dict(type='error', error=dict(message='Environment not found')))
+            return
+
+        self.variables(repository.environments[env]['variables'], item)
+
+    def route_environments(self, slug, item):
+        repository = self.repository(slug)
+        if repository is None:
+            return
+
+        def describe(env_uuid, env):
+            return dict(
+                type='deployment_environment',
+                uuid=env_uuid,
+                name=env['name'],
+                slug=env['name'].lower(),
+                environment_type=dict(type='deployment_environment_type', name=env['type']),
+                lock=dict(type='deployment_environment_lock_open'),
+            )
+
+        if self.command == 'GET' and not item:
+            self.page([describe(env_uuid, env) for env_uuid, env in repository.environments.items()])
+        elif self.command == 'POST' and not item:
+            env_uuid = BitbucketStub.add_environment(
+                repository, self.payload['name'], self.payload['environment_type']['name'])
+            self.reply(201, describe(env_uuid, repository.environments[env_uuid]))
+        elif item not in repository.environments:
+            self.reply(404, dict(type='error', error=dict(message='Environment not found')))
+        elif self.command == 'GET':
+            self.reply(200, describe(item, repository.environments[item]))
+        elif self.command == 'DELETE':
+            del repository.environments[item]
+            self.reply(204)
+        else:
+            self.reply(405)
+
+    def route_permissions(self, slug, scope, item):
+        repository = self.repository(slug)
+        if repository is None:
+            return
+
+        members = repository.groups if scope == 'groups' else repository.users
+
+        def describe(name, permission):
+            if scope == 'groups':
+                member = dict(group=dict(type='group', slug=name, name=name.title()))
+            else:
+                member = dict(user=dict(
+                    type='user', nickname=name, display_name=name.title(),
+                    account_id='557058:{0}'.format(name), uuid='{{{0}}}'.format(uuid.uuid5(uuid.NAMESPACE_DNS, name))))
+            return dict(member, type='repository_{0}_permission'.format(scope[:-1]), permission=permission)
+
+        if scope == 'users' and item:
+            # users are addressed by account ID or UUID
+            for name in members:
+                if item in (describe(name, None)['user']['account_id'], describe(name, None)['user']['uuid']):
+                    item = name
+                    break
+            else:
+                item = item.split(':', 1)[-1]
+
+        if self.command == 'GET' and not item:
+            self.page([describe(name, permission) for name, permission in sorted(members.items())])
+        elif self.command == 'PUT' and item:
+            members[item] = self.payload.get('permission')
+            self.reply(200, describe(item, members[item]))
+        elif item not in members:
+            self.reply(404, dict(type='error', error=dict(message='Permission not found')))
+        elif self.command == 'GET':
+            self.reply(200, describe(item, members[item]))
+        elif self.command == 'DELETE':
+            del members[item]
+            self.reply(204)
+        else:
+            self.reply(405)
+
+def main():
+    """ main function """
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workspace', default='i2b')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    parser.add_argument('--throttle', type=float, default=0.0, help='share of the requests answered with 429')
+    args = parser.parse_args()
+
+    stub = BitbucketStub(args.workspace, args.latency, args.throttle, port=args.port)
+    print('Bitbucket stand-in listening on {0}'.format(stub.url))
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        stub.server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""
+Benchmark of the Bitbucket modules against the local stand-in of the API.
+
+Each module runs in this process, through the same stand-in of AnsibleModule used by the action
+plugins, against `bitbucket_stub.py`. For every size it measures two runs: `apply` starts from an
+empty repository and creates every item, `noop` runs the same task again when nothing changed.
+It reports the requests received by the stand-in, the wall time and the peak memory allocated
+by Python during the run (measured with tracemalloc, which slows the run down; disable it with
+--no-memory to compare wall times).
+
+Run it from the tests folder:
+
+    python benchmarks/modules_benchmark.py
+    python benchmarks/modules_benchmark.py --sizes 10 100 --latency 50 --throttle 0.05
+"""
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import argparse
+import importlib
+import os
+import sys
+import time
+import tracemalloc
+from functools import partial
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'collections'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+#pylint: disable=wrong-import-position
+from bitbucket_stub import BitbucketStub
+from ansible_collections.i2btech.ops.plugins.plugin_utils.bitbucket_action import ControllerModule, ModuleExit
+#pylint: disable=wrong-import-position
+
+MODULES = ['bitbucket_repo_var', 'bitbucket_repo_env', 'bitbucket_repo_perm']
+
+def build_args(module_name, repository, size):
+    """ arguments of a task that manages `size` items, a quarter of the variables are secured """
+
+    variables = [
+        dict(name='VARIABLE_{0}'.format(i), value='value-{0}'.format(i), secured=i % 4 == 0)
+        for i in range(size)]
+
+    if module_name == 'bitbucket_repo_var':
+        return dict(repository=repository, variables=variables)
+
+    if module_name == 'bitbucket_repo_env':
+        return dict(repository=repository, name='Benchmark', type='Test', variables=variables)
+
+    return dict(repository=repository, permissions=[
+        dict(type='group', name='group-{0}'.format(i), perm=('read', 'write', 'admin')[i % 3])
+        for i in range(size)])
+
+def run_module(module_name, args):
+    """ run a module with the given arguments and return its result """
+
+    module = importlib.import_module('ansible_collections.i2btech.ops.plugins.modules.' + module_name)
+
+    try:
+        module.run_module(partial(ControllerModule, module_name, args, False))
+    except ModuleExit as exc:
+        return exc.result
+
+    return {}
+
+def measure(stub, module_name, args, memory):
+    """ requests, wall time in seconds and peak memory in MiB of a module run """
+
+    stub.reset_counters()
+    if memory:
+        tracemalloc.start()
+
+    started = time.time()
+    result = run_module(module_name, args)
+    wall = time.time() - started
+
+    peak = None
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1] / 1024.0 / 1024.0
+        tracemalloc.stop()
+
+    if result.get('failed'):
+        raise RuntimeError('{0} failed: {1}'.format(module_name, result.get('msg')))
+
+    return stub.total_requests(), wall, peak
+
+def main():
+    """ main function """
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--modules', nargs='+', choices=MODULES, default=MODULES)
+    parser.add_argument('--max-concurrency', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.0, help='milliseconds added to every request')
+    parser.add_argument('--throttle', type=float, default=0.0, help='share of the requests answered with 429')
+    parser.add_argument('--no-memory', action='store_true', help="don't measure the peak memory")
+    args = parser.parse_args()
+
+    stub = BitbucketStub(latency=args.latency / 1000.0, throttle=args.throttle).start()
+
+    common = dict(
+        url=stub.url,
+        username='benchmark',
+        password='benchmark',
+        max_concurrency=args.max_concurrency,
+        retries=10,
+        sleep=0,
+        max_retry_delay=0,
+    )
+
+    print('{0:<20} {1:<6} {2:>8} {3:>10} {4:>10} {5:>10}'.format(
+        'module', 'run', 'items', 'requests', 'wall (s)', 'peak (MiB)'))
+
+    for module_name in args.modules:
+        for size in args.sizes:
+            repository = '{0}-{1}'.format(module_name.replace('_', '-'), size)
+            stub.add_repository(repository)
+            task_args = dict(common, **build_args(module_name, repository, size))
+
+            for run in ('apply', 'noop'):
+                requests, wall, peak = measure(stub, module_name, dict(task_args), not args.no_memory)
+                print('{0:<20} {1:<6} {2:>8} {3:>10} {4:>10.2f} {5:>10}'.format(
+                    module_name, run, size, requests, wall, '-' if peak is None else '{0:.1f}'.format(peak)))
+
+    stub.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark of the reconciliation core used by the Bitbucket modules.
+
+It compares `plan_variables` against the nested loops the modules used before, both sides
+hold the same number of variables with a mix of unchanged, updated, new and removed ones.
+The time per item of `plan_variables` stays flat as the number of items grows.
+
+Run it from the tests folder:
+
+    python benchmarks/reconcile_benchmark.py
+"""
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'collections'))
+
+#pylint: disable=wrong-import-position
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_reconcile import plan_variables
+#pylint: disable=wrong-import-position
+
+def build_items(size):
+    """ desired and current variables, a quarter of them changes on each side """
+
+    desired = []
+    current = []
+    for i in range(size):
+        if i % 4 != 0:
+            desired.append(dict(name='VARIABLE_{0}'.format(i), value='value-{0}'.format(i), secured=False))
+        if i % 4 != 1:
+            current.append(dict(
+                key='variable_{0}'.format(i),
+                uuid='{{{0}}}'.format(i),
+                value='value-{0}'.format(i if i % 4 != 2 else -i),
+                secured=i % 8 == 3))
+
+    return desired, current
+
+def legacy_plan(desired, current):
+    """ nested loops used by the modules before the reconciliation core """
+
+    changes = []
+    for i in desired:
+        var_exists = False
+        var_value = None
+        for x in current:
+            if i['name'].lower() == x['key'].lower():
+                var_exists = True
+                if not x['secured']:
+                    var_value = x['value']
+                break
+        if var_exists:
+            if var_value is None or i['value'] != var_value:
+                changes.append('update')
+        else:
+            changes.append('create')
+
+    for i in current:
+        if not any(i['key'].lower() == x['name'].lower() for x in desired):
+            changes.append('delete')
+
+    return changes
+
+def measure(function, desired, current, repeat):
+    """ best time of a run in seconds """
+
+    return min(timeit.repeat(lambda: function(desired, current), number=1, repeat=repeat))
+
+def main():
+    """ main function """
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 5000, 10000])
+    parser.add_argument('--legacy-max', type=int, default=2000,
+                        help='biggest size measured with the nested loops, they are quadratic')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print('{0:>8} {1:>12} {2:>14} {3:>12} {4:>14}'.format(
+        'items', 'plan (ms)', 'plan (us/item)', 'legacy (ms)', 'legacy (us/item)'))
+
+    per_item = []
+    for size in args.sizes:
+        desired, current = build_items(size)
+        plan_time = measure(plan_variables, desired, current, args.repeat)
+        per_item.append(plan_time / size)
+
+        legacy = ''
+        legacy_per_item = ''
+        if size <= args.legacy_max:
+            legacy_time = measure(legacy_plan, desired, current, 1)
+            legacy = '{0:.2f}'.format(legacy_time * 1000)
+            legacy_per_item = '{0:.3f}'.format(legacy_time / size * 1000000)
+
+        print('{0:>8} {1:>12.2f} {2:>14.3f} {3:>12} {4:>14}'.format(
+            size, plan_time * 1000, plan_time / size * 1000000, legacy, legacy_per_item))
+
+    print('growth of the time per item of plan from {0} to {1} items: x{2:.2f}'.format(
+        args.sizes[0], args.sizes[-1], per_item[-1] / per_item[0]))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""
+Benchmark of the workspace scan done by the bitbucket_workspace inventory plugin.
+
+It reads every repository of a workspace held by `bitbucket_stub.py` twice: with `build_snapshot`,
+which reads `max_concurrency` repositories at a time from a pool of threads, and with `scan_workspace`,
+which keeps up to `max_concurrency` requests in flight from one thread with the asyncio client.
+Every repository has variables, two deployment environments with variables and group permissions.
+It reports the requests received by the stand-in and the wall time, and checks both scans read the same entries.
+
+Run it from the tests folder:
+
+    python benchmarks/snapshot_benchmark.py
+    python benchmarks/snapshot_benchmark.py --sizes 100 1000 --latency 50 --max-concurrency 50
+"""
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'collections'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+#pylint: disable=wrong-import-position
+from bitbucket_stub import BitbucketStub
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket import BitbucketHelper
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_async import scan_workspace
+from ansible_collections.i2btech.ops.plugins.module_utils.bitbucket_snapshot import build_snapshot
+from ansible_collections.i2btech.ops.plugins.plugin_utils.bitbucket_action import ControllerModule
+#pylint: disable=wrong-import-position
+
+SCANS = dict(threads=build_snapshot, asyncio=scan_workspace)
+
+def fill_workspace(stub, size):
+    """ add `size` repositories to the stand-in """
+
+    for i in range(size):
+        repository = stub.add_repository('snapshot-{0}'.format(i))
+        for j in range(5):
+            stub.add_variable(repository.variables, 'VARIABLE_{0}'.format(j), 'value-{0}'.format(j), secured=j == 0)
+        for name, environment_type in (('Test', 'Test'), ('Production', 'Production')):
+            env_uuid = stub.add_environment(repository, name, environment_type)
+            stub.add_variable(repository.environments[env_uuid]['variables'], 'DEPLOY_TARGET', name.lower())
+        repository.groups['developers'] = 'write'
+
+def measure(stub, scan, options):
+    """ entries, requests and wall time in seconds of a scan of the workspace """
+
+    snapshot_path = tempfile.mkdtemp()
+    try:
+        module = ControllerModule(
+            'bitbucket_workspace', dict(options, snapshot_path=snapshot_path), False, BitbucketHelper.bitbucket_argument_spec())
+        bitbucket = BitbucketHelper(module)
+
+        stub.reset_counters()
+        started = time.time()
+        entries = scan(bitbucket, bitbucket.snapshot)
+        wall = time.time() - started
+    finally:
+        shutil.rmtree(snapshot_path)
+
+    return entries, stub.total_requests(), wall
+
+def main():
+    """ main function """
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 500])
+    parser.add_argument('--max-concurrency', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=20.0, help='milliseconds added to every request')
+    parser.add_argument('--throttle', type=float, default=0.0, help='share of the requests answered with 429')
+    args = parser.parse_args()
+
+    options = dict(
+        username='benchmark',
+        password='benchmark',
+        max_concurrency=args.max_concurrency,
+        retries=10,
+        sleep=0,
+        max_retry_delay=0,
+    )
+
+    print('{0:<8} {1:>8} {2:>10} {3:>10}'.format('scan', 'repos', 'requests', 'wall (s)'))
+
+    for size in args.sizes:
+        stub = BitbucketStub(latency=args.latency / 1000.0, throttle=args.throttle).start()
+        fill_workspace(stub, size)
+        options['url'] = stub.url
+
+        results = []
+        for name, scan in SCANS.items():
+            entries, requests, wall = measure(stub, scan, options)
+            results.append(entries)
+            print('{0:<8} {1:>8} {2:>10} {3:>10.2f}'.format(name, len(entries), requests, wall))
+
+        if results[0] != results[1]:
+            raise RuntimeError('the scans of {0} repositories read different entries'.format(size))
+
+        stub.stop()
+
+if __name__ == '__main__':
+    main()